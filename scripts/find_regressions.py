@@ -0,0 +1,141 @@
+#!/bin/env python
+#
+# Look through the history `run_test_continuous.py` writes for tests (and swarm profiles) that
+# have got slower.
+#
+#   find_regressions.py history.csv [--window 20] [--recent 3] [--threshold 4] [--min-change 0.1]
+#
+# Every timing column of every test is a series. The last `--recent` values of a series are
+# compared with the `--window` values before them: it has regressed if their median is more
+# than `--threshold` robust standard deviations (1.4826 * the median absolute deviation) above
+# the median of the baseline, and at least `--min-change` (as a fraction) above it. Taking the
+# median of a few recent runs means one slow run on a noisy cluster does not count, but a step
+# change does as soon as it has lasted that long.
+#
+# The CSV is read a row at a time and only the last window+recent values of each series are
+# kept, so a history that has been running for months is fine.
+#
+# The exit code is 1 if anything regressed, so a nightly job can fail on it.
+#
+import argparse
+import csv
+import os
+import statistics
+import sys
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tests.servicex_timing import phase_columns  # noqa: E402
+
+# The columns where bigger is worse (mostly timings), and those where smaller is worse.
+rate_columns = ['Jobs Per Second', 'Min Queue Consumers']
+timing_columns = ['Setup Time', 'Run Time'] + [c for c in phase_columns if c not in ['Download Bytes'] + rate_columns] \
+    + ['Latency p50', 'Latency p90', 'Latency p99', 'Latency Max']
+
+# Converts a median absolute deviation into something comparable to a standard deviation.
+mad_scale = 1.4826
+
+Series = Tuple[str, str]
+
+
+def _value(row: Dict[str, str], column: str) -> Optional[float]:
+    v = row.get(column)
+    if v is None or v == '':
+        return None
+    try:
+        return float(v)
+    except ValueError:
+        return None
+
+
+def load_history(history_csv: str, keep: int) -> Dict[Series, Deque[Tuple[str, float]]]:
+    '''
+    The last `keep` (time, value) points of every (test, column) series, from the runs that
+    worked. Old logs that have no Status column count every row as good.
+    '''
+    series = {}
+    with open(history_csv, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get('Status') not in (None, '', 'ok'):
+                continue
+            test_name = row.get('Test Name')
+            if not test_name:
+                continue
+            for column in timing_columns + rate_columns:
+                v = _value(row, column)
+                if v is None:
+                    continue
+                key = (test_name, column)
+                if key not in series:
+                    series[key] = deque(maxlen=keep)
+                series[key].append((row.get('Time', ''), v))
+    return series
+
+
+def check_series(values: List[float], window: int, recent: int, threshold: float, min_change: float,
+                 smaller_is_worse: bool = False) -> Optional[Dict]:
+    '''
+    Compare the last `recent` values with the (up to) `window` before them. Returns a
+    description of the regression, or None if there isn't one (or not enough history to tell).
+    '''
+    if len(values) < recent + 3:
+        return None
+    baseline = values[:-recent][-window:]
+    latest = values[-recent:]
+    if smaller_is_worse:
+        baseline = [-v for v in baseline]
+        latest = [-v for v in latest]
+
+    base_median = statistics.median(baseline)
+    spread = mad_scale * statistics.median([abs(v - base_median) for v in baseline])
+    latest_median = statistics.median(latest)
+    change = latest_median - base_median
+    relative = change / abs(base_median) if base_median != 0 else float('inf')
+    # A perfectly steady baseline has no spread, so only the relative change counts.
+    score = change / spread if spread > 0 else float('inf') if change > 0 else 0.0
+    if score <= threshold or relative < min_change:
+        return None
+
+    sign = -1 if smaller_is_worse else 1
+    return {'baseline': sign * base_median, 'latest': sign * latest_median, 'change': relative,
+            'score': score, 'n_baseline': len(baseline)}
+
+
+def find_regressions(history_csv: str, window: int = 20, recent: int = 3, threshold: float = 4.0,
+                     min_change: float = 0.1) -> List[Dict]:
+    'All the series in the history that have regressed'
+    found = []
+    for (test_name, column), points in sorted(load_history(history_csv, window + recent).items()):
+        r = check_series([v for _, v in points], window, recent, threshold, min_change,
+                         smaller_is_worse=column in rate_columns)
+        if r is not None:
+            r.update({'test': test_name, 'column': column, 'since': points[-recent][0]})
+            found.append(r)
+    return found
+
+
+def print_regressions(regressions: List[Dict]):
+    if len(regressions) == 0:
+        print('No regressions found.')
+        return
+    print(f'{len(regressions)} regression(s) found:')
+    for r in regressions:
+        print(f"  {r['test']} {r['column']}: {r['baseline']:.3g} -> {r['latest']:.3g} "
+              f"({r['change']:+.0%}, {r['score']:.1f} sigma over {r['n_baseline']} runs, since {r['since']})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find tests whose timings have regressed in a run_test_continuous.py history.')
+    parser.add_argument('history_csv')
+    parser.add_argument('--window', type=int, default=20, help='How many runs before the recent ones make up the baseline.')
+    parser.add_argument('--recent', type=int, default=3, help='How many of the latest runs have to be slow.')
+    parser.add_argument('--threshold', type=float, default=4.0, help='How many robust standard deviations counts as slower.')
+    parser.add_argument('--min-change', type=float, default=0.1, help='The smallest relative slowdown that counts.')
+    args = parser.parse_args()
+    if args.window < 3 or args.recent < 1:
+        parser.error('--window must be at least 3 and --recent at least 1')
+
+    regressions = find_regressions(args.history_csv, args.window, args.recent, args.threshold, args.min_change)
+    print_regressions(regressions)
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,134 @@
+#!/bin/env python
+#
+# Run the same selection with each result format and compare them end to end, to pick the
+# format the tests (and production) should default to.
+#
+#   format_benchmark.py [--formats root-file,parquet] [--repeats 1] [--as-data-type pandas] [--fake] [--json out.json]
+#
+# Each format is run in its own python process, so the peak memory it reports belongs to that
+# format alone. For each one it reports:
+#
+# - the transform time (submit until the backend says it is done);
+# - the bytes of result files transferred and how long the download took;
+# - the decode time and throughput (MB and rows per second of decode);
+# - the peak resident memory of the process.
+#
+# The results are never taken from, or written to, the local result cache - each object is
+# decoded from memory as it is downloaded (SERVICEX_DECODE_MODE permitting). By default the
+# request goes to the backend the tests use (started through the backend broker if it is not
+# running); --servicex points it somewhere else, and --fake uses the fake backend in
+# tests/fake_backend.py, which only measures the client side (download, decode and merge).
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# The simple jets query from tests/test_func_adl_queries.py - the result format is filled in.
+default_request = {
+    "did": "mc15_13TeV:mc15_13TeV.361106.PowhegPythia8EvtGen_AZNLOCTEQ6L1_Zee.merge.DAOD_STDM3.e3601_s2576_s2132_r6630_r6264_p2363_tid05630052_00",
+    "selection": "(call ResultTTree (call Select (call SelectMany (call EventDataset (list 'localds:bogus')) (lambda (list e) (call (attr e 'Jets') 'AntiKt4EMTopoJets'))) (lambda (list j) (/ (call (attr j 'pt')) 1000.0))) (list 'JetPt') 'analysis' 'junk.root')",
+    "image": "sslhep/servicex_func_adl_xaod_transformer:v0.4",
+    "result-destination": "object-store",
+    "chunk-size": 1000,
+    "workers": 5
+}
+
+
+def run_format(result_format: str, request_json: dict, as_data_type: str, servicex: str = None, fake: bool = False) -> Dict:
+    'Run the request with one result format (in this process) and measure it'
+    import tests.servicex_test_utils as utils
+    from tests.fake_backend import fake_servicex
+    from tests.result_merge import n_rows
+    from tests.servicex_timing import recorded, summarise_phases
+
+    request_json = dict(request_json, **{'result-format': result_format})
+
+    def fetch(address):
+        start = time.time()
+        table = utils.get_servicex_data(address, request_json, as_data_type=as_data_type,
+                                        ignore_cache=True, store_in_cache=False)
+        return time.time() - start, n_rows(table)
+
+    if fake:
+        with fake_servicex(n_files=20, rows_per_file=50000) as backend:
+            wall, rows = fetch(backend.servicex_address)
+    elif servicex is not None:
+        wall, rows = fetch(servicex)
+    else:
+        from tests.backend_broker import ensure_broker
+        endpoints = ensure_broker('servicex-integrated-testing')
+        utils.default_minio_endpoint = endpoints['minio']
+        wall, rows = fetch(endpoints['servicex'])
+
+    phases = summarise_phases(recorded())
+    n_bytes = phases['Download Bytes'] or 0
+    decode = phases['Decode Time'] or 0.0
+    return {'format': result_format,
+            'rows': rows,
+            'wall_seconds': wall,
+            'transform_seconds': phases['Transform Time'],
+            'bytes': n_bytes,
+            'download_seconds': phases['Download Time'],
+            'decode_seconds': decode,
+            'decode_mb_per_second': n_bytes / 1024 ** 2 / decode if decode > 0 else None,
+            'decode_rows_per_second': rows / decode if decode > 0 else None,
+            'merge_seconds': phases['Merge Time'],
+            'peak_rss_mb': utils.peak_rss_mb()}
+
+
+def run_format_process(result_format: str, args) -> Dict:
+    'Run one format in a fresh python process and get its measurements back'
+    cmd = [sys.executable, os.path.abspath(__file__), '--worker', result_format,
+           '--as-data-type', args.as_data_type, '--request', json.dumps(args.request)]
+    if args.servicex is not None:
+        cmd += ['--servicex', args.servicex]
+    if args.fake:
+        cmd += ['--fake']
+    result = subprocess.run(cmd, stdout=subprocess.PIPE)
+    if result.returncode != 0:
+        raise BaseException(f'The {result_format} run failed (exit code {result.returncode}).')
+    # The measurements are the last line - everything before it is the test utilities chatting.
+    return json.loads(result.stdout.decode('utf-8').strip().splitlines()[-1])
+
+
+def _fmt(v, spec: str) -> str:
+    return '-' if v is None else format(v, spec)
+
+
+def print_results(results: List[Dict]):
+    print(f"{'Format':<10} {'Rows':>10} {'Transform s':>12} {'MB':>9} {'Download s':>11} {'Decode s':>9} "
+          f"{'Decode MB/s':>12} {'Decode rows/s':>14} {'Peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['format']:<10} {r['rows']:>10} {_fmt(r['transform_seconds'], '12.1f')} {r['bytes'] / 1024 ** 2:>9.1f} "
+              f"{_fmt(r['download_seconds'], '11.2f')} {r['decode_seconds']:>9.2f} {_fmt(r['decode_mb_per_second'], '12.1f')} "
+              f"{_fmt(r['decode_rows_per_second'], '14.0f')} {_fmt(r['peak_rss_mb'], '12.0f')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the result formats end to end on the same selection.')
+    parser.add_argument('--formats', default='root-file,parquet', help='Comma separated result formats to compare.')
+    parser.add_argument('--repeats', type=int, default=1, help='How many times to run each format.')
+    parser.add_argument('--as-data-type', default='pandas', choices=['pandas', 'awkward'])
+    parser.add_argument('--request', type=json.loads, default=default_request,
+                        help='The transform request to run, as json (the result-format is filled in).')
+    parser.add_argument('--servicex', default=None, help='ServiceX address to use instead of the one the tests use.')
+    parser.add_argument('--fake', action='store_true', help='Use the fake backend (measures the client side only).')
+    parser.add_argument('--json', default=None, help='Also write the results to this file.')
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_format(args.worker, args.request, args.as_data_type, args.servicex, args.fake)))
+        sys.exit(0)
+
+    results = [run_format_process(f, args) for _ in range(args.repeats) for f in args.formats.split(',')]
+    print_results(results)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
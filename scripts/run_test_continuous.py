@@ -1,31 +1,121 @@
 #!/bin/env python
 #
-# Run a test continously, updating an output file with timeing tests
+# Run a matrix of tests (and swarm load profiles) continously, updating an output file with
+# timeing tests.
 #
+#   run_test_continuous.py history.csv [--config matrix.json] [--once]
+#
+# The matrix config is a JSON file like:
+#
+#   {
+#     "interval_seconds": 3600,
+#     "retries": 3,
+#     "retry_backoff_seconds": 60,
+#     "output_dir": "continuous-runs",
+#     "tests": ["test_func_adl_query_electrons_and_muons", "test_func_adl_query_simple"],
+#     "swarm": [
+#       {"name": "herd-20", "args": ["swarm", "20", "--mode", "async"]},
+#       {"name": "ramp", "args": ["swarm", "60", "--profile", "ramp", "--rate", "0.2", "--end-rate", "2"]}
+#     ]
+#   }
+#
+# Each entry of `tests` is a pytest `-k` expression; every test it selects gets its own row.
+# Each `swarm` entry is run as `servicex_swarm.py <args> --report-json ...` and gets one row.
+#
+# Runs happen once per interval, and every row carries a run id made from the start of its
+# interval and the matrix entry. If the script is restarted in the same interval it skips the
+# entries that already have rows, so it can be killed and started again without duplicates.
+#
+import argparse
+import csv
+import json
+import os
+import subprocess
 import sys
-from typing import List
+import time
 import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional
 from xml.etree.ElementTree import Element
-import os
-import time
 
-def run_test() -> Element:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tests.servicex_timing import phase_columns, read_timing_log, summarise_phases  # noqa: E402
+
+swarm_columns = ['Jobs', 'Jobs OK', 'Jobs Per Second', 'Latency p50', 'Latency p90', 'Latency p99', 'Latency Max']
+csv_columns = ['Run Id', 'Time', 'Test Name', 'Status', 'Setup Time', 'Run Time'] + phase_columns + swarm_columns
+
+swarm_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'servicex_swarm.py')
+
+# What runs if no config is given: the one test this script always used to run, once an hour.
+default_config = {
+    'interval_seconds': 60 * 60,
+    'retries': 3,
+    'retry_backoff_seconds': 60,
+    'max_backoff_seconds': 30 * 60,
+    'output_dir': 'continuous-runs',
+    'tests': ['test_func_adl_query_electrons_and_muons'],
+    'swarm': [],
+    'swarm_command': [sys.executable, swarm_script],
+}
+
+
+def load_config(config_file: Optional[str]) -> dict:
+    config = dict(default_config)
+    if config_file is not None:
+        with open(config_file, 'r') as f:
+            config.update(json.load(f))
+    return config
+
+
+def entry_name(test_expression: str) -> str:
+    'Something safe to put in a file name'
+    return ''.join(c if c.isalnum() or c in '-_' else '_' for c in test_expression)
+
+
+def run_id_for(interval_start: float, name: str) -> str:
+    return f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(interval_start))}-{name}"
+
+
+def with_retries(attempt_fn, retries: int, backoff: float, max_backoff: float) -> bool:
     '''
-    Runs the test and returns the contents of the pytest output
+    Call attempt_fn until it returns True, at most retries+1 times, waiting twice as long
+    after each failure. Returns whether it ever worked.
     '''
-    r = 10
-    while r != 0:
-        r = os.system('pytest -k test_func_adl_query_electrons_and_muons --durations=0 --junitxml stuff.xml')
-        if r != 0:
-            print ("Error running!")
-    return ET.parse('stuff.xml').getroot()
-
-def run_and_log_test(output_csv_log: str) -> None:
+    for attempt in range(retries + 1):
+        if attempt_fn():
+            return True
+        if attempt < retries:
+            wait = min(backoff * 2 ** attempt, max_backoff)
+            print(f'Attempt {attempt + 1} failed. Retrying in {wait:.0f} seconds.')
+            time.sleep(wait)
+    return False
+
+
+def run_test(test_expression: str, junit_file: str, timing_log: str, config: dict) -> Optional[Element]:
     '''
-    Run a test, and log its output.
+    Runs the tests and returns the contents of the pytest output, or None if pytest never
+    managed to run them. The per-phase timing records the test utilities make are written to
+    `timing_log`.
     '''
-    test_log_file = run_test()
-    testsuites = test_log_file.findall('testsuite')
+    env = dict(os.environ, SERVICEX_TIMING_LOG=os.path.abspath(timing_log))
+
+    def attempt() -> bool:
+        for f_name in [junit_file, timing_log]:
+            if os.path.exists(f_name):
+                os.remove(f_name)
+        r = subprocess.run([sys.executable, '-m', 'pytest', '-k', test_expression, '--durations=0', '--junitxml', junit_file], env=env)
+        if r.returncode != 0:
+            print(f'Error running {test_expression}!')
+        return r.returncode == 0
+
+    with_retries(attempt, config['retries'], config['retry_backoff_seconds'], config['max_backoff_seconds'])
+    if not os.path.exists(junit_file):
+        return None
+    return ET.parse(junit_file).getroot()
+
+
+def test_rows(run_id: str, test_log: Element, timing_log: str) -> List[Dict]:
+    'One row per test case in the pytest output'
+    testsuites = test_log.findall('testsuite') if test_log.tag == 'testsuites' else [test_log]
     assert len(testsuites) == 1
     testsuite = testsuites[0]
     timestamp = testsuite.get('timestamp').replace('T', ' ')
@@ -35,30 +125,171 @@ def run_and_log_test(output_csv_log: str) -> None:
     total_time = float(total_time_s)
 
     testcases = testsuite.findall('testcase')
-    assert len(testcases) == 1
-    testcase = testcases[0]
-    test_name = testcase.get('name')
-    test_time_s = testcase.get('time')
-    assert test_time_s is not None
-    test_time = float(test_time_s)
+    if len(testcases) == 0:
+        return [{'Run Id': run_id, 'Time': timestamp, 'Test Name': None, 'Status': 'no tests'}]
+    # The session setup (cluster, port forwards) is shared by all the tests run together.
+    setup_time = total_time - sum(float(tc.get('time', '0')) for tc in testcases)
+    timings = read_timing_log(timing_log)
+
+    rows = []
+    for testcase in testcases:
+        test_name = testcase.get('name')
+        test_time_s = testcase.get('time')
+        assert test_time_s is not None
+        if testcase.find('skipped') is not None:
+            status = 'skipped'
+        elif testcase.find('failure') is not None or testcase.find('error') is not None:
+            status = 'failed'
+        else:
+            status = 'ok'
+        row = {'Run Id': run_id, 'Time': timestamp, 'Test Name': test_name, 'Status': status,
+               'Setup Time': setup_time, 'Run Time': float(test_time_s)}
+        row.update(summarise_phases(timings, label=test_name))
+        rows.append(row)
+    return rows
+
+
+def run_and_log_test(output_csv_log: str, test_expression: str, run_id: str, config: dict) -> None:
+    '''
+    Run a test, and log its output. If a previous attempt at this run got as far as writing
+    the pytest output, that is logged rather than running the tests again.
+    '''
+    junit_file = os.path.join(config['output_dir'], f'{run_id}.xml')
+    timing_log = os.path.join(config['output_dir'], f'{run_id}-timing.jsonl')
+    test_log = None
+    if os.path.exists(junit_file):
+        try:
+            test_log = ET.parse(junit_file).getroot()
+        except ET.ParseError:
+            pass
+    if test_log is None:
+        test_log = run_test(test_expression, junit_file, timing_log, config)
+
+    if test_log is None:
+        rows = [{'Run Id': run_id, 'Time': time.strftime('%Y-%m-%d %H:%M:%S'), 'Test Name': test_expression,
+                 'Status': 'error'}]
+    else:
+        rows = test_rows(run_id, test_log, timing_log)
+    write_rows(output_csv_log, rows)
+
+
+def run_and_log_swarm(output_csv_log: str, swarm: dict, run_id: str, config: dict) -> None:
+    'Run a swarm load profile, and log its throughput and latency'
+    report_file = os.path.join(config['output_dir'], f'{run_id}.json')
+    started = time.time()
+
+    def attempt() -> bool:
+        if os.path.exists(report_file):
+            os.remove(report_file)
+        r = subprocess.run(config['swarm_command'] + swarm['args'] + ['--report-json', report_file])
+        # Jobs that fail or time out are part of the measurement - only a swarm that did not
+        # get as far as its report is run again.
+        if not os.path.exists(report_file):
+            print(f"Swarm {swarm['name']} did not finish (exit code {r.returncode})!")
+            return False
+        return True
+
+    if not os.path.exists(report_file):
+        with_retries(attempt, config['retries'], config['retry_backoff_seconds'], config['max_backoff_seconds'])
+
+    row = {'Run Id': run_id, 'Time': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)),
+           'Test Name': f"swarm:{swarm['name']}", 'Status': 'error'}
+    if os.path.exists(report_file):
+        with open(report_file, 'r') as f:
+            summary = json.load(f)['summary']
+        latency = summary['latency']['query_seconds'] or {}
+        row.update({'Status': 'ok' if summary['ok'] == summary['jobs'] else 'failed',
+                    'Run Time': summary['seconds_since_release'],
+                    'Jobs': summary['jobs'], 'Jobs OK': summary['ok'],
+                    'Jobs Per Second': summary['jobs_per_second'],
+                    'Latency p50': latency.get('p50'), 'Latency p90': latency.get('p90'),
+                    'Latency p99': latency.get('p99'), 'Latency Max': latency.get('max')})
+    write_rows(output_csv_log, [row])
 
-    setup_time = total_time - test_time
 
-    # write the log line out
+def csv_header(output_csv_log: str) -> List[str]:
+    '''
+    The columns of the log, creating it if need be. A log started before the run id and the
+    other current columns were added is rewritten once with them added (old rows leave them
+    blank), so resuming can tell which runs it already has.
+    '''
     if not os.path.exists(output_csv_log):
         with open(output_csv_log, 'a') as f:
-            f.write('Time,Test Name,Setup Time,Run Time\n')
-    with open(output_csv_log, 'a') as f:
-        f.write(f'{timestamp},{test_name},{setup_time},{test_time}\n')
+            f.write(','.join(csv_columns) + '\n')
+        return csv_columns
+    with open(output_csv_log, 'r', newline='') as f:
+        columns = next(csv.reader(f))
+    missing = [c for c in csv_columns if c not in columns]
+    if not missing:
+        return columns
+
+    columns = csv_columns + [c for c in columns if c not in csv_columns]
+    tmp = f'{output_csv_log}.tmp'
+    with open(output_csv_log, 'r', newline='') as f_in, open(tmp, 'w', newline='') as f_out:
+        writer = csv.DictWriter(f_out, fieldnames=columns, lineterminator='\n')
+        writer.writeheader()
+        for row in csv.DictReader(f_in):
+            writer.writerow(row)
+    os.replace(tmp, output_csv_log)
+    return columns
+
+
+def write_rows(output_csv_log: str, rows: List[Dict]) -> None:
+    'Append the rows to the log, in one go so a crash cannot leave half a run behind'
+    columns = csv_header(output_csv_log)
+    with open(output_csv_log, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore', lineterminator='\n')
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+
 
-def monitor_test_performance(output_csv_log: str) -> None:
+def logged_run_ids(output_csv_log: str) -> set:
+    'The runs that already have rows in the log'
+    if not os.path.exists(output_csv_log):
+        return set()
+    with open(output_csv_log, 'r', newline='') as f:
+        return {row.get('Run Id') for row in csv.DictReader(f) if row.get('Run Id')}
+
+
+def run_matrix(output_csv_log: str, config: dict, interval_start: float) -> None:
+    'Run every entry of the matrix that has not already been logged for this interval'
+    os.makedirs(config['output_dir'], exist_ok=True)
+    done = logged_run_ids(output_csv_log)
+    for test_expression in config['tests']:
+        run_id = run_id_for(interval_start, entry_name(test_expression))
+        if run_id in done:
+            print(f'{run_id} is already logged.')
+            continue
+        print(f'Running {run_id}')
+        run_and_log_test(output_csv_log, test_expression, run_id, config)
+    for swarm in config['swarm']:
+        run_id = run_id_for(interval_start, f"swarm-{entry_name(swarm['name'])}")
+        if run_id in done:
+            print(f'{run_id} is already logged.')
+            continue
+        print(f'Running {run_id}')
+        run_and_log_swarm(output_csv_log, swarm, run_id, config)
+
+
+def monitor_test_performance(output_csv_log: str, config: dict, once: bool = False) -> None:
     '''
-    Run the test and log the results to an output file
+    Run the matrix once per interval and log the results to an output file
     '''
+    interval = config['interval_seconds']
     while True:
-        run_and_log_test(output_csv_log)
-        time.sleep(60*60)
+        interval_start = (time.time() // interval) * interval
+        run_matrix(output_csv_log, config, interval_start)
+        if once:
+            return
+        next_start = interval_start + interval
+        time.sleep(max(0.0, next_start - time.time()))
+
 
 if __name__ == '__main__':
-    assert len(sys.argv) == 2
-    monitor_test_performance(sys.argv[1])
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Run the tests (and swarm profiles) over and over, logging their timings.')
+    parser.add_argument('output_csv_log')
+    parser.add_argument('--config', help='JSON file with the matrix of tests and swarm profiles to run.')
+    parser.add_argument('--once', action='store_true', help='Run the matrix for the current interval and stop.')
+    args = parser.parse_args()
+    monitor_test_performance(args.output_csv_log, load_config(args.config), args.once)
@@ -6,6 +6,8 @@
 #   "servicex",
 #   "func_adl_servicex_xaodr25",
 #   "servicex_analysis_utils",
+#   "awkward>=2",
+#   "numpy",
 #   "jinja2",
 # ]
 # ///
@@ -13,61 +15,270 @@
 from __future__ import annotations
 
 import asyncio
+import csv
+import importlib
 import inspect
+import itertools
+import json
+import math
 import os
+import random
+import select
+import selectors
 import signal
 import subprocess
 import sys
 import tempfile
 import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, Callable, Iterator, NamedTuple
 
 import typer
-from func_adl_servicex_xaodr25 import FuncADLQueryPHYSLITE
-from servicex import Sample, ServiceXSpec, dataset, deliver
-from servicex.servicex_client import ProgressBarFormat
-from servicex_analysis_utils import to_awk
 
-try:
-    from servicex import deliver_async as sx_deliver_async
-except ImportError:
-    sx_deliver_async = None
+if TYPE_CHECKING:
+    import awkward as ak
+    from servicex import ServiceXSpec
+
+# The modules a job needs. They take seconds to import, so they are only imported once there
+# is a job to run - `--help`, the swarm parent in process mode and the reports never pay for
+# them - and a worker imports them before it says it is ready (see `import_job_modules`).
+JOB_MODULES = [
+    "numpy",
+    "awkward",
+    "servicex",
+    "func_adl_servicex_xaodr25",
+    "servicex_analysis_utils",
+]
+# What builds the func_adl query - a job that loads a spec the swarm built does not need it.
+QUERY_BUILD_MODULE = "func_adl_servicex_xaodr25"
 
 DATASET_DID = "user.zmarshal:user.zmarshal.364702_OpenData_v1_p6026_2024-04-23"
 SAMPLE_NAME = "jet_pt_fetch"
 QUERY_TIMEOUT_SECONDS = 600
+# Prefix of the line a `fetch` child prints its timings on, for the swarm to pick up.
+TIMINGS_PREFIX = "swarm-timings: "
+# What a child prints once it is waiting for the release signal.
+READY_LINE = "swarm-ready"
+# Per-job timings (seconds) that the swarm report summarises. import and ready are the
+# worker's: how long it spent importing the job modules, and from being started to waiting
+# for the release signal.
+TIMING_METRICS = [
+    "import_seconds",
+    "ready_seconds",
+    "release_seconds",
+    "build_seconds",
+    "submit_seconds",
+    "first_file_seconds",
+    "query_seconds",
+    "summary_seconds",
+]
+# Range (GeV) and number of bins of the jet pT histogram the `stats` summary makes.
+JET_PT_RANGE = (0.0, 500.0)
+JET_PT_N_BINS = 50
 
 app = typer.Typer(add_completion=False, help="ServiceX fetch and swarm stress tool.")
 
 
-def build_query() -> Any:
+# What the query reads at each complexity level. Every level keeps the jet pT of level 1.
+QUERY_COMPLEXITY = {
+    1: "jet pT",
+    2: "jet pT, eta and phi",
+    3: "jet, electron and muon pT and eta",
+    4: "jet, electron and muon pT and eta, and missing ET",
+}
+
+
+# ServiceX will not take two identical samples in one spec. Every sample after the first reads
+# its events through a filter that keeps them all (no run number is this big) but makes its
+# query different.
+UNUSED_RUN_NUMBER = 1_000_000_000
+
+
+# How long this process spent importing the job modules the first time.
+_import_seconds: float | None = None
+
+
+def import_job_modules(modules: list[str] = JOB_MODULES) -> float:
+    """
+    Import everything a job needs, and return how long it took. Modules are only imported
+    once per process, so after the first call this costs (next to) nothing.
+    """
+    global _import_seconds
+    start = time.perf_counter()
+    for name in modules:
+        importlib.import_module(name)
+    elapsed = time.perf_counter() - start
+    if _import_seconds is None:
+        _import_seconds = elapsed
+    return elapsed
+
+
+def servicex_deliver_async() -> Callable[..., Any] | None:
+    """`servicex.deliver_async`, or None for a servicex that does not have it."""
+    try:
+        from servicex import deliver_async
+    except ImportError:
+        return None
+    return deliver_async
+
+
+def event_source(sample: int = 0) -> Any:
+    from func_adl_servicex_xaodr25 import FuncADLQueryPHYSLITE
+
+    events = FuncADLQueryPHYSLITE()
+    if sample == 0:
+        return events
+    return events.Where(
+        lambda evt: evt.EventInfo("EventInfo").runNumber() != UNUSED_RUN_NUMBER + sample
+    )
+
+
+def build_query(complexity: int = 1, sample: int = 0) -> Any:
+    if complexity == 1:
+        return (
+            event_source(sample)
+            .Select(lambda evt: {"jets": evt.Jets()})
+            .Select(
+                lambda collections: {
+                    "jet_pt": collections.jets.Select(lambda jet: jet.pt() / 1000.0)
+                }
+            )
+        )
+    if complexity == 2:
+        return (
+            event_source(sample)
+            .Select(lambda evt: {"jets": evt.Jets()})
+            .Select(
+                lambda collections: {
+                    "jet_pt": collections.jets.Select(lambda jet: jet.pt() / 1000.0),
+                    "jet_eta": collections.jets.Select(lambda jet: jet.eta()),
+                    "jet_phi": collections.jets.Select(lambda jet: jet.phi()),
+                }
+            )
+        )
+    if complexity == 3:
+        return (
+            event_source(sample)
+            .Select(
+                lambda evt: {
+                    "jets": evt.Jets(),
+                    "electrons": evt.Electrons(),
+                    "muons": evt.Muons(),
+                }
+            )
+            .Select(
+                lambda collections: {
+                    "jet_pt": collections.jets.Select(lambda jet: jet.pt() / 1000.0),
+                    "jet_eta": collections.jets.Select(lambda jet: jet.eta()),
+                    "ele_pt": collections.electrons.Select(lambda ele: ele.pt() / 1000.0),
+                    "ele_eta": collections.electrons.Select(lambda ele: ele.eta()),
+                    "mu_pt": collections.muons.Select(lambda mu: mu.pt() / 1000.0),
+                    "mu_eta": collections.muons.Select(lambda mu: mu.eta()),
+                }
+            )
+        )
     return (
-        FuncADLQueryPHYSLITE()
-        .Select(lambda evt: {"jets": evt.Jets()})
+        event_source(sample)
+        .Select(
+            lambda evt: {
+                "jets": evt.Jets(),
+                "electrons": evt.Electrons(),
+                "muons": evt.Muons(),
+                "met": evt.MissingET().First(),
+            }
+        )
         .Select(
             lambda collections: {
-                "jet_pt": collections.jets.Select(lambda jet: jet.pt() / 1000.0)
+                "jet_pt": collections.jets.Select(lambda jet: jet.pt() / 1000.0),
+                "jet_eta": collections.jets.Select(lambda jet: jet.eta()),
+                "ele_pt": collections.electrons.Select(lambda ele: ele.pt() / 1000.0),
+                "ele_eta": collections.electrons.Select(lambda ele: ele.eta()),
+                "mu_pt": collections.muons.Select(lambda mu: mu.pt() / 1000.0),
+                "mu_eta": collections.muons.Select(lambda mu: mu.eta()),
+                "met": collections.met.met() / 1000.0,
             }
         )
     )
 
 
-def build_spec(query: Any) -> ServiceXSpec:
+def sample_names(samples: int) -> list[str]:
+    if samples == 1:
+        return [SAMPLE_NAME]
+    return [f"{SAMPLE_NAME}_{i}" for i in range(samples)]
+
+
+def build_queries(complexity: int = 1, samples: int = 1) -> list[Any]:
+    """One query per sample - all reading the same thing."""
+    return [build_query(complexity, sample) for sample in range(samples)]
+
+
+def build_spec(queries: list[Any], nfiles: int = 1) -> ServiceXSpec:
+    """A sample of `nfiles` files for each query."""
+    from servicex import Sample, ServiceXSpec, dataset
+
     return ServiceXSpec(
         Sample=[
             Sample(
-                Name=SAMPLE_NAME,
+                Name=name,
                 Dataset=dataset.Rucio(DATASET_DID),
-                NFiles=1,
+                NFiles=nfiles,
                 Query=query,
             )
+            for name, query in zip(sample_names(len(queries)), queries)
+        ]
+    )
+
+
+def spec_record(complexity: int = 1, samples: int = 1, nfiles: int = 1) -> dict[str, Any]:
+    """
+    The spec for a job with the func_adl queries already turned into their qastle text, in a
+    form that can be written to a file and turned back into a ServiceXSpec without func_adl.
+    """
+    queries = build_queries(complexity, samples)
+    return {
+        "samples": [
+            {
+                "Name": name,
+                "RucioDID": DATASET_DID,
+                "NFiles": nfiles,
+                "Query": query.generate_selection_string(),
+                "Codegen": query.default_codegen,
+            }
+            for name, query in zip(sample_names(len(queries)), queries)
+        ]
+    }
+
+
+def save_spec(path: Path, record: dict[str, Any]) -> None:
+    path.write_text(json.dumps(record, separators=(",", ":")))
+
+
+def load_spec(path: Path) -> ServiceXSpec:
+    """A ServiceXSpec from a file `save_spec` wrote."""
+    from servicex import Sample, ServiceXSpec, dataset
+
+    record = json.loads(path.read_text())
+    return ServiceXSpec(
+        Sample=[
+            Sample(
+                Name=sample["Name"],
+                Dataset=dataset.Rucio(sample["RucioDID"]),
+                NFiles=sample["NFiles"],
+                Query=sample["Query"],
+                Codegen=sample["Codegen"],
+            )
+            for sample in record["samples"]
         ]
     )
 
 
 async def run_deliver_async(spec: ServiceXSpec) -> Any:
-    result = sx_deliver_async(
+    from servicex.servicex_client import ProgressBarFormat
+
+    result = servicex_deliver_async()(  # type: ignore[misc]
         spec,
         ignore_local_cache=True,
         progress_bar=ProgressBarFormat.none,
@@ -86,6 +297,9 @@ async def run_deliver_async(spec: ServiceXSpec) -> Any:
 
 
 def run_deliver_sync_with_timeout(spec: ServiceXSpec, timeout_seconds: int) -> Any:
+    from servicex import deliver
+    from servicex.servicex_client import ProgressBarFormat
+
     def on_timeout(_signum: int, _frame: Any) -> None:
         raise TimeoutError
 
@@ -102,75 +316,493 @@ def run_deliver_sync_with_timeout(spec: ServiceXSpec, timeout_seconds: int) -> A
         signal.signal(signal.SIGALRM, previous)
 
 
+# The timing marks of the job running in the current task. The sync `deliver` path runs its
+# query on a thread of its own where this is not visible, but it only ever runs one job per
+# process, so it falls back to the marks of the last job started.
+_job_marks: ContextVar[dict[str, Any] | None] = ContextVar("job_marks", default=None)
+_last_marks: dict[str, Any] = {}
+
+
+def start_job_marks(
+    released_at: float | None, modules: list[str] = JOB_MODULES
+) -> dict[str, Any]:
+    """Start timing a job. `released_at` is the wall clock time the swarm released it."""
+    global _last_marks
+    import_job_modules(modules)
+    marks: dict[str, Any] = {
+        "import_seconds": _import_seconds,
+        "start": time.perf_counter(),
+        "released_at": released_at,
+        "release_seconds": (
+            None if released_at is None else max(0.0, time.time() - released_at)
+        ),
+    }
+    _job_marks.set(marks)
+    _last_marks = marks
+    return marks
+
+
+def current_job_marks() -> dict[str, Any]:
+    marks = _job_marks.get()
+    return _last_marks if marks is None else marks
+
+
+def _probe(cls: Any, method_name: str, on_return: Any) -> None:
+    original = getattr(cls, method_name, None)
+    if original is None or getattr(original, "_swarm_probe", False):
+        return
+
+    async def probed(*args: Any, **kwargs: Any) -> Any:
+        marks = current_job_marks()
+        called = time.perf_counter()
+        result = await original(*args, **kwargs)
+        on_return(marks, called)
+        return result
+
+    probed._swarm_probe = True  # type: ignore[attr-defined]
+    setattr(cls, method_name, probed)
+
+
+def install_probes() -> None:
+    """
+    Time the transform submit call and the first result file of each job. The servicex client
+    has no hooks for either, so wrap the adapter methods it calls. A client without them just
+    reports no submit or first file time.
+    """
+
+    def submitted(marks: dict[str, Any], called: float) -> None:
+        marks.setdefault("submit_seconds", time.perf_counter() - called)
+
+    def file_ready(marks: dict[str, Any], _called: float) -> None:
+        marks.setdefault("first_file_seconds", time.perf_counter() - marks["start"])
+
+    try:
+        from servicex.minio_adapter import MinioAdapter
+        from servicex.servicex_adapter import ServiceXAdapter
+    except ImportError:
+        return
+    _probe(ServiceXAdapter, "submit_transform", submitted)
+    _probe(MinioAdapter, "download_file", file_ready)
+    _probe(MinioAdapter, "get_signed_url", file_ready)
+
+
+def job_timings(
+    marks: dict[str, Any], summary: dict[str, Any] | None = None
+) -> dict[str, Any]:
+    timings = {name: marks.get(name) for name in TIMING_METRICS}
+    if timings["query_seconds"] is None:
+        timings["query_seconds"] = time.perf_counter() - marks["start"]
+    summary = dict(summary or {})
+    timings["jets"] = summary.pop("jets", None)
+    timings["released_at"] = marks["released_at"]
+    if summary:
+        timings["summary"] = summary
+    return timings
+
+
+# What a job does with its result once it has it: summary_hook(delivered) -> dict. A "jets"
+# entry is what the job reports as the jets it found. Hooks run after the query is timed,
+# so a more thorough check of the result does not show up as ServiceX latency.
+SummaryHook = Callable[[Any], dict[str, Any]]
+SUMMARY_HOOKS: dict[str, SummaryHook] = {}
+
+
+def summary_hook(name: str) -> Callable[[SummaryHook], SummaryHook]:
+    def register(hook: SummaryHook) -> SummaryHook:
+        SUMMARY_HOOKS[name] = hook
+        return hook
+
+    return register
+
+
+def delivered_jet_pts(delivered: Any) -> list[ak.Array]:
+    """The jet pT of each sample in the result."""
+    from servicex_analysis_utils import to_awk
+
+    return [sample_data["jet_pt"] for sample_data in to_awk(delivered).values()]
+
+
 def count_jets(delivered: Any) -> int:
-    awkward_payload = to_awk(delivered)
-    sample_data = awkward_payload[SAMPLE_NAME]
-    jet_pts = sample_data["jet_pt"]
-    total_jets = 0
-    for event_jets in jet_pts:
-        total_jets += len(event_jets)
-    return int(total_jets)
+    import awkward as ak
+
+    return sum(int(ak.sum(ak.num(jet_pts, axis=1))) for jet_pts in delivered_jet_pts(delivered))
+
+
+@summary_hook("none")
+def summarise_nothing(_delivered: Any) -> dict[str, Any]:
+    """Do not even load the result files."""
+    return {}
+
+
+@summary_hook("count")
+def summarise_count(delivered: Any) -> dict[str, Any]:
+    return {"jets": count_jets(delivered)}
+
+
+@summary_hook("stats")
+def summarise_jet_pt(delivered: Any) -> dict[str, Any]:
+    """Jet counts plus the sum, range and a histogram of the jet pT."""
+    import awkward as ak
+    import numpy as np
+
+    per_sample = delivered_jet_pts(delivered)
+    flat = np.concatenate(
+        [ak.to_numpy(ak.flatten(jet_pts, axis=1)) for jet_pts in per_sample]
+    )
+    counts, _edges = np.histogram(flat, bins=JET_PT_N_BINS, range=JET_PT_RANGE)
+    return {
+        "events": sum(len(jet_pts) for jet_pts in per_sample),
+        "jets": int(len(flat)),
+        "jet_pt_sum": float(flat.sum()),
+        "jet_pt_min": float(flat.min()) if len(flat) else None,
+        "jet_pt_max": float(flat.max()) if len(flat) else None,
+        "jet_pt_histogram": counts.tolist(),
+    }
+
+
+class JobOptions(NamedTuple):
+    """How each job of a swarm runs - passed to in-process jobs, and on the command line to children."""
+
+    summary: str = "count"
+    nfiles: int = 1
+    samples: int = 1
+    complexity: int = 1
+    # A spec built once by the swarm (see `prebuilt_spec`), used instead of building the query.
+    spec_file: str | None = None
+
+    def child_args(self) -> list[str]:
+        args = [
+            "--summary",
+            self.summary,
+            "--nfiles",
+            str(self.nfiles),
+            "--samples",
+            str(self.samples),
+            "--complexity",
+            str(self.complexity),
+        ]
+        if self.spec_file is not None:
+            args += ["--spec-file", self.spec_file]
+        return args
+
+    def modules(self) -> list[str]:
+        """The modules a job with these options imports."""
+        if self.spec_file is None:
+            return JOB_MODULES
+        return [m for m in JOB_MODULES if m != QUERY_BUILD_MODULE]
+
+
+@contextmanager
+def prebuilt_spec(options: JobOptions) -> Iterator[JobOptions]:
+    """
+    Build the query and spec for `options` once and save them to a file, so every job of a
+    swarm loads them rather than building the same func_adl query again. Yields the options
+    that point the jobs at the file.
+
+    The build runs in a `build-spec` child, so the swarm process itself still never imports
+    func_adl or servicex. The time reported includes starting that child.
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="servicex-swarm-") as tmp:
+        path = Path(tmp) / "spec.json"
+        result = subprocess.run(
+            [
+                sys.executable,
+                str(Path(__file__).resolve()),
+                "build-spec",
+                str(path),
+                "--nfiles",
+                str(options.nfiles),
+                "--samples",
+                str(options.samples),
+                "--complexity",
+                str(options.complexity),
+            ]
+        )
+        if result.returncode != 0:
+            print("Building the query spec failed", file=sys.stderr)
+            raise typer.Exit(code=1)
+        print(
+            f"Query build took {time.perf_counter() - start:.2f} seconds "
+            f"(once, for every job, in a child process; {path.stat().st_size} byte spec)."
+        )
+        yield options._replace(spec_file=str(path))
+
+
+def job_spec(options: JobOptions, marks: dict[str, Any]) -> ServiceXSpec:
+    """
+    The job's spec - loaded, if the swarm built it already. The time it takes is the job's
+    build time, and the query clock starts once it is done.
+    """
+    build_start = time.perf_counter()
+    if options.spec_file is not None:
+        spec = load_spec(Path(options.spec_file))
+    else:
+        spec = build_spec(build_queries(options.complexity, options.samples), options.nfiles)
+    marks["build_seconds"] = time.perf_counter() - build_start
+    marks["start"] = time.perf_counter()
+    return spec
+
+
+class FetchOutcome(NamedTuple):
+    """What a `fetch` run exits with and prints, so in-process jobs classify the same way."""
+
+    return_code: int
+    stdout: str
+    stderr: str = ""
+    timings: dict[str, Any] | None = None
+
+
+def finish_fetch(
+    delivered: Any, marks: dict[str, Any], start: float, options: JobOptions
+) -> FetchOutcome:
+    """Stop the query clock, then run the summary hook on the result (timed on its own)."""
+    summary_start = time.perf_counter()
+    elapsed = summary_start - start
+    marks["query_seconds"] = summary_start - marks["start"]
+    try:
+        summary = SUMMARY_HOOKS[options.summary](delivered)
+    except Exception as exc:
+        marks["summary_seconds"] = time.perf_counter() - summary_start
+        return FetchOutcome(1, "", f"Summary failed: {exc}", job_timings(marks))
+    marks["summary_seconds"] = time.perf_counter() - summary_start
+
+    line = f"Query took {elapsed:.2f} seconds."
+    if "jets" in summary:
+        line += f" Found {summary['jets']} jets"
+    build_line = f"Query build took {marks['build_seconds']:.2f} seconds."
+    return FetchOutcome(0, f"{build_line}\n{line}", timings=job_timings(marks, summary))
+
+
+async def fetch_once(
+    released_at: float | None = None, options: JobOptions = JobOptions()
+) -> FetchOutcome:
+    install_probes()
+    marks = start_job_marks(released_at, options.modules())
+    spec = job_spec(options, marks)
+    start = marks["start"]
+
+    try:
+        delivered = await asyncio.wait_for(
+            run_deliver_async(spec), timeout=QUERY_TIMEOUT_SECONDS
+        )
+    except TimeoutError:
+        return FetchOutcome(1, "Query timed out", timings=job_timings(marks))
+    except Exception as exc:
+        return FetchOutcome(1, "", f"Query failed: {exc}", job_timings(marks))
+
+    # Off the event loop, so summarising one result does not hold up the other jobs.
+    return await asyncio.to_thread(finish_fetch, delivered, marks, start, options)
+
+
+def wait_for_release(
+    release_fd: int, timeout_seconds: float, options: JobOptions = JobOptions()
+) -> float | None:
+    """
+    Import what the job needs, tell the swarm we are ready, then block until it closes its end
+    of the release pipe. Returns when we woke up, or None if the signal never came (or the
+    swarm went away).
+    """
+    swarm_pid = os.getppid()
+    import_job_modules(options.modules())
+    print(READY_LINE, flush=True)
+    ready, _, _ = select.select([release_fd], [], [], timeout_seconds)
+    woke_at = time.time()
+    os.close(release_fd)
+    if not ready or os.getppid() != swarm_pid:
+        return None
+    return woke_at
 
 
-def wait_for_release_file(release_file: Path, timeout_seconds: float) -> bool:
-    deadline = time.monotonic() + timeout_seconds
-    while time.monotonic() < deadline:
-        if release_file.exists():
-            return True
-        time.sleep(0.01)
-    return False
+def print_timings(timings: dict[str, Any] | None) -> None:
+    if timings is not None:
+        print(TIMINGS_PREFIX + json.dumps(timings))
+
+
+# The job options shared by the commands that run jobs.
+SUMMARY_OPTION = typer.Option(
+    "count",
+    "--summary",
+    help="What each job does with its result, timed apart from the query: none, count or stats.",
+)
+NFILES_OPTION = typer.Option(1, "--nfiles", min=1, help="Files per sample.")
+SAMPLES_OPTION = typer.Option(1, "--samples", min=1, help="Samples per ServiceXSpec.")
+COMPLEXITY_OPTION = typer.Option(
+    1, "--complexity", help="Query complexity: 1 (jet pT) to 4 (jets, leptons and MET)."
+)
+SPEC_FILE_OPTION = typer.Option(
+    None,
+    "--spec-file",
+    help="Load the query and spec from this file (as the swarm writes it) instead of building "
+    "them. --nfiles, --samples and --complexity are then ignored.",
+)
 
 
 @app.command()
 def fetch(
-    release_file: Path | None = typer.Option(
+    release_fd: int | None = typer.Option(
         None,
-        "--release-file",
-        help="Wait until this file exists before starting the query.",
+        "--release-fd",
+        help="Wait until the write end of this (inherited) pipe is closed before starting the query.",
     ),
     release_wait_timeout: float = typer.Option(
         30.0,
         "--release-wait-timeout",
         min=0.1,
-        help="Maximum seconds to wait for --release-file before failing.",
+        help="Maximum seconds to wait for the --release-fd signal before failing.",
+    ),
+    emit_timings: bool = typer.Option(
+        False,
+        "--emit-timings",
+        hidden=True,
+        help="Also print the job timings as a JSON line for the swarm.",
     ),
+    scheduled_at: float | None = typer.Option(
+        None,
+        "--scheduled-at",
+        hidden=True,
+        help="Wall clock time an open-loop swarm meant this job to start.",
+    ),
+    summary: str = SUMMARY_OPTION,
+    nfiles: int = NFILES_OPTION,
+    samples: int = SAMPLES_OPTION,
+    complexity: int = COMPLEXITY_OPTION,
+    spec_file: Path | None = SPEC_FILE_OPTION,
 ) -> None:
-    if release_file is not None:
-        if not wait_for_release_file(release_file, release_wait_timeout):
+    options = job_options(summary, nfiles, samples, complexity, spec_file)
+    released_at = scheduled_at
+    if release_fd is not None:
+        released_at = wait_for_release(release_fd, release_wait_timeout, options)
+        if released_at is None:
             print("Timed out waiting for release signal", file=sys.stderr)
             raise typer.Exit(code=1)
 
-    start = time.perf_counter()
-    query = build_query()
-    spec = build_spec(query)
+    return_code = report_outcome(run_fetch(released_at, options), emit_timings)
+    if return_code != 0:
+        raise typer.Exit(code=return_code)
+
+
+def run_fetch(released_at: float | None, options: JobOptions) -> FetchOutcome:
+    """One job, with `deliver_async` if this servicex has it."""
+    if servicex_deliver_async() is not None:
+        return asyncio.run(fetch_once(released_at, options))
+    return fetch_sync(released_at, options)
+
+
+def report_outcome(outcome: FetchOutcome, emit_timings: bool) -> int:
+    """Print what a `fetch` prints, and return its exit code."""
+    if outcome.stdout:
+        print(outcome.stdout)
+    if outcome.stderr:
+        print(outcome.stderr, file=sys.stderr)
+    if emit_timings:
+        print_timings(outcome.timings)
+    return outcome.return_code
+
+
+def fetch_sync(released_at: float | None, options: JobOptions) -> FetchOutcome:
+    """`fetch_once` for a servicex without `deliver_async`."""
+    install_probes()
+    marks = start_job_marks(released_at, options.modules())
+    spec = job_spec(options, marks)
+    start = marks["start"]
 
     try:
-        if sx_deliver_async is None:
-            delivered = run_deliver_sync_with_timeout(spec, QUERY_TIMEOUT_SECONDS)
-        else:
-            delivered = asyncio.run(
-                asyncio.wait_for(run_deliver_async(spec), timeout=QUERY_TIMEOUT_SECONDS)
-            )
+        delivered = run_deliver_sync_with_timeout(spec, QUERY_TIMEOUT_SECONDS)
     except TimeoutError:
-        print("Query timed out")
-        raise typer.Exit(code=1)
+        return FetchOutcome(1, "Query timed out", timings=job_timings(marks))
     except Exception as exc:
-        print(f"Query failed: {exc}", file=sys.stderr)
-        raise typer.Exit(code=1)
+        return FetchOutcome(1, "", f"Query failed: {exc}", job_timings(marks))
 
-    elapsed = time.perf_counter() - start
-    jets = count_jets(delivered)
-    print(f"Query took {elapsed:.2f} seconds. Found {jets} jets")
+    return finish_fetch(delivered, marks, start, options)
+
+
+def job_options(
+    summary: str,
+    nfiles: int = 1,
+    samples: int = 1,
+    complexity: int = 1,
+    spec_file: Path | None = None,
+) -> JobOptions:
+    """Check the job options given on the command line."""
+    if summary not in SUMMARY_HOOKS:
+        print(
+            f"Unknown summary {summary!r}. Choose from: {', '.join(SUMMARY_HOOKS)}",
+            file=sys.stderr,
+        )
+        raise typer.Exit(code=2)
+    if complexity not in QUERY_COMPLEXITY:
+        print(
+            f"Unknown query complexity {complexity}. Choose from: "
+            f"{', '.join(str(c) for c in QUERY_COMPLEXITY)}",
+            file=sys.stderr,
+        )
+        raise typer.Exit(code=2)
+    return JobOptions(
+        summary, nfiles, samples, complexity, None if spec_file is None else str(spec_file)
+    )
+
+
+@app.command("build-spec", hidden=True)
+def build_spec_file(
+    path: Path = typer.Argument(..., help="Where to write the spec."),
+    nfiles: int = NFILES_OPTION,
+    samples: int = SAMPLES_OPTION,
+    complexity: int = COMPLEXITY_OPTION,
+) -> None:
+    """Build the query and spec once and write them to `path` (see `prebuilt_spec`)."""
+    job_options("none", nfiles, samples, complexity)
+    save_spec(path, spec_record(complexity, samples, nfiles))
+
+
+@app.command("async-worker", hidden=True)
+def async_worker(
+    count: int = typer.Argument(..., min=1, help="Number of concurrent queries to run."),
+    release_fd: int | None = typer.Option(None, "--release-fd"),
+    release_wait_timeout: float = typer.Option(30.0, "--release-wait-timeout", min=0.1),
+    summary: str = SUMMARY_OPTION,
+    nfiles: int = NFILES_OPTION,
+    samples: int = SAMPLES_OPTION,
+    complexity: int = COMPLEXITY_OPTION,
+    spec_file: Path | None = SPEC_FILE_OPTION,
+) -> None:
+    """Run `count` queries in one event loop, printing one JSON outcome line per query."""
+    options = job_options(summary, nfiles, samples, complexity, spec_file)
+    released_at = None
+    if release_fd is not None:
+        released_at = wait_for_release(release_fd, release_wait_timeout, options)
+        if released_at is None:
+            print("Timed out waiting for release signal", file=sys.stderr)
+            raise typer.Exit(code=1)
+
+    async def run_all() -> None:
+        jobs = [fetch_once(released_at, options) for _ in range(count)]
+        for job in asyncio.as_completed(jobs):
+            outcome = await job
+            print(json.dumps(outcome._asdict()), flush=True)
+
+    asyncio.run(run_all())
 
 
 def classify_result(return_code: int, stdout: str) -> str:
     if return_code == 0:
         return "ok"
-    if stdout.strip() == "Query timed out":
+    if "Query timed out" in (line.strip() for line in stdout.splitlines()):
         return "timeout"
     return "failed"
 
 
+def parse_timings(stdout: str) -> dict[str, Any] | None:
+    """The timings a `fetch --emit-timings` child printed, if it got that far."""
+    for line in stdout.splitlines():
+        if line.startswith(TIMINGS_PREFIX):
+            try:
+                return json.loads(line.removeprefix(TIMINGS_PREFIX))
+            except ValueError:
+                return None
+    return None
+
+
 def render_progress(
     *,
     done: int,
@@ -187,102 +819,1074 @@ def render_progress(
     )
 
 
-@app.command()
-def swarm(
-    count: int = typer.Argument(..., min=1, help="Number of fetch jobs to start."),
-    release_delay: float = typer.Option(
-        10.0,
-        "--release-delay",
-        min=0.0,
-        help="Seconds to wait after launching workers before releasing them.",
-    ),
-    release_wait_timeout: float = typer.Option(
-        30.0,
-        "--release-wait-timeout",
-        min=0.1,
-        help="Timeout passed to child fetch jobs while waiting for release signal.",
-    ),
+def write_progress(statuses: list[str], start: float) -> None:
+    done = sum(statuses.count(s) for s in ("ok", "timeout", "failed"))
+    sys.stdout.write(
+        render_progress(
+            done=done,
+            total=len(statuses),
+            ok=statuses.count("ok"),
+            timeout=statuses.count("timeout"),
+            failed=statuses.count("failed"),
+            elapsed=time.perf_counter() - start,
+        )
+    )
+    sys.stdout.flush()
+
+
+class SwarmRun(NamedTuple):
+    """
+    How each job of a swarm ended, its timings (if it reported any) and when it was released.
+    Open-loop runs also know when each job was due and when it finished (seconds since release).
+    """
+
+    statuses: list[str]
+    timings: list[dict[str, Any] | None]
+    released: float
+    arrivals: list[float] | None = None
+    finished: list[float | None] | None = None
+    # Wall clock time of the release signal, for runs whose workers wait on a ReleaseBarrier.
+    released_at: float | None = None
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Linearly interpolated percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low, high = math.floor(rank), math.ceil(rank)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarise_run(run: SwarmRun, finished: float, interval: float = 10.0) -> dict[str, Any]:
+    """Latency percentiles of the successful jobs, and the swarm's throughput."""
+    ok_timings = [
+        t for s, t in zip(run.statuses, run.timings) if s == "ok" and t is not None
+    ]
+    latency: dict[str, dict[str, float] | None] = {}
+    for metric in TIMING_METRICS:
+        values = [t[metric] for t in ok_timings if t.get(metric) is not None]
+        latency[metric] = (
+            None
+            if not values
+            else {
+                "count": len(values),
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": max(values),
+            }
+        )
+    since_release = finished - run.released
+    ok = run.statuses.count("ok")
+    return {
+        "jobs": len(run.statuses),
+        "ok": ok,
+        "timeout": run.statuses.count("timeout"),
+        "failed": run.statuses.count("failed"),
+        "seconds_since_release": since_release,
+        "jobs_per_second": ok / since_release if since_release > 0 else None,
+        "latency": latency,
+        "release_skew": summarise_release_skew(run),
+        "intervals": summarise_intervals(run, interval),
+    }
+
+
+def summarise_release_skew(run: SwarmRun) -> dict[str, Any] | None:
+    """How long after the release signal the workers actually woke up, and how spread out."""
+    if run.released_at is None:
+        return None
+    woke = [t["released_at"] for t in run.timings if t and t.get("released_at") is not None]
+    if not woke:
+        return None
+    return {
+        "jobs": len(woke),
+        "first_seconds": min(woke) - run.released_at,
+        "last_seconds": max(woke) - run.released_at,
+        "spread_seconds": max(woke) - min(woke),
+    }
+
+
+def render_histogram(values: list[float], bins: int = 10, width: int = 40) -> list[str]:
+    low, high = min(values), max(values)
+    step = (high - low) / bins or 1.0
+    counts = [0] * bins
+    for v in values:
+        counts[min(int((v - low) / step), bins - 1)] += 1
+    scale = width / max(counts)
+    return [
+        f"  {low + i * step:8.2f}s - {low + (i + 1) * step:8.2f}s | "
+        f"{'#' * math.ceil(n * scale):<{width}} {n}"
+        for i, n in enumerate(counts)
+    ]
+
+
+def summarise_intervals(run: SwarmRun, interval: float) -> list[dict[str, Any]]:
+    """Throughput and latency of an open-loop run in windows of `interval` seconds."""
+    if run.arrivals is None or run.finished is None:
+        return []
+    end = max([f for f in run.finished if f is not None] + run.arrivals + [0.0])
+    rows = []
+    for k in range(max(1, math.ceil(end / interval))):
+        low, high = k * interval, (k + 1) * interval
+        finished = [
+            i for i, f in enumerate(run.finished) if f is not None and low <= f < high
+        ]
+        latencies = [
+            run.timings[i]["query_seconds"]  # type: ignore[index]
+            for i in finished
+            if run.statuses[i] == "ok" and run.timings[i] is not None
+        ]
+        rows.append(
+            {
+                "start_seconds": low,
+                "sent": sum(low <= a < high for a in run.arrivals),
+                "finished": len(finished),
+                "ok": sum(run.statuses[i] == "ok" for i in finished),
+                "jobs_per_second": len(latencies) / interval,
+                "p50": percentile(latencies, 50) if latencies else None,
+                "p90": percentile(latencies, 90) if latencies else None,
+                "outstanding": sum(
+                    a < high and (f is None or f >= high)
+                    for a, f in zip(run.arrivals, run.finished)
+                ),
+            }
+        )
+    return rows
+
+
+def print_intervals(rows: list[dict[str, Any]]) -> None:
+    print(
+        f"{'t (s)':>8}{'sent':>6}{'done':>6}{'ok':>6}{'jobs/s':>9}"
+        f"{'p50':>9}{'p90':>9}{'outstanding':>13}"
+    )
+    for row in rows:
+        p50 = "-" if row["p50"] is None else f"{row['p50']:.2f}"
+        p90 = "-" if row["p90"] is None else f"{row['p90']:.2f}"
+        print(
+            f"{row['start_seconds']:>8.1f}{row['sent']:>6}{row['finished']:>6}"
+            f"{row['ok']:>6}{row['jobs_per_second']:>9.3f}{p50:>9}{p90:>9}"
+            f"{row['outstanding']:>13}"
+        )
+
+
+def print_report(summary: dict[str, Any], run: SwarmRun) -> None:
+    print(f"{'Latency (s)':<20}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'jobs':>6}")
+    for metric, stats in summary["latency"].items():
+        name = metric.removesuffix("_seconds")
+        if stats is None:
+            print(f"{name:<20}{'-':>9}{'-':>9}{'-':>9}{'-':>9}{0:>6}")
+            continue
+        print(
+            f"{name:<20}{stats['p50']:>9.2f}{stats['p90']:>9.2f}"
+            f"{stats['p99']:>9.2f}{stats['max']:>9.2f}{stats['count']:>6}"
+        )
+
+    query_seconds = [
+        t["query_seconds"]
+        for s, t in zip(run.statuses, run.timings)
+        if s == "ok" and t is not None
+    ]
+    if query_seconds:
+        print("Query time histogram:")
+        for line in render_histogram(query_seconds):
+            print(line)
+
+    skew = summary["release_skew"]
+    if skew is not None:
+        print(
+            f"Release skew: {skew['jobs']} jobs woke {skew['first_seconds'] * 1000:.1f}ms to "
+            f"{skew['last_seconds'] * 1000:.1f}ms after the release signal "
+            f"(spread {skew['spread_seconds'] * 1000:.1f}ms)"
+        )
+
+    if summary["intervals"]:
+        print("Per interval (latency of the jobs that finished in it):")
+        print_intervals(summary["intervals"])
+
+    if summary["jobs_per_second"] is not None:
+        print(
+            f"Throughput: {summary['jobs_per_second']:.3f} jobs/s "
+            f"({summary['ok']} ok in {summary['seconds_since_release']:.2f}s since release)"
+        )
+
+
+def write_report_json(path: Path, summary: dict[str, Any], run: SwarmRun) -> None:
+    path.write_text(json.dumps({"summary": summary, "jobs": job_rows(run)}, indent=2))
+
+
+def job_rows(run: SwarmRun) -> list[dict[str, Any]]:
+    rows = []
+    for i, (s, t) in enumerate(zip(run.statuses, run.timings)):
+        row = {"job": i, "status": s, **(t or {})}
+        if run.arrivals is not None and run.finished is not None:
+            row["due_seconds"] = run.arrivals[i]
+            row["finished_seconds"] = run.finished[i]
+        rows.append(row)
+    return rows
+
+
+def write_report_csv(path: Path, run: SwarmRun) -> None:
+    columns = ["job", "status", *TIMING_METRICS, "jets", "released_at"]
+    if run.arrivals is not None:
+        columns += ["due_seconds", "finished_seconds"]
+    with path.open("w", newline="") as f:
+        writer = csv.DictWriter(f, columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(job_rows(run))
+
+
+def finish_swarm(
+    run: SwarmRun,
+    start: float,
+    report_json: Path | None = None,
+    report_csv: Path | None = None,
+    interval: float = 10.0,
 ) -> None:
+    sys.stdout.write("\n")
+    finished = time.perf_counter()
+    total_elapsed = finished - start
+    statuses = run.statuses
+    ok = statuses.count("ok")
+    timeout = statuses.count("timeout")
+    failed = statuses.count("failed")
+    print(
+        f"Swarm finished in {total_elapsed:.2f}s. "
+        f"ok={ok} timeout={timeout} failed={failed}"
+    )
+
+    summary = summarise_run(run, finished, interval)
+    print_report(summary, run)
+    if report_json is not None:
+        write_report_json(report_json, summary, run)
+    if report_csv is not None:
+        write_report_csv(report_csv, run)
+
+    if timeout > 0 or failed > 0:
+        raise typer.Exit(code=1)
+
+
+class ReleaseBarrier:
+    """
+    Workers inherit the read end of a pipe and block on it. Closing the write end wakes them
+    all at the same moment (they see EOF) - there is no file for them to keep checking.
+    """
+
+    def __init__(self) -> None:
+        self._read_fd, self._write_fd = os.pipe()
+        self.released_at: float | None = None
+
+    @property
+    def pass_fds(self) -> tuple[int, ...]:
+        return (self._read_fd,)
+
+    def child_args(self) -> list[str]:
+        return ["--release-fd", str(self._read_fd)]
+
+    def forked(self) -> int:
+        """
+        In a forked worker: let go of the write end (or the pipe would never see EOF) and
+        return the read end to wait on.
+        """
+        if self._write_fd >= 0:
+            os.close(self._write_fd)
+            self._write_fd = -1
+        return self._read_fd
+
+    def release(self) -> float:
+        self.released_at = time.time()
+        released = time.perf_counter()
+        os.close(self._write_fd)
+        self._write_fd = -1
+        return released
+
+    def close(self) -> None:
+        for fd in (self._read_fd, self._write_fd):
+            if fd >= 0:
+                os.close(fd)
+        self._read_fd = self._write_fd = -1
+
+
+class ChildWatcher:
+    """
+    Follows the stdout and stderr of child processes with a selector, so each line a child
+    prints and each child's exit are handled as they happen rather than by polling.
+    on_line(key, line) gets each stdout line; on_exit(key, return_code, stderr) each exit.
+    """
+
+    def __init__(
+        self,
+        on_line: Callable[[int, str], None],
+        on_exit: Callable[[int, int, str], None],
+    ) -> None:
+        self._selector = selectors.DefaultSelector()
+        self._on_line = on_line
+        self._on_exit = on_exit
+        self._procs: dict[int, subprocess.Popen[bytes]] = {}
+        self._open_streams: dict[int, int] = {}
+        self._partial: dict[int, bytes] = {}
+        self._stderr: dict[int, bytes] = {}
+
+    def __len__(self) -> int:
+        """Number of children still running."""
+        return len(self._procs)
+
+    def add(self, key: int, proc: subprocess.Popen[bytes]) -> None:
+        self._procs[key] = proc
+        self._open_streams[key] = 0
+        self._partial[key] = b""
+        self._stderr[key] = b""
+        for stream in (proc.stdout, proc.stderr):
+            if stream is not None:
+                self._selector.register(stream, selectors.EVENT_READ, key)
+                self._open_streams[key] += 1
+
+    def wait(self, timeout: float) -> None:
+        """Handle whatever the children print, and any that exit, in the next `timeout` seconds."""
+        if not self._selector.get_map():
+            time.sleep(timeout)
+            return
+        for selected, _ in self._selector.select(timeout):
+            key = selected.data
+            stream = selected.fileobj
+            data = os.read(selected.fd, 65536)
+            if stream is self._procs[key].stdout:
+                self._stdout_data(key, data)
+            else:
+                self._stderr[key] += data
+            if not data:
+                self._selector.unregister(stream)
+                stream.close()  # type: ignore[union-attr]
+                self._open_streams[key] -= 1
+                if self._open_streams[key] == 0:
+                    proc = self._procs.pop(key)
+                    stderr = self._stderr.pop(key).decode(errors="replace")
+                    self._on_exit(key, proc.wait(), stderr)
+
+    def _stdout_data(self, key: int, data: bytes) -> None:
+        if not data:
+            rest = self._partial.pop(key)
+            if rest:
+                self._on_line(key, rest.decode(errors="replace"))
+            return
+        lines = (self._partial[key] + data).split(b"\n")
+        self._partial[key] = lines.pop()
+        for line in lines:
+            self._on_line(key, line.decode(errors="replace").rstrip("\r"))
+
+    def kill_all(self) -> None:
+        for proc in self._procs.values():
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
+class ForkedJob:
+    """
+    Runs `job()` in a forked copy of this process, which exits with what it returns. Its stdout
+    and stderr are pipes, and it has the parts of `subprocess.Popen` that ChildWatcher uses.
+    The copy starts with every module this process has already imported.
+    """
+
+    def __init__(self, job: Callable[[], int]) -> None:
+        out_read, out_write = os.pipe()
+        err_read, err_write = os.pipe()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            return_code = 1
+            try:
+                os.close(out_read)
+                os.close(err_read)
+                os.dup2(out_write, 1)
+                os.dup2(err_write, 2)
+                os.close(out_write)
+                os.close(err_write)
+                return_code = job()
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(return_code)
+        os.close(out_write)
+        os.close(err_write)
+        self.pid = pid
+        self.returncode: int | None = None
+        self.stdout = os.fdopen(out_read, "rb", buffering=0)
+        self.stderr = os.fdopen(err_read, "rb", buffering=0)
+
+    def _reap(self, flags: int) -> int | None:
+        if self.returncode is None:
+            pid, status = os.waitpid(self.pid, flags)
+            if pid != 0:
+                self.returncode = os.waitstatus_to_exitcode(status)
+        return self.returncode
+
+    def poll(self) -> int | None:
+        return self._reap(os.WNOHANG)
+
+    def wait(self) -> int:
+        return self._reap(0)  # type: ignore[return-value]
+
+    def kill(self) -> None:
+        if self.returncode is None:
+            os.kill(self.pid, signal.SIGKILL)
+
+
+def forked_fetch(
+    barrier: ReleaseBarrier, release_wait_timeout: float, options: JobOptions
+) -> int:
+    """What a forked worker runs: `fetch --release-fd ... --emit-timings`."""
+    global _import_seconds
+    # Whatever the parent spent importing, this worker did not.
+    _import_seconds = None
+    released_at = wait_for_release(barrier.forked(), release_wait_timeout, options)
+    if released_at is None:
+        print("Timed out waiting for release signal", file=sys.stderr)
+        return 1
+    return report_outcome(run_fetch(released_at, options), emit_timings=True)
+
+
+def release_workers(
+    barrier: ReleaseBarrier,
+    watcher: ChildWatcher,
+    workers: str,
+    n_workers: int,
+    ready: Callable[[], int],
+    release_delay: float,
+) -> float:
+    """Release the workers as soon as they are all waiting (or have died), or after `release_delay`."""
+    print(
+        f"Started {workers}. Releasing them once they are all ready "
+        f"(at most {release_delay:.1f}s)..."
+    )
+    deadline = time.perf_counter() + release_delay
+    while ready() + (n_workers - len(watcher)) < n_workers:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        watcher.wait(min(remaining, 0.5))
+    released = barrier.release()
+    print(
+        f"Release signal sent to {ready()}/{n_workers} ready workers. "
+        "Workers are now starting queries."
+    )
+    return released
+
+
+def since_release(
+    timings: dict[str, Any] | None,
+    released_at: float | None,
+    ready_seconds: float | None = None,
+) -> dict[str, Any] | None:
+    """
+    A released worker only knows when it woke up. Add the time from the release signal to
+    that, so release_seconds covers the whole delay, and how long the worker took to be
+    ready, which only the swarm saw.
+    """
+    if timings is None:
+        return None
+    timings = {**timings, "ready_seconds": ready_seconds}
+    if released_at is None or timings.get("released_at") is None:
+        return timings
+    woke_after = timings["released_at"] - released_at
+    return {**timings, "release_seconds": (timings["release_seconds"] or 0.0) + woke_after}
+
+
+def run_process_swarm(
+    count: int,
+    release_delay: float,
+    release_wait_timeout: float,
+    start: float,
+    options: JobOptions,
+    fork: bool = False,
+) -> SwarmRun:
+    """
+    One `fetch` process per job. With `fork` they are forked from this process (which has
+    imported the job modules already) rather than each started from scratch.
+    """
     script_path = Path(__file__).resolve()
-    start = time.perf_counter()
-    release_fd, release_name = tempfile.mkstemp(prefix="servicex_swarm_release_")
-    release_path = Path(release_name)
-    # Workers need to wait for file creation, so ensure it does not exist yet.
-    Path(release_name).unlink(missing_ok=True)
-    os.close(release_fd)
+    barrier = ReleaseBarrier()
+    statuses = ["running"] * count
+    timings: list[dict[str, Any] | None] = [None] * count
+    stdout_lines: list[list[str]] = [[] for _ in range(count)]
+    started_at = [0.0] * count
+    ready_seconds: list[float | None] = [None] * count
+
+    def on_line(idx: int, line: str) -> None:
+        if line == READY_LINE:
+            ready_seconds[idx] = time.perf_counter() - started_at[idx]
+        else:
+            stdout_lines[idx].append(line)
+
+    def on_exit(idx: int, return_code: int, _stderr: str) -> None:
+        stdout = "\n".join(stdout_lines[idx])
+        statuses[idx] = classify_result(return_code, stdout)
+        timings[idx] = since_release(
+            parse_timings(stdout), barrier.released_at, ready_seconds[idx]
+        )
 
-    processes: list[subprocess.Popen[str]] = []
+    watcher = ChildWatcher(on_line, on_exit)
     try:
-        for _ in range(count):
+        for idx in range(count):
+            started_at[idx] = time.perf_counter()
+            if fork:
+                watcher.add(
+                    idx,
+                    ForkedJob(lambda: forked_fetch(barrier, release_wait_timeout, options)),  # type: ignore[arg-type]
+                )
+                continue
             proc = subprocess.Popen(
                 [
                     sys.executable,
                     str(script_path),
                     "fetch",
-                    "--release-file",
-                    str(release_path),
+                    *barrier.child_args(),
                     "--release-wait-timeout",
                     str(release_wait_timeout),
+                    "--emit-timings",
+                    *options.child_args(),
                 ],
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
+                pass_fds=barrier.pass_fds,
             )
-            processes.append(proc)
+            watcher.add(idx, proc)
 
-        print(
-            f"Started {count} workers. Waiting {release_delay:.1f}s before release signal..."
+        released = release_workers(
+            barrier,
+            watcher,
+            f"{count} {'forked ' if fork else ''}workers",
+            count,
+            lambda: sum(r is not None for r in ready_seconds),
+            release_delay,
         )
-        time.sleep(release_delay)
-        release_path.touch()
-        print("Release signal sent. Workers are now starting queries.")
 
-        statuses = ["running"] * count
+        while len(watcher) > 0:
+            watcher.wait(0.5)
+            write_progress(statuses, start)
+        return SwarmRun(statuses, timings, released, released_at=barrier.released_at)
+    finally:
+        watcher.kill_all()
+        barrier.close()
+
+
+def run_async_swarm(count: int, start: float, options: JobOptions) -> SwarmRun:
+    """All jobs as concurrent `deliver_async` calls in this process's event loop."""
+    statuses = ["running"] * count
+    timings: list[dict[str, Any] | None] = [None] * count
+
+    async def run_all() -> None:
+        released_at = time.time()
         done = 0
+        jobs = [fetch_once(released_at, options) for _ in range(count)]
+        for job in asyncio.as_completed(jobs):
+            outcome = await job
+            statuses[done] = classify_result(outcome.return_code, outcome.stdout)
+            timings[done] = outcome.timings
+            done += 1
+            write_progress(statuses, start)
 
-        while done < count:
-            for idx, proc in enumerate(processes):
-                if statuses[idx] != "running":
-                    continue
-                return_code = proc.poll()
-                if return_code is None:
-                    continue
-
-                stdout, _stderr = proc.communicate()
-                statuses[idx] = classify_result(return_code, stdout)
-                done += 1
-
-            ok = statuses.count("ok")
-            timeout = statuses.count("timeout")
-            failed = statuses.count("failed")
-            elapsed = time.perf_counter() - start
-            sys.stdout.write(
-                render_progress(
-                    done=done,
-                    total=count,
-                    ok=ok,
-                    timeout=timeout,
-                    failed=failed,
-                    elapsed=elapsed,
-                )
+    import_job_modules()
+    print(f"Starting {count} queries in one event loop.")
+    write_progress(statuses, start)
+    released = time.perf_counter()
+    asyncio.run(run_all())
+    return SwarmRun(statuses, timings, released)
+
+
+def split_jobs(count: int, procs: int) -> list[int]:
+    """Spread `count` jobs as evenly as possible over at most `procs` workers."""
+    procs = min(procs, count)
+    return [count // procs + (1 if i < count % procs else 0) for i in range(procs)]
+
+
+def run_multiprocess_async_swarm(
+    count: int,
+    procs: int,
+    release_delay: float,
+    release_wait_timeout: float,
+    start: float,
+    options: JobOptions,
+) -> SwarmRun:
+    """Jobs spread over `procs` processes, each running its share in one event loop."""
+    script_path = Path(__file__).resolve()
+    barrier = ReleaseBarrier()
+    shares = split_jobs(count, procs)
+    statuses = ["running"] * count
+    timings: list[dict[str, Any] | None] = [None] * count
+    reported = [0] * len(shares)
+    started_at = [0.0] * len(shares)
+    ready_seconds: list[float | None] = [None] * len(shares)
+    done = 0
+
+    def on_line(worker: int, line: str) -> None:
+        nonlocal done
+        if line == READY_LINE:
+            ready_seconds[worker] = time.perf_counter() - started_at[worker]
+            return
+        try:
+            outcome = FetchOutcome(**json.loads(line))
+        except (ValueError, TypeError):
+            return
+        statuses[done] = classify_result(outcome.return_code, outcome.stdout)
+        timings[done] = since_release(
+            outcome.timings, barrier.released_at, ready_seconds[worker]
+        )
+        reported[worker] += 1
+        done += 1
+
+    def on_exit(worker: int, _return_code: int, _stderr: str) -> None:
+        nonlocal done
+        # A worker that died early takes its unreported jobs down with it.
+        for _ in range(shares[worker] - reported[worker]):
+            statuses[done] = "failed"
+            done += 1
+        reported[worker] = shares[worker]
+
+    watcher = ChildWatcher(on_line, on_exit)
+    try:
+        for worker, share in enumerate(shares):
+            started_at[worker] = time.perf_counter()
+            proc = subprocess.Popen(
+                [
+                    sys.executable,
+                    str(script_path),
+                    "async-worker",
+                    str(share),
+                    *barrier.child_args(),
+                    "--release-wait-timeout",
+                    str(release_wait_timeout),
+                    *options.child_args(),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                pass_fds=barrier.pass_fds,
             )
-            sys.stdout.flush()
-            time.sleep(0.2)
+            watcher.add(worker, proc)
 
-        sys.stdout.write("\n")
-        total_elapsed = time.perf_counter() - start
-        ok = statuses.count("ok")
-        timeout = statuses.count("timeout")
-        failed = statuses.count("failed")
+        released = release_workers(
+            barrier,
+            watcher,
+            f"{len(shares)} async workers for {count} jobs",
+            len(shares),
+            lambda: sum(r is not None for r in ready_seconds),
+            release_delay,
+        )
+
+        while len(watcher) > 0:
+            watcher.wait(0.5)
+            write_progress(statuses, start)
+        return SwarmRun(statuses, timings, released, released_at=barrier.released_at)
+    finally:
+        watcher.kill_all()
+        barrier.close()
+
+
+def run_herd(
+    count: int,
+    mode: str,
+    procs: int,
+    release_delay: float,
+    release_wait_timeout: float,
+    start: float,
+    options: JobOptions,
+) -> SwarmRun:
+    """Release `count` jobs at once, run the way `mode` and `procs` say."""
+    if mode == "process":
+        return run_process_swarm(
+            count, release_delay, release_wait_timeout, start, options
+        )
+    if mode == "fork":
         print(
-            f"Swarm finished in {total_elapsed:.2f}s. "
-            f"ok={ok} timeout={timeout} failed={failed}"
+            f"Imported the job modules in {import_job_modules():.2f}s, "
+            "once for all the forked workers."
         )
+        install_probes()
+        return run_process_swarm(
+            count, release_delay, release_wait_timeout, start, options, fork=True
+        )
+    if mode == "async":
+        if servicex_deliver_async() is None:
+            print("Async mode needs servicex.deliver_async", file=sys.stderr)
+            raise typer.Exit(code=2)
+        if procs == 1:
+            return run_async_swarm(count, start, options)
+        return run_multiprocess_async_swarm(
+            count, procs, release_delay, release_wait_timeout, start, options
+        )
+    print(f"Unknown mode {mode!r}", file=sys.stderr)
+    raise typer.Exit(code=2)
 
-        if timeout > 0 or failed > 0:
-            raise typer.Exit(code=1)
+
+PROFILES = ["herd", "constant", "ramp", "step", "poisson"]
+
+
+def arrival_times(
+    profile: str,
+    count: int,
+    rate: float,
+    end_rate: float | None = None,
+    ramp_seconds: float = 60.0,
+    step_seconds: float = 60.0,
+    step_rate: float | None = None,
+    seed: int | None = None,
+) -> list[float]:
+    """
+    When (seconds after release) each of `count` jobs is due under an open-loop profile:
+    - constant: `rate` jobs/s, evenly spaced.
+    - ramp: the rate goes linearly from `rate` to `end_rate` over `ramp_seconds`, then holds.
+    - step: the rate goes up by `step_rate` every `step_seconds`.
+    - poisson: random (exponential) gaps averaging `rate` jobs/s.
+    """
+
+    def rate_at(t: float) -> float:
+        if profile == "ramp":
+            target = rate if end_rate is None else end_rate
+            return rate + (target - rate) * min(t / ramp_seconds, 1.0)
+        if profile == "step":
+            return rate + (rate if step_rate is None else step_rate) * math.floor(
+                t / step_seconds
+            )
+        return rate
+
+    rng = random.Random(seed)
+    times = []
+    t = 0.0
+    for _ in range(count):
+        times.append(t)
+        if profile == "poisson":
+            t += rng.expovariate(rate)
+        else:
+            t += 1.0 / rate_at(t)
+    return times
+
+
+def run_open_loop_async(
+    arrivals: list[float], max_in_flight: int, start: float, options: JobOptions
+) -> SwarmRun:
+    """Start each job as a `deliver_async` call in this process when it is due."""
+    count = len(arrivals)
+    statuses = ["running"] * count
+    timings: list[dict[str, Any] | None] = [None] * count
+    finished: list[float | None] = [None] * count
+    import_job_modules()
+    released = time.perf_counter()
+    released_at = time.time()
+
+    async def run_job(idx: int, slots: asyncio.Semaphore | None) -> None:
+        await asyncio.sleep(max(0.0, released + arrivals[idx] - time.perf_counter()))
+        if slots is None:
+            outcome = await fetch_once(released_at + arrivals[idx], options)
+        else:
+            async with slots:
+                outcome = await fetch_once(released_at + arrivals[idx], options)
+        statuses[idx] = classify_result(outcome.return_code, outcome.stdout)
+        timings[idx] = outcome.timings
+        finished[idx] = time.perf_counter() - released
+        write_progress(statuses, start)
+
+    async def run_all() -> None:
+        slots = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+        await asyncio.gather(*(run_job(idx, slots) for idx in range(count)))
+
+    asyncio.run(run_all())
+    return SwarmRun(statuses, timings, released, arrivals, finished)
+
+
+def run_open_loop_processes(
+    arrivals: list[float], max_in_flight: int, start: float, options: JobOptions
+) -> SwarmRun:
+    """Start a `fetch` process for each job when it is due."""
+    script_path = Path(__file__).resolve()
+    count = len(arrivals)
+    statuses = ["running"] * count
+    timings: list[dict[str, Any] | None] = [None] * count
+    finished: list[float | None] = [None] * count
+    stdout_lines: list[list[str]] = [[] for _ in range(count)]
+    released = time.perf_counter()
+    released_at = time.time()
+
+    def on_exit(idx: int, return_code: int, _stderr: str) -> None:
+        stdout = "\n".join(stdout_lines[idx])
+        statuses[idx] = classify_result(return_code, stdout)
+        timings[idx] = parse_timings(stdout)
+        finished[idx] = time.perf_counter() - released
+
+    watcher = ChildWatcher(lambda idx, line: stdout_lines[idx].append(line), on_exit)
+    next_job = 0
+
+    def job_due(now: float) -> bool:
+        if next_job >= count or arrivals[next_job] > now:
+            return False
+        return max_in_flight <= 0 or len(watcher) < max_in_flight
+
+    try:
+        while next_job < count or len(watcher) > 0:
+            now = time.perf_counter() - released
+            while job_due(now):
+                proc = subprocess.Popen(
+                    [
+                        sys.executable,
+                        str(script_path),
+                        "fetch",
+                        "--emit-timings",
+                        "--scheduled-at",
+                        repr(released_at + arrivals[next_job]),
+                        *options.child_args(),
+                    ],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+                watcher.add(next_job, proc)
+                next_job += 1
+
+            wait = 0.5
+            if next_job < count and (max_in_flight <= 0 or len(watcher) < max_in_flight):
+                wait = min(wait, max(0.0, arrivals[next_job] - now))
+            watcher.wait(wait)
+            write_progress(statuses, start)
+        return SwarmRun(statuses, timings, released, arrivals, finished)
     finally:
-        release_path.unlink(missing_ok=True)
+        watcher.kill_all()
+
+
+@app.command()
+def swarm(
+    count: int = typer.Argument(..., min=1, help="Number of fetch jobs to start."),
+    release_delay: float = typer.Option(
+        10.0,
+        "--release-delay",
+        min=0.0,
+        help="Longest to wait for the launched workers to be ready before releasing them.",
+    ),
+    release_wait_timeout: float = typer.Option(
+        30.0,
+        "--release-wait-timeout",
+        min=0.1,
+        help="Timeout passed to child fetch jobs while waiting for the release signal.",
+    ),
+    mode: str = typer.Option(
+        "process",
+        "--mode",
+        help="process: one fetch process per job. fork: the same, but forked from a parent that "
+        "has imported the job modules once. async: concurrent deliver_async calls in one event loop.",
+    ),
+    procs: int = typer.Option(
+        1,
+        "--procs",
+        min=1,
+        help="In async mode, spread the jobs over this many worker processes.",
+    ),
+    report_json: Path | None = typer.Option(
+        None,
+        "--report-json",
+        help="Write the per-job timings and the latency summary to this JSON file.",
+    ),
+    report_csv: Path | None = typer.Option(
+        None,
+        "--report-csv",
+        help="Write the per-job timings to this CSV file.",
+    ),
+    profile: str = typer.Option(
+        "herd",
+        "--profile",
+        help="herd: release every job at once. constant, ramp, step, poisson: "
+        "start jobs over time at --rate jobs/s (open loop).",
+    ),
+    rate: float = typer.Option(
+        1.0, "--rate", min=0.001, help="Jobs per second (starting rate for ramp and step)."
+    ),
+    end_rate: float | None = typer.Option(
+        None, "--end-rate", min=0.001, help="ramp: the rate reached after --ramp-seconds."
+    ),
+    ramp_seconds: float = typer.Option(60.0, "--ramp-seconds", min=0.001),
+    step_seconds: float = typer.Option(
+        60.0, "--step-seconds", min=0.001, help="step: seconds between rate increases."
+    ),
+    step_rate: float | None = typer.Option(
+        None, "--step-rate", min=0.0, help="step: jobs/s added at each step (default --rate)."
+    ),
+    max_in_flight: int = typer.Option(
+        0,
+        "--max-in-flight",
+        min=0,
+        help="Open loop: never have more than this many queries running (0 = no cap). "
+        "Jobs that are due wait for a slot, which shows up as release time.",
+    ),
+    interval: float = typer.Option(
+        10.0, "--interval", min=0.001, help="Open loop: report window in seconds."
+    ),
+    seed: int | None = typer.Option(None, "--seed", help="poisson: random seed."),
+    summary: str = SUMMARY_OPTION,
+    nfiles: int = NFILES_OPTION,
+    samples: int = SAMPLES_OPTION,
+    complexity: int = COMPLEXITY_OPTION,
+) -> None:
+    options = job_options(summary, nfiles, samples, complexity)
+    if profile not in PROFILES:
+        print(f"Unknown profile {profile!r}", file=sys.stderr)
+        raise typer.Exit(code=2)
+    if profile != "herd":
+        if mode == "async" and servicex_deliver_async() is None:
+            print("Async mode needs servicex.deliver_async", file=sys.stderr)
+            raise typer.Exit(code=2)
+        if mode not in ("process", "async") or procs != 1:
+            print(
+                "Open-loop profiles run with --mode process or --mode async and one process",
+                file=sys.stderr,
+            )
+            raise typer.Exit(code=2)
+
+    with prebuilt_spec(options) as options:
+        start = time.perf_counter()
+        if profile != "herd":
+            arrivals = arrival_times(
+                profile, count, rate, end_rate, ramp_seconds, step_seconds, step_rate, seed
+            )
+            print(
+                f"Sending {count} jobs with a {profile} profile over "
+                f"{arrivals[-1]:.1f}s ({mode} mode)."
+            )
+            if mode == "async":
+                run = run_open_loop_async(arrivals, max_in_flight, start, options)
+            else:
+                run = run_open_loop_processes(arrivals, max_in_flight, start, options)
+            finish_swarm(run, start, report_json, report_csv, interval)
+            return
+
+        run = run_herd(
+            count, mode, procs, release_delay, release_wait_timeout, start, options
+        )
+        finish_swarm(run, start, report_json, report_csv)
+
+
+def parse_sweep(values: str, option: str) -> list[int]:
+    try:
+        parsed = [int(v) for v in values.split(",") if v.strip()]
+    except ValueError:
+        raise typer.BadParameter(f"{values!r} is not a comma separated list of numbers", param_hint=option)
+    if not parsed or min(parsed) < 1:
+        raise typer.BadParameter(f"{values!r} needs positive numbers", param_hint=option)
+    return parsed
+
+
+def benchmark_row(options: JobOptions, summary: dict[str, Any]) -> dict[str, Any]:
+    row: dict[str, Any] = {
+        "nfiles": options.nfiles,
+        "samples": options.samples,
+        "complexity": options.complexity,
+    }
+    row.update(
+        {k: summary[k] for k in ("jobs", "ok", "timeout", "failed", "jobs_per_second")}
+    )
+    for metric in ("query_seconds", "first_file_seconds", "submit_seconds"):
+        stats = summary["latency"][metric] or {}
+        name = metric.removesuffix("_seconds")
+        for pct in ("p50", "p90", "p99", "max"):
+            row[f"{name}_{pct}"] = stats.get(pct)
+    return row
+
+
+BENCHMARK_COLUMNS = [
+    "nfiles",
+    "samples",
+    "complexity",
+    "jobs",
+    "ok",
+    "timeout",
+    "failed",
+    "jobs_per_second",
+    *(
+        f"{name}_{pct}"
+        for name in ("query", "first_file", "submit")
+        for pct in ("p50", "p90", "p99", "max")
+    ),
+]
+
+
+def print_benchmark(rows: list[dict[str, Any]]) -> None:
+    def cell(value: Any) -> str:
+        return "-" if value is None else f"{value:.2f}"
+
+    print(
+        f"{'nfiles':>7}{'samples':>8}{'cplx':>5}{'ok':>5}{'fail':>5}{'jobs/s':>9}"
+        f"{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'1st file':>9}"
+    )
+    for row in rows:
+        print(
+            f"{row['nfiles']:>7}{row['samples']:>8}{row['complexity']:>5}{row['ok']:>5}"
+            f"{row['timeout'] + row['failed']:>5}{cell(row['jobs_per_second']):>9}"
+            f"{cell(row['query_p50']):>9}{cell(row['query_p90']):>9}"
+            f"{cell(row['query_p99']):>9}{cell(row['query_max']):>9}"
+            f"{cell(row['first_file_p50']):>9}"
+        )
+
+
+@app.command()
+def benchmark(
+    nfiles: str = typer.Option("1,2,5", "--nfiles", help="NFiles values to sweep (comma separated)."),
+    samples: str = typer.Option("1,2", "--samples", help="Samples per spec to sweep."),
+    complexity: str = typer.Option(
+        "1,2,3", "--complexity", help="Query complexities to sweep (1 to 4)."
+    ),
+    concurrency: int = typer.Option(
+        4, "--concurrency", min=1, help="Jobs released together at each setting."
+    ),
+    mode: str = typer.Option("process", "--mode", help="process, fork or async, as for swarm."),
+    procs: int = typer.Option(1, "--procs", min=1),
+    release_delay: float = typer.Option(10.0, "--release-delay", min=0.0),
+    release_wait_timeout: float = typer.Option(30.0, "--release-wait-timeout", min=0.1),
+    summary: str = SUMMARY_OPTION,
+    report_json: Path | None = typer.Option(
+        None, "--report-json", help="Write every setting's row and full summary to this JSON file."
+    ),
+    report_csv: Path | None = typer.Option(
+        None, "--report-csv", help="Write one row per setting to this CSV file."
+    ),
+) -> None:
+    """
+    Run a swarm of --concurrency jobs at every combination of NFiles, samples per spec and query
+    complexity, and report the throughput and latency of each, to see how ServiceX scales with
+    the size of a request.
+    """
+    settings = [
+        job_options(summary, n, s, c)
+        for n, s, c in itertools.product(
+            parse_sweep(nfiles, "--nfiles"),
+            parse_sweep(samples, "--samples"),
+            parse_sweep(complexity, "--complexity"),
+        )
+    ]
+    rows = []
+    results = []
+    for i, options in enumerate(settings):
+        print(
+            f"[{i + 1}/{len(settings)}] NFiles={options.nfiles} samples={options.samples} "
+            f"complexity={options.complexity} ({QUERY_COMPLEXITY[options.complexity]})"
+        )
+        with prebuilt_spec(options) as prebuilt:
+            start = time.perf_counter()
+            run = run_herd(
+                concurrency, mode, procs, release_delay, release_wait_timeout, start, prebuilt
+            )
+        sys.stdout.write("\n")
+        run_summary = summarise_run(run, time.perf_counter())
+        rows.append(benchmark_row(options, run_summary))
+        results.append({"settings": options._asdict(), "summary": run_summary})
+
+    print_benchmark(rows)
+    if report_json is not None:
+        report_json.write_text(json.dumps(results, indent=2))
+    if report_csv is not None:
+        with report_csv.open("w", newline="") as f:
+            writer = csv.DictWriter(f, BENCHMARK_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    if any(row["ok"] < row["jobs"] for row in rows):
+        raise typer.Exit(code=1)
 
 
 if __name__ == "__main__":
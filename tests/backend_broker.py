@@ -0,0 +1,288 @@
+# Keep a ServiceX release and its port forwards up between test sessions.
+#
+# One broker process runs per machine (per release). It makes sure the helm chart is running,
+# holds the `kubectl port-forward`s open, checks on them and restarts any that die. Test
+# sessions and pytest-xdist workers all just ask it for the endpoints - the first one to ask
+# starts it, and it keeps running after they are done so the next run skips
+# cluster and forward setup completely.
+#
+#   python -m tests.backend_broker serve [--release NAME]   (what `ensure_broker` starts)
+#   python -m tests.backend_broker stop [--release NAME]
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict
+
+# The pods we forward, and the (local and remote) port for each.
+default_forwards = {'servicex-app': 5000, 'minio': 9000, 'rabbitmq': 15672}
+
+default_broker_dir = os.environ.get('SERVICEX_TEST_BROKER_DIR', os.path.join(os.path.expanduser('~'), '.servicex_tests', 'broker'))
+
+# How often the broker checks its forwards, and how stale its heartbeat can get before a client
+# decides the broker is gone.
+check_interval = 2.0
+heartbeat_timeout = 15.0
+
+
+def _release_dir(release: str) -> str:
+    return os.path.join(default_broker_dir, release)
+
+
+def _state_file(release: str) -> str:
+    return os.path.join(_release_dir(release), 'state.json')
+
+
+def _write_json(path: str, data: dict):
+    'Write so readers never see half a file'
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_state(release: str):
+    try:
+        with open(_state_file(release), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_port_open(port: int, host: str = 'localhost') -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=1.0):
+            return True
+    except OSError:
+        return False
+
+
+def _is_healthy(state) -> bool:
+    'The broker is still running and all its forwards answer'
+    if state is None or time.time() - state.get('heartbeat', 0) > heartbeat_timeout:
+        return False
+    return all(is_port_open(p) for p in state['ports'].values())
+
+
+def endpoints(state: dict) -> Dict[str, str]:
+    'What the tests need to talk to the backend'
+    return {
+        'servicex': f"http://localhost:{state['ports']['servicex-app']}/servicex",
+        'minio': f"localhost:{state['ports']['minio']}",
+        'rabbitmq': f"http://localhost:{state['ports']['rabbitmq']}",
+    }
+
+
+class _StartLock:
+    'Only one process gets to start the broker. A lock left behind by a crashed process expires.'
+    def __init__(self, release: str, timeout: float):
+        self._path = os.path.join(_release_dir(release), 'start.lock')
+        self._timeout = timeout
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        deadline = time.time() + self._timeout
+        while True:
+            try:
+                os.close(os.open(self._path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self._path) > self._timeout:
+                        os.remove(self._path)
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise BaseException(f'Timed out waiting for the broker start lock {self._path}')
+                time.sleep(0.5)
+
+    def __exit__(self, *args):
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+
+def _is_broker_process(pid: int) -> bool:
+    'Is pid (still) a broker? Without /proc to check its command line (e.g. windows) we cannot tell, and say no.'
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return b'tests.backend_broker' in f.read()
+    except OSError:
+        return False
+
+
+def _kill_stale_broker(state: dict, timeout: float = 30):
+    'A broker whose heartbeat has stopped may be hung rather than gone - make sure it is gone'
+    pid = state.get('pid') if state is not None else None
+    if pid is None or pid == os.getpid() or not _is_broker_process(pid):
+        return
+    logging.warning(f'Backend broker {pid} for {state.get("release")} stopped answering - killing it.')
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except OSError:
+        return
+    deadline = time.time() + timeout
+    while _is_broker_process(pid) and time.time() < deadline:
+        time.sleep(0.5)
+    if _is_broker_process(pid):
+        os.kill(pid, signal.SIGKILL)
+
+
+def _spawn_broker(release: str) -> subprocess.Popen:
+    'Start a broker that will outlive this process'
+    os.makedirs(_release_dir(release), exist_ok=True)
+    log = open(os.path.join(_release_dir(release), 'broker.log'), 'a')
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, '-m', 'tests.backend_broker', 'serve', '--release', release],
+                            cwd=package_root, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, **kwargs)
+
+
+def ensure_broker(release: str, timeout: float = None) -> Dict[str, str]:
+    '''
+    Return the endpoints of a healthy backend for `release`, starting a broker (and with it the
+    chart and the port forwards) if there isn't one running already.
+    '''
+    state = _read_state(release)
+    if _is_healthy(state):
+        return endpoints(state)
+
+    from tests.config import default_chart_timeout
+    timeout = timeout if timeout is not None else default_chart_timeout + 60
+    with _StartLock(release, timeout):
+        # Someone else may have started it while we waited for the lock.
+        state = _read_state(release)
+        if not _is_healthy(state):
+            _kill_stale_broker(state)
+            logging.info(f'Starting a backend broker for {release}.')
+            broker = _spawn_broker(release)
+            deadline = time.time() + timeout
+            while not _is_healthy(state):
+                if broker.poll() is not None:
+                    raise BaseException(f'Backend broker for {release} exited with code {broker.returncode} while starting. '
+                                        f'See {_release_dir(release)}/broker.log.')
+                if time.time() > deadline:
+                    raise BaseException(f'Backend broker for {release} did not come up. See {_release_dir(release)}/broker.log.')
+                time.sleep(1)
+                state = _read_state(release)
+    return endpoints(state)
+
+
+def stop_broker(release: str, timeout: float = 60):
+    'Ask the broker to shut down its forwards and exit, and wait for it'
+    state = _read_state(release)
+    if state is None:
+        return
+    stop_file = os.path.join(_release_dir(release), 'stop')
+    open(stop_file, 'w').close()
+    deadline = time.time() + timeout
+    while os.path.exists(_state_file(release)) and time.time() < deadline:
+        if time.time() - state.get('heartbeat', 0) > heartbeat_timeout:
+            # Nobody is there to clean up
+            os.remove(_state_file(release))
+            break
+        time.sleep(0.5)
+        state = _read_state(release) or state
+    if os.path.exists(stop_file):
+        os.remove(stop_file)
+
+
+class _Forward:
+    'A port forward to one of the release pods that can be restarted'
+    def __init__(self, release: str, pod_prefix: str, port: int):
+        self.release = release
+        self.pod_prefix = pod_prefix
+        self.port = port
+        self._proc = None
+
+    def start(self):
+        from tests.config import find_pod
+        pod = find_pod(self.release, self.pod_prefix)
+        logging.info(f'Forwarding port {self.port} to {pod}.')
+        self._proc = subprocess.Popen(['kubectl', 'port-forward', pod, f'{self.port}:{self.port}'],
+                                      stdout=subprocess.DEVNULL)
+
+    def try_start(self) -> bool:
+        '''
+        `start`, but if the pod cannot be found (it is being replaced, or kubectl is having a bad
+        moment) say so and leave it for the next check rather than taking the broker down.
+        '''
+        try:
+            self.start()
+            return True
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except BaseException as e:
+            logging.warning(f'Unable to forward port {self.port} to {self.pod_prefix} ({e}) - trying again shortly.')
+            return False
+
+    def healthy(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None and is_port_open(self.port)
+
+    def stop(self):
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+
+def serve(release: str, forwards: Dict[str, int] = None):
+    'Run the broker: bring the release up, and keep the forwards alive until asked to stop'
+    from tests.config import start_helm_chart
+    forwards = forwards or default_forwards
+    stop_file = os.path.join(_release_dir(release), 'stop')
+    if os.path.exists(stop_file):
+        os.remove(stop_file)
+
+    # Being killed (e.g. by `_kill_stale_broker`) still closes the forwards below.
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
+
+    start_helm_chart(release, restart_if_running=False)
+    running = [_Forward(release, name, port) for name, port in forwards.items()]
+    started = time.time()
+    try:
+        for f in running:
+            f.try_start()
+        while not os.path.exists(stop_file):
+            for f in running:
+                if not f.healthy():
+                    # Give a forward that was just started a moment to open its port.
+                    time.sleep(1)
+                    if not f.healthy():
+                        logging.warning(f'Port forward to {f.pod_prefix} is down - restarting it.')
+                        f.stop()
+                        f.try_start()
+            if all(is_port_open(f.port) for f in running):
+                _write_json(_state_file(release), {'pid': os.getpid(), 'release': release, 'started': started,
+                                                   'heartbeat': time.time(), 'ports': forwards})
+            time.sleep(check_interval)
+    finally:
+        for f in running:
+            f.stop()
+        for path in [_state_file(release), stop_file]:
+            if os.path.exists(path):
+                os.remove(path)
+        logging.info(f'Backend broker for {release} stopped.')
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    parser = argparse.ArgumentParser(description='Keep a ServiceX release and its port forwards running for the tests.')
+    parser.add_argument('command', choices=['serve', 'stop'])
+    parser.add_argument('--release', default='servicex-integrated-testing')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args.release)
+    else:
+        stop_broker(args.release)
@@ -0,0 +1,157 @@
+# Sample what the backend is doing while a transform runs: how deep the RabbitMQ queues are and
+# how many consumers they have (from the management API that the fixtures forward on 15672),
+# and the status and restart counts of the transformer pods.
+#
+# Samples are `telemetry` timing records (see `tests/servicex_timing.py`), so they carry the same
+# time.time() timestamps as the submit/first file/download records for the request and can be
+# lined up with them. That is what tells a queue backlog apart from transformers that are not
+# running (or keep restarting) and from a slow object store.
+#
+# Sampling starts as soon as a request is submitted (`start_request_telemetry`) and stops once its
+# results have been downloaded, so the wait for the first file is covered as well.
+#
+# It is off unless SERVICEX_TELEMETRY is set, as it runs `kubectl get pod` every few seconds.
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from tests.servicex_timing import current_label, record
+
+telemetry_enabled = os.environ.get('SERVICEX_TELEMETRY', '0').lower() in ['1', 'true', 'yes']
+default_telemetry_interval = float(os.environ.get('SERVICEX_TELEMETRY_INTERVAL', '5'))
+
+# The management API of the rabbitmq in the chart, and the pods to watch.
+default_rabbitmq_endpoint = os.environ.get('SERVICEX_RABBITMQ_ENDPOINT', 'http://localhost:15672')
+default_rabbitmq_user = os.environ.get('SERVICEX_RABBITMQ_USER', 'user')
+default_rabbitmq_password = os.environ.get('SERVICEX_RABBITMQ_PASSWORD', 'leftfoot1')
+default_transformer_prefix = os.environ.get('SERVICEX_TRANSFORMER_POD_PREFIX', 'transformer-')
+
+
+def get_queue_stats(endpoint: str = None, user: str = None, password: str = None) -> List[Dict]:
+    'Depth and consumer count of every queue rabbitmq knows about'
+    from tests.servicex_test_utils import get_session
+    endpoint = endpoint or default_rabbitmq_endpoint
+    response = get_session().get(f'{endpoint}/api/queues',
+                                 auth=(user or default_rabbitmq_user, password or default_rabbitmq_password),
+                                 params={'columns': 'name,messages,messages_ready,messages_unacknowledged,consumers'},
+                                 timeout=5)
+    assert response.status_code == 200, f'Queue listing from rabbitmq failed ({response.status_code}): {response.text}'
+    return [{'name': q['name'], 'messages': q.get('messages', 0), 'ready': q.get('messages_ready', 0),
+             'unacked': q.get('messages_unacknowledged', 0), 'consumers': q.get('consumers', 0)}
+            for q in response.json()]
+
+
+class TelemetrySampler:
+    '''
+    Takes a sample of the queues and the transformer pods every `interval` seconds on a
+    background thread, from `start` until `stop`. A source that can't be reached is left out of
+    that sample (and logged once) rather than stopping the sampling.
+    '''
+    def __init__(self, request_id: str = None, interval: float = None, rabbitmq_endpoint: str = None,
+                 rabbitmq_user: str = None, rabbitmq_password: str = None, pod_prefix: str = None,
+                 label: str = None):
+        self.request_id = request_id
+        self.label = label or current_label()
+        self._interval = interval if interval is not None else default_telemetry_interval
+        self._endpoint = rabbitmq_endpoint or default_rabbitmq_endpoint
+        self._auth = (rabbitmq_user or default_rabbitmq_user, rabbitmq_password or default_rabbitmq_password)
+        self._pod_prefix = pod_prefix if pod_prefix is not None else default_transformer_prefix
+        self._stop = threading.Event()
+        self._thread = None
+        self._warned = set()
+        self.n_samples = 0
+
+    def _warn_once(self, source: str, e: BaseException):
+        if source not in self._warned:
+            self._warned.add(source)
+            logging.warning(f'Unable to sample {source} for backend telemetry: {e}')
+
+    def sample(self) -> dict:
+        'Take one sample and record it'
+        from tests.config import get_pod_status
+        fields = {}
+        try:
+            fields['queues'] = get_queue_stats(self._endpoint, *self._auth)
+        except BaseException as e:
+            self._warn_once('rabbitmq', e)
+        try:
+            fields['pods'] = get_pod_status(self._pod_prefix)
+        except BaseException as e:
+            self._warn_once('pods', e)
+        self.n_samples += 1
+        return record('telemetry', self.label, request_id=self.request_id, **fields)
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self._interval):
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# The samplers started when a request was submitted, by request id, so the one that downloads
+# the results can carry on with it (and stop it) rather than start a second one.
+_request_samplers = {}
+_request_samplers_lock = threading.Lock()
+
+
+def start_request_telemetry(request_id: str, enabled: bool = None, **sampler_options) -> Optional[TelemetrySampler]:
+    '''
+    Start sampling the backend for a request that has just been submitted, so the time before its
+    first result file is covered too. It runs until `stop_request_telemetry`. Returns the sampler
+    (the one already running, if there is one), or None if telemetry is turned off.
+    '''
+    with _request_samplers_lock:
+        if request_id in _request_samplers:
+            return _request_samplers[request_id]
+        if not (telemetry_enabled if enabled is None else enabled):
+            return None
+        sampler = TelemetrySampler(request_id, **sampler_options)
+        _request_samplers[request_id] = sampler
+    sampler.start()
+    return sampler
+
+
+def stop_request_telemetry(request_id: str):
+    'Stop the sampler running for the request, if there is one'
+    with _request_samplers_lock:
+        sampler = _request_samplers.pop(request_id, None)
+    if sampler is not None:
+        sampler.stop()
+
+
+@contextmanager
+def backend_telemetry(request_id: str = None, enabled: bool = None, **sampler_options):
+    '''
+    Sample the backend for as long as the block runs (if telemetry is turned on). If sampling was
+    started for request_id when it was submitted, that sampler is carried on with and stopped at
+    the end of the block.
+    '''
+    if request_id is not None:
+        sampler = start_request_telemetry(request_id, enabled, **sampler_options)
+        try:
+            yield sampler
+        finally:
+            stop_request_telemetry(request_id)
+        return
+
+    if not (telemetry_enabled if enabled is None else enabled):
+        yield None
+        return
+    sampler = TelemetrySampler(request_id, **sampler_options)
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
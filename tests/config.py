@@ -1,21 +1,39 @@
 # Setup and tear down the test
 import subprocess
 import json
+import os
 import time
 import logging
 import pytest
 from itertools import chain
 
+from tests.backend_broker import ensure_broker, stop_broker
+from tests.fake_backend import fake_servicex
+from tests.input_staging import input_file, put_in_container, stage_inputs
+from tests.pod_index import pod_index
+from tests.servicex_timing import record
+
 # The container that will we can use for the transformer
 default_container = "sslhep/servicex_func_adl_xaod_transformer:v0.4"
 #default_container = "sslhep/servicex_code_gen_funcadl_xaod:support_subscripts"
 
-def copy_file_to_container(container_name, file_uri, file_name):
-    logging.info(f'Making sure the file {file_name} is local in the xrootd container.')
-    cmd = f'cd /data/xrd; if [ ! -f {file_name} ]; then wget -O {file_name}-temp {file_uri}; mv {file_name}-temp {file_name}; fi'
-    r = subprocess.run(['docker', 'exec', container_name, '/bin/bash', '-c', cmd])
-    if r.returncode != 0:
-        raise BaseException(f'Unable to docker into the xrootd container "{container_name}".')
+# How long to wait for a chart to come up or go away before giving up
+default_chart_timeout = float(os.environ.get('SERVICEX_CHART_TIMEOUT', '600'))
+
+# Get the backend from a long lived broker process (see tests/backend_broker.py) rather than
+# starting port forwards in every session.
+use_backend_broker = os.environ.get('SERVICEX_TEST_USE_BROKER', '1').lower() in ['1', 'true', 'yes']
+
+def copy_file_to_container(container_name, file_uri, file_name, checksum: str = None):
+    'Make sure the xrootd container has the file, fetching it into the host input cache only if it is not there already'
+    copy_files_to_container(container_name, [input_file(file_uri, file_name, checksum=checksum)])
+
+
+def copy_files_to_container(container_name, files):
+    'Stage several input files (see tests/input_staging.py) in parallel and make sure the xrootd container has them'
+    logging.info(f'Making sure {len(files)} input file(s) are local in the xrootd container.')
+    report = stage_inputs(files)
+    put_in_container(container_name, report['files'])
 
 
 def is_chart_running(name: str):
@@ -28,46 +46,78 @@ def is_chart_running(name: str):
     return True
 
 
-def stop_helm_chart(name: str):
+def stop_helm_chart(name: str, timeout: float = None):
     'Delete a chart if it is running'
     if not is_chart_running(name):
         return
     logging.info(f'Deleteing running chart {name}.')
+    timeout = timeout if timeout is not None else default_chart_timeout
 
-    # It is running, lets do the delete now.
+    # It is running, lets do the delete now. Grab the pods first so we know what to wait on.
+    pods = [p['name'] for p in pod_index.pods(name, max_age=0)]
     subprocess.run(['helm', 'delete', name])
+    pod_index.invalidate()
 
     # It often fails on windows - so we check the listing again.
     if is_chart_running(name):
         raise BaseException(f"Unable to delete the chart {name}!")
 
-    logging.info(f'Waiting until all pods from chart {name} are off kubectl.')
-    while True:
-        s = get_pod_status(name)
-        if len(s) == 0:
-            logging.info(f'All pods from chart {name} are now deleted.')
-            return
-        time.sleep(1)
+    if len(pods) > 0:
+        logging.info(f'Waiting until all pods from chart {name} are off kubectl.')
+        result = subprocess.run(['kubectl', 'wait', '--for=delete', f'--timeout={timeout:.0f}s'] + [f'pod/{p}' for p in pods])
+        if result.returncode != 0:
+            raise BaseException(f'Pods from chart {name} were not deleted within {timeout:.0f} seconds.')
+    logging.info(f'All pods from chart {name} are now deleted.')
 
 
-def get_pod_status(name: str):
-    'Get the pod status for everything that starts with name'
-    result = subprocess.run(['kubectl', 'get', 'pod', '-o', 'json'], stdout=subprocess.PIPE)
+def get_release_workloads(name: str):
+    '''
+    The deployments and stateful sets that belong to a helm release, as `kind/name` (helm marks
+    everything it installs with a `meta.helm.sh/release-name` annotation).
+    '''
+    result = subprocess.run(['kubectl', 'get', 'deployment,statefulset', '-o', 'json'], stdout=subprocess.PIPE)
+    if result.returncode != 0:
+        raise BaseException('Unable to list the deployments and stateful sets with kubectl.')
     data = json.loads(result.stdout)
-    return [{'name': p['metadata']['name'], 'status': all([s['ready'] for s in p['status']['containerStatuses']])} for p in data['items'] if p['metadata']['name'].startswith(name)]
+    return [f"{w['kind'].lower()}/{w['metadata']['name']}" for w in data['items']
+            if w['metadata'].get('annotations', {}).get('meta.helm.sh/release-name') == name]
 
 
-def start_helm_chart(chart_name: str, restart_if_running: bool = False, config_files=['../servicex-desktop-local.yaml']):
+def wait_for_release_ready(name: str, timeout: float = None):
     '''
-    Start the testing chart.
+    Wait for every deployment and stateful set in a helm release to have all its pods ready.
+    `kubectl rollout status` watches the workloads, so we return as soon as they are up.
+    '''
+    timeout = timeout if timeout is not None else default_chart_timeout
+    workloads = get_release_workloads(name)
+    if len(workloads) == 0:
+        raise BaseException(f'No deployments or stateful sets found for chart {name}.')
+
+    waits = [(w, subprocess.Popen(['kubectl', 'rollout', 'status', w, f'--timeout={timeout:.0f}s'], stdout=subprocess.PIPE))
+             for w in workloads]
+    not_ready = [w for w, proc in waits if proc.wait() != 0]
+    if len(not_ready) > 0:
+        raise BaseException(f'Chart {name} was not ready within {timeout:.0f} seconds: {", ".join(not_ready)} did not come up.')
+
+
+def get_pod_status(name: str):
+    'Get the pod status (name, ready, phase, restarts) for everything that starts with name'
+    return pod_index.pods(name)
+
+
+def start_helm_chart(chart_name: str, restart_if_running: bool = False, config_files=['../servicex-desktop-local.yaml'], timeout: float = None):
+    '''
+    Start the testing chart. The time it takes is recorded as a `setup` timing record.
 
     Returns:
         chart-name      Name of the started chart.
         IP-Address      Where to contact anything running in the new chart
     '''
     ip_address = 'localhost'
+    start = time.time()
     if is_chart_running(chart_name) and not restart_if_running:
         logging.info(f'Chart with name {chart_name} already running. We will use it for testing.')
+        record('setup', chart=chart_name, started=False, seconds=time.time() - start)
         return (chart_name, ip_address)
 
     # Ok, make sure helm is clear of anything left over.
@@ -77,21 +127,21 @@ def start_helm_chart(chart_name: str, restart_if_running: bool = False, config_f
     # Start the chart now that the system is clean.
     cmd = ['helm', 'install', chart_name] + list(chain.from_iterable([['-f', f] for f in config_files])) + ['../ServiceX/servicex']
     result = subprocess.run(cmd, stdout=subprocess.PIPE)
+    pod_index.invalidate()
     if result.returncode != 0:
         stop_helm_chart(chart_name)
         raise BaseException("Unable to start test helm chart")
 
-    # Now, wait until it is up and running. The initial sleep is because if we don't, the containers
-    # may not have status associated with them!
+    # Now, wait until it is up and running.
+    installed = time.time()
     logging.info(f'Waiting until all pods for chart {chart_name} are ready.')
-    time.sleep(30)
-    while True:
-        time.sleep(10)
-        status = get_pod_status(chart_name)
-        is_ready = all(s['status'] for s in status)
-        if is_ready:
-            logging.info(f'All pods from chart {chart_name} are ready.')
-            return (chart_name, ip_address)
+    wait_for_release_ready(chart_name, timeout)
+    pod_index.invalidate()
+    done = time.time()
+    logging.info(f'All pods from chart {chart_name} are ready ({done - start:.0f} seconds).')
+    record('setup', chart=chart_name, started=True, seconds=done - start,
+           install_seconds=installed - start, ready_seconds=done - installed)
+    return (chart_name, ip_address)
 
 
 if __name__ == '__main__':
@@ -115,16 +165,18 @@ class forward_port:
 
 def find_pod(helm_release_name:str, pod_name:str):
     'Find the pod name in the release and return the full name'
-    pods = get_pod_status(helm_release_name)
-    named_pods = [p['name'] for p in pods if p['name'].startswith(f"{helm_release_name}-{pod_name}")]
-    assert len(named_pods) == 1
-    return named_pods[0]
+    return pod_index.find(f"{helm_release_name}-{pod_name}")
 
 @pytest.yield_fixture(scope='session')
 def running_backend():
     'Configure a backend that is up and running. Will not restart if it is running. Using the file server rather than the network for testing.'
     c_name = 'servicex-integrated-testing'
 
+    if use_backend_broker:
+        # The broker keeps the chart and forwards up between sessions, and shares them between workers.
+        yield ensure_broker(c_name)['servicex']
+        return
+
     (_, ip_address) = start_helm_chart(c_name, restart_if_running=False)
     with forward_port(find_pod(c_name, "servicex-app"), 5000):
         with forward_port(find_pod(c_name, "minio"), 9000):
@@ -137,8 +189,21 @@ def restarted_backend():
     'Configure a backend that gets restarted if it is currently running.'
     c_name = 'servicex-integrated-testing'
 
+    if use_backend_broker:
+        stop_broker(c_name)
+        start_helm_chart(c_name, restart_if_running=True)
+        yield ensure_broker(c_name)['servicex']
+        return
+
     (_, ip_address) = start_helm_chart(c_name, restart_if_running=True)
     with forward_port(find_pod(c_name, "servicex-app"), 5000):
         with forward_port(find_pod(c_name, "minio"), 9000):
             yield f'http://{ip_address}:5000/servicex'
 
+
+
+@pytest.yield_fixture(scope='module')
+def fake_backend():
+    'A fake ServiceX and minio (see tests/fake_backend.py) to run the client side against, no cluster needed.'
+    with fake_servicex() as backend:
+        yield backend
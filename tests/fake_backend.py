@@ -0,0 +1,326 @@
+# A stand-in for a ServiceX release that runs in-process, so the client side of the tests (submit,
+# status polling, listing and downloading from the object store, decoding, merging) can be run
+# and benchmarked without a cluster or a network.
+#
+# One http server plays both parts:
+#   - ServiceX: POST /servicex/transformation and GET /servicex/transformation/{id}/status
+#   - minio: the S3 calls the minio client makes (bucket location, bucket exists, ListObjectsV2,
+#     stat and get of an object). One bucket per request, as ServiceX does.
+#
+# The result files are synthetic ROOT or parquet files (whichever `result-format` the request
+# asks for) with a `JetPt` column. Their number and size, how quickly the "transformers" finish
+# them, and how often things go wrong are all set on the `FakeBackend`, and everything random is
+# seeded so a benchmark sees the same thing every time.
+#
+#   with FakeBackend(n_files=10, rows_per_file=100000, file_delay=0.1) as backend:
+#       get_servicex_data(backend.servicex_address, request_json, ignore_cache=True)
+#
+# `fake_servicex` (and the `fake_backend` fixture in tests/config.py that uses it) also points
+# the minio client at it.
+import hashlib
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+
+def make_result_file(result_format: str, n_rows: int, seed: int) -> bytes:
+    'A result file holding n_rows random jet pTs, in the format ServiceX would have written'
+    pts = np.random.default_rng(seed).exponential(50.0, n_rows)
+    if result_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        sink = pa.BufferOutputStream()
+        pq.write_table(pa.table({'JetPt': pts}), sink)
+        return sink.getvalue().to_pybytes()
+
+    import uproot
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path = os.path.join(tmpdirname, 'result.root')
+        with uproot.recreate(path) as f:
+            f['analysis'] = uproot.newtree({'JetPt': 'float64'})
+            f['analysis'].extend({'JetPt': pts})
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class FakeTransform:
+    'One submitted request: its result files and when each of them is finished'
+    def __init__(self, backend: 'FakeBackend', request_id: str, request_json: dict):
+        self.request_id = request_id
+        self.request_json = request_json
+        self.submitted = time.time()
+        fmt = 'parquet' if request_json.get('result-format') == 'parquet' else 'root-file'
+        suffix = 'parquet' if fmt == 'parquet' else 'root'
+        workers = backend.workers or int(request_json.get('workers', 1))
+
+        # Which files fail is fixed by the seed (and the request), like everything else.
+        rng = random.Random(f'{backend.seed}-{request_id}')
+        failed = set(rng.sample(range(backend.n_files), min(backend.fail_files, backend.n_files)))
+        self.files = []
+        for i in range(backend.n_files):
+            # The workers each take the next file as soon as they are free.
+            ready_after = backend.submit_delay + math.ceil((i + 1) / workers) * backend.file_delay
+            self.files.append({'name': f'{request_id}-part{i:05d}.{suffix}', 'index': i, 'format': fmt,
+                               'ready_at': self.submitted + ready_after, 'failed': i in failed})
+
+    @property
+    def completed_at(self) -> float:
+        'When the last file is finished, and the transform with it'
+        return max((f['ready_at'] for f in self.files), default=self.submitted)
+
+    def _finished(self, now: float) -> List[dict]:
+        return [f for f in self.files if f['ready_at'] <= now]
+
+    def status(self) -> dict:
+        finished = self._finished(time.time())
+        skipped = sum(1 for f in finished if f['failed'])
+        return {'request-id': self.request_id,
+                'files-processed': len(finished) - skipped,
+                'files-skipped': skipped,
+                'files-remaining': len(self.files) - len(finished)}
+
+    def objects(self) -> List[dict]:
+        'The result files that are in the bucket so far'
+        return [f for f in self._finished(time.time()) if not f['failed']]
+
+
+class FakeBackend:
+    '''
+    Serve a fake ServiceX and minio on localhost until `stop` (or the end of a `with` block).
+
+    n_files, rows_per_file     How many result files each request makes, and how big they are.
+    submit_delay, file_delay   Seconds before the first file is started, and that each file takes.
+    workers                    Files made at once (defaults to the request's `workers`).
+    fail_files                 How many files of each request fail (they are reported as skipped).
+    status_error_rate          Fraction of status calls that get a 503.
+    object_error_rate          Fraction of object downloads that get a 500.
+    '''
+    def __init__(self, n_files: int = 4, rows_per_file: int = 1000, submit_delay: float = 0.0,
+                 file_delay: float = 0.0, workers: int = None, fail_files: int = 0,
+                 status_error_rate: float = 0.0, object_error_rate: float = 0.0,
+                 seed: int = 1, port: int = 0):
+        self.n_files = n_files
+        self.rows_per_file = rows_per_file
+        self.submit_delay = submit_delay
+        self.file_delay = file_delay
+        self.workers = workers
+        self.fail_files = fail_files
+        self.status_error_rate = status_error_rate
+        self.object_error_rate = object_error_rate
+        self.seed = seed
+        self.transforms = {}
+        self.n_status_errors = 0
+        self.n_object_errors = 0
+        self._rng = random.Random(seed)
+        self._id_rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._file_cache = {}
+        self._server = ThreadingHTTPServer(('localhost', port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def servicex_address(self) -> str:
+        'What the tests use as the backend address'
+        return f'http://localhost:{self.port}/servicex'
+
+    @property
+    def minio_endpoint(self) -> str:
+        return f'localhost:{self.port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, request_json: dict) -> str:
+        request_id = str(uuid.UUID(int=self._id_rng.getrandbits(128)))
+        with self._lock:
+            self.transforms[request_id] = FakeTransform(self, request_id, request_json)
+        return request_id
+
+    def inject_error(self, kind: str) -> bool:
+        'Should this call fail?'
+        rate = self.status_error_rate if kind == 'status' else self.object_error_rate
+        with self._lock:
+            if rate <= 0 or self._rng.random() >= rate:
+                return False
+            if kind == 'status':
+                self.n_status_errors += 1
+            else:
+                self.n_object_errors += 1
+            return True
+
+    def file_bytes(self, f: dict):
+        'The contents of a result file and its md5 (made the first time it is asked for)'
+        key = (f['format'], self.rows_per_file, f['index'])
+        with self._lock:
+            cached = self._file_cache.get(key)
+        if cached is None:
+            data = make_result_file(f['format'], self.rows_per_file, self.seed * 100003 + f['index'])
+            cached = (data, hashlib.md5(data).hexdigest())
+            with self._lock:
+                self._file_cache[key] = cached
+        return cached
+
+    def find_object(self, bucket: str, key: str) -> Optional[dict]:
+        transform = self.transforms.get(bucket)
+        if transform is None:
+            return None
+        return next((f for f in transform.objects() if f['name'] == key), None)
+
+
+def _list_objects_xml(bucket: str, objects: List[dict], sizes: Dict[str, int], etags: Dict[str, str]) -> str:
+    'A ListObjectsV2 result with everything in one page'
+    modified = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+    contents = ''.join(f'<Contents><Key>{escape(f["name"])}</Key><LastModified>{modified}</LastModified>'
+                       f'<ETag>"{etags[f["name"]]}"</ETag><Size>{sizes[f["name"]]}</Size>'
+                       f'<StorageClass>STANDARD</StorageClass></Contents>' for f in objects)
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f'<Name>{escape(bucket)}</Name><Prefix></Prefix><KeyCount>{len(objects)}</KeyCount>'
+            f'<MaxKeys>1000</MaxKeys><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>')
+
+
+def _make_handler(backend: FakeBackend):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: bytes = b'', content_type: str = 'application/xml', headers: dict = None,
+                  head: bool = False):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+
+        def _send_json(self, code: int, data: dict):
+            self._send(code, json.dumps(data).encode(), 'application/json')
+
+        def _s3_error(self, code: int, s3_code: str, head: bool = False):
+            body = (f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{s3_code}</Code>'
+                    f'<Message>{s3_code}</Message><Resource>{escape(self.path)}</Resource></Error>').encode()
+            self._send(code, body, head=head)
+
+        def _body(self) -> bytes:
+            n = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(n) if n > 0 else b''
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            body = self._body()
+            if url.path.rstrip('/') != '/servicex/transformation':
+                self._send_json(404, {'message': f'Unknown endpoint {url.path}'})
+                return
+            self._send_json(200, {'request_id': backend.submit(json.loads(body))})
+
+        def do_GET(self):
+            self._get(head=False)
+
+        def do_HEAD(self):
+            self._get(head=True)
+
+        def _get(self, head: bool):
+            url = urlparse(self.path)
+            if url.path.startswith('/servicex/'):
+                self._servicex_get(url)
+            else:
+                self._s3_get(url, head)
+
+        def _servicex_get(self, url):
+            parts = url.path.strip('/').split('/')
+            if len(parts) != 4 or parts[1] != 'transformation' or parts[3] != 'status':
+                self._send_json(404, {'message': f'Unknown endpoint {url.path}'})
+                return
+            transform = backend.transforms.get(parts[2])
+            if transform is None:
+                self._send_json(404, {'message': f'No such request {parts[2]}'})
+            elif backend.inject_error('status'):
+                self._send_json(503, {'message': 'Injected failure'})
+            else:
+                self._send_json(200, transform.status())
+
+        def _s3_get(self, url, head: bool):
+            query = parse_qs(url.query, keep_blank_values=True)
+            path = unquote(url.path).lstrip('/')
+            bucket, _, key = path.partition('/')
+            if 'location' in query:
+                self._send(200, b'<?xml version="1.0" encoding="UTF-8"?>'
+                                b'<LocationConstraint xmlns="http://s3.amazonaws.com/doc/2006-03-01/"></LocationConstraint>')
+                return
+            transform = backend.transforms.get(bucket)
+            if transform is None:
+                self._s3_error(404, 'NoSuchBucket', head)
+                return
+
+            if key == '':
+                if head:
+                    self._send(200, head=True)
+                    return
+                objects = transform.objects()
+                files = {f['name']: backend.file_bytes(f) for f in objects}
+                body = _list_objects_xml(bucket, objects, {k: len(data) for k, (data, _) in files.items()},
+                                         {k: md5 for k, (_, md5) in files.items()}).encode()
+                self._send(200, body)
+                return
+
+            f = backend.find_object(bucket, key)
+            if f is None:
+                self._s3_error(404, 'NoSuchKey', head)
+                return
+            if not head and backend.inject_error('object'):
+                self._s3_error(500, 'InternalError')
+                return
+            data, md5 = backend.file_bytes(f)
+            headers = {'ETag': f'"{md5}"',
+                       'Last-Modified': formatdate(f['ready_at'], usegmt=True)}
+            self._send(200, data, 'application/octet-stream', headers, head)
+
+    return Handler
+
+
+@contextmanager
+def fake_servicex(**options):
+    'Run a `FakeBackend` (made with `options`) and have the test utilities download from it'
+    import tests.servicex_test_utils as utils
+    with FakeBackend(**options) as backend:
+        old_endpoint = utils.default_minio_endpoint
+        utils.default_minio_endpoint = backend.minio_endpoint
+        try:
+            yield backend
+        finally:
+            utils.default_minio_endpoint = old_endpoint
@@ -0,0 +1,260 @@
+# Fetch the input files the xrootd container serves onto the host once, and keep them there.
+#
+# Getting the inputs is what makes a fresh run of the func_adl tests slow, so `stage_inputs`
+# fetches a list of files in parallel into a cache on the host (SERVICEX_INPUT_CACHE, default
+# ~/.servicex_tests/inputs) that outlives the container:
+#
+# - A file that was only partly fetched is kept as `<name>.part`, and the next attempt carries on
+#   from where it stopped (with an http Range request, if the server allows it).
+# - A file only gets its real name once its size and checksum (adler32, as rucio uses, md5 or
+#   sha256 - whichever was given) check out. So anything in the cache under its own name is good
+#   and is never fetched again.
+#
+# The container gets the files either by having the cache mounted as its data directory
+# (`docker run -v ~/.servicex_tests/inputs:/data/xrd ...`), in which case there is nothing more to
+# do, or by a `docker cp` of the files it does not have yet.
+#
+#   python -m tests.input_staging [--did DID] [--container NAME] [uri ...]
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from urllib.parse import urlparse
+
+from tests.servicex_timing import record
+
+default_input_cache_dir = os.environ.get('SERVICEX_INPUT_CACHE', os.path.join(os.path.expanduser('~'), '.servicex_tests', 'inputs'))
+default_staging_workers = int(os.environ.get('SERVICEX_STAGING_WORKERS', '4'))
+
+# Grid storage (what rucio hands out) wants a grid proxy as the client certificate, and is
+# signed by the grid CAs rather than the usual public ones.
+default_grid_proxy = os.environ.get('X509_USER_PROXY', f'/tmp/x509up_u{os.getuid()}' if hasattr(os, 'getuid') else '')
+default_grid_ca_dir = os.environ.get('X509_CERT_DIR', '/etc/grid-security/certificates')
+
+# Where the xrootd container serves its files from.
+container_data_dir = '/data/xrd'
+
+_chunk_bytes = 1024 ** 2
+
+
+def input_file(uri: str, name: str = None, size: int = None, checksum: str = None, grid: bool = False) -> Dict:
+    '''
+    One file to stage. `name` defaults to the last part of the uri, and `checksum` looks like
+    "adler32:0a1b2c3d", "md5:..." or "sha256:...". A `grid` file is fetched with the grid proxy
+    and checked against the grid CAs (see `grid_credentials`).
+    '''
+    return {'uri': uri, 'name': name or os.path.basename(urlparse(uri).path), 'bytes': size, 'checksum': checksum,
+            'grid': grid}
+
+
+def grid_credentials() -> Dict:
+    'The `cert` and `verify` arguments for fetching from grid storage'
+    assert os.path.exists(default_grid_proxy), \
+        f'No grid proxy at {default_grid_proxy} (set X509_USER_PROXY, or run voms-proxy-init).'
+    return {'cert': default_grid_proxy,
+            'verify': default_grid_ca_dir if os.path.isdir(default_grid_ca_dir) else True}
+
+
+def did_input_files(did: str, schemes: List[str] = ['davs', 'https']) -> List[Dict]:
+    '''
+    The files of a rucio dataset, with their sizes and checksums. Needs the rucio client, and a
+    grid proxy to fetch them with (X509_USER_PROXY) - the https/davs doors of grid storage
+    do not let anonymous clients in.
+    '''
+    from rucio.client.replicaclient import ReplicaClient
+    scope, name = did.split(':', 1)
+    files = []
+    for replica in ReplicaClient().list_replicas([{'scope': scope, 'name': name}], schemes=schemes):
+        pfns = list(replica['pfns'].keys())
+        assert len(pfns) > 0, f'No {schemes} replica of {replica["name"]} in {did}.'
+        files.append(input_file(pfns[0].replace('davs://', 'https://', 1), replica['name'],
+                                replica.get('bytes'),
+                                f'adler32:{replica["adler32"]}' if replica.get('adler32') else None, grid=True))
+    return files
+
+
+class _Adler32:
+    'Running adler32, with the same interface as the hashlib hashes'
+    def __init__(self):
+        self._value = 1
+
+    def update(self, data: bytes):
+        self._value = zlib.adler32(data, self._value)
+
+    def hexdigest(self) -> str:
+        return f'{self._value:08x}'
+
+
+def _make_hash(checksum: str):
+    algorithm = checksum.split(':', 1)[0].lower()
+    if algorithm == 'adler32':
+        return _Adler32()
+    return hashlib.new(algorithm)
+
+
+def _hash_file(path: str, h):
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_chunk_bytes), b''):
+            h.update(block)
+
+
+def _fetch(uri: str, part: str, h, grid: bool = False) -> int:
+    '''
+    Fetch uri into part, carrying on from whatever is in part already. Everything written ends
+    up in the hash `h`. Returns the number of bytes fetched.
+    '''
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if urlparse(uri).scheme in ['', 'file']:
+        source = open(urlparse(uri).path, 'rb')
+        source.seek(offset)
+        blocks = iter(lambda: source.read(_chunk_bytes), b'')
+    else:
+        from tests.servicex_test_utils import get_session
+        response = get_session().get(uri, stream=True, timeout=60,
+                                     headers={'Range': f'bytes={offset}-'} if offset > 0 else {},
+                                     **(grid_credentials() if grid else {}))
+        if response.status_code == 416:
+            # We have all of it already.
+            response.close()
+            blocks = iter([])
+        else:
+            assert response.status_code in [200, 206], f'Fetching {uri} failed ({response.status_code}): {response.text[:200]}'
+            if response.status_code == 200 and offset > 0:
+                # The server sent the whole file rather than the rest of it - start again.
+                offset = 0
+            blocks = response.iter_content(_chunk_bytes)
+        source = response
+
+    if h is not None and offset > 0:
+        _hash_file(part, h)
+    fetched = 0
+    with source, open(part, 'r+b' if offset > 0 else 'wb') as f:
+        f.seek(offset)
+        f.truncate()
+        for block in blocks:
+            f.write(block)
+            if h is not None:
+                h.update(block)
+            fetched += len(block)
+    return fetched
+
+
+def stage_file(f: Dict, cache_dir: str = None) -> Dict:
+    '''
+    Make sure `f` (see `input_file`) is in the cache, fetching whatever is missing. Returns where
+    it is, how big it is, and how many bytes had to be fetched (0 if it was already there).
+    '''
+    cache_dir = cache_dir or default_input_cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f['name'])
+    if os.path.exists(path):
+        return {'name': f['name'], 'path': path, 'bytes': os.path.getsize(path), 'fetched': 0}
+
+    part = f'{path}.part'
+    h = _make_hash(f['checksum']) if f.get('checksum') else None
+    fetched = _fetch(f['uri'], part, h, f.get('grid', False))
+    size = os.path.getsize(part)
+    if (f.get('bytes') is not None and size != f['bytes']) \
+            or (h is not None and h.hexdigest().lstrip('0') != f['checksum'].split(':', 1)[1].lower().lstrip('0')):
+        os.unlink(part)
+        raise BaseException(f'The copy of {f["uri"]} is bad (size {size}, checksum {h.hexdigest() if h else None}, '
+                            f'expected {f.get("bytes")} and {f.get("checksum")}) - it has been removed.')
+    os.replace(part, path)
+    return {'name': f['name'], 'path': path, 'bytes': size, 'fetched': fetched}
+
+
+def stage_inputs(files: List[Dict], cache_dir: str = None, workers: int = None) -> Dict:
+    '''
+    Stage all of `files` (see `input_file` and `did_input_files`), `workers` at a time. Returns the
+    staged files along with how many bytes there are, how many had to be fetched, and the rate
+    they were fetched at. A `staging` timing record is made with the same numbers.
+    '''
+    # The same file asked for twice would have two threads writing the same .part file.
+    files = list({f['name']: f for f in files}.values())
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers or default_staging_workers) as executor:
+        staged = list(executor.map(lambda f: stage_file(f, cache_dir), files))
+    elapsed = time.time() - start
+
+    fetched = sum(s['fetched'] for s in staged)
+    report = {'files': staged,
+              'bytes': sum(s['bytes'] for s in staged),
+              'fetched_bytes': fetched,
+              'seconds': elapsed,
+              'bytes_per_second': fetched / elapsed if fetched > 0 and elapsed > 0 else None}
+    record('staging', n_files=len(staged), n_fetched=sum(1 for s in staged if s['fetched'] > 0),
+           bytes=report['bytes'], fetched_bytes=fetched, seconds=elapsed, bytes_per_second=report['bytes_per_second'])
+    if fetched > 0:
+        logging.info(f'Staged {len(staged)} input files: fetched {fetched / 1024 ** 2:.1f} MB in {elapsed:.1f} seconds '
+                     f'({report["bytes_per_second"] / 1024 ** 2:.1f} MB/s).')
+    else:
+        logging.info(f'All {len(staged)} input files were already staged.')
+    return report
+
+
+def cache_is_mounted(container_name: str, cache_dir: str = None) -> bool:
+    'Is the cache mounted as the data directory of the container?'
+    result = subprocess.run(['docker', 'inspect', '-f', '{{json .Mounts}}', container_name], stdout=subprocess.PIPE)
+    if result.returncode != 0:
+        raise BaseException(f'Unable to inspect the xrootd container "{container_name}".')
+    cache_dir = os.path.realpath(cache_dir or default_input_cache_dir)
+    return any(m.get('Destination') == container_data_dir and os.path.realpath(m.get('Source', '')) == cache_dir
+               for m in json.loads(result.stdout) or [])
+
+
+def put_in_container(container_name: str, staged: List[Dict], cache_dir: str = None):
+    'Give the container the staged files it does not have yet (nothing to do if the cache is mounted)'
+    if cache_is_mounted(container_name, cache_dir):
+        return
+    listing = subprocess.run(['docker', 'exec', container_name, 'find', container_data_dir, '-maxdepth', '1',
+                              '-type', 'f', '-printf', '%f %s\\n'], stdout=subprocess.PIPE)
+    if listing.returncode != 0:
+        raise BaseException(f'Unable to docker into the xrootd container "{container_name}".')
+    present = dict(line.rsplit(' ', 1) for line in listing.stdout.decode('utf-8').splitlines() if ' ' in line)
+    for s in staged:
+        if present.get(s['name']) == str(s['bytes']):
+            continue
+        logging.info(f'Copying {s["name"]} into the xrootd container.')
+        temp_name = f'{container_data_dir}/{s["name"]}-temp'
+        r = subprocess.run(['docker', 'cp', s['path'], f'{container_name}:{temp_name}'])
+        if r.returncode == 0:
+            r = subprocess.run(['docker', 'exec', container_name, 'mv', temp_name, f'{container_data_dir}/{s["name"]}'])
+        if r.returncode != 0:
+            raise BaseException(f'Unable to copy {s["name"]} into the xrootd container "{container_name}".')
+
+
+def clear_partial(cache_dir: str = None):
+    'Throw away any partly fetched files, so they are fetched from scratch next time'
+    cache_dir = cache_dir or default_input_cache_dir
+    if os.path.isdir(cache_dir):
+        for f_name in os.listdir(cache_dir):
+            if f_name.endswith('.part'):
+                os.unlink(os.path.join(cache_dir, f_name))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    parser = argparse.ArgumentParser(description='Stage input files into the host cache the xrootd container serves from.')
+    parser.add_argument('uris', nargs='*', help='Files to stage (http(s) or local paths).')
+    parser.add_argument('--did', action='append', default=[], help='Also stage every file of this rucio dataset.')
+    parser.add_argument('--grid', action='store_true', help='The uris are on grid storage - fetch them with the grid proxy.')
+    parser.add_argument('--container', help='Then make sure this xrootd container has them.')
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--restart', action='store_true', help='Throw away partly fetched files first.')
+    args = parser.parse_args()
+
+    if args.restart:
+        clear_partial(args.cache_dir)
+    files = [input_file(u, grid=args.grid) for u in args.uris]
+    for did in args.did:
+        files += did_input_files(did)
+    report = stage_inputs(files, args.cache_dir, args.workers)
+    if args.container:
+        put_in_container(args.container, report['files'], args.cache_dir)
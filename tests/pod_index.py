@@ -0,0 +1,95 @@
+# One place that knows what pods are running, so the fixtures, the broker and the telemetry
+# sampler don't each list (and parse) every pod in the namespace for every question they ask.
+#
+# The index runs one `kubectl get pod` for everything it is asked within `ttl` seconds. It only
+# asks kubectl for the few fields it uses (name, phase, container readiness and restarts) rather
+# than the full json of every pod, which on a busy shared namespace runs to megabytes, and it can
+# be limited to a label selector (SERVICEX_POD_SELECTOR). Pods that are still pending have no
+# container statuses yet - they are simply not ready.
+import os
+import subprocess
+import threading
+import time
+from typing import Dict, List
+
+default_pod_ttl = float(os.environ.get('SERVICEX_POD_INDEX_TTL', '2'))
+default_pod_selector = os.environ.get('SERVICEX_POD_SELECTOR')
+
+# One line per pod: name, phase, the ready flag of each container, the restart count of each.
+_pod_fields = ('{range .items[*]}{.metadata.name}{"\\t"}{.status.phase}{"\\t"}'
+               '{.status.containerStatuses[*].ready}{"\\t"}{.status.containerStatuses[*].restartCount}{"\\n"}{end}')
+
+
+def parse_pod_lines(text: str) -> List[Dict]:
+    'Turn what kubectl printed into pod records like `get_pod_status` returns'
+    pods = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        name, phase, ready, restarts = (line.split('\t') + ['', '', ''])[:4]
+        ready_flags = [r == 'true' for r in ready.split()]
+        pods.append({'name': name,
+                     'status': len(ready_flags) > 0 and all(ready_flags),
+                     'phase': phase or None,
+                     'restarts': sum(int(r) for r in restarts.split())})
+    return pods
+
+
+class PodIndex:
+    '''
+    The pods in the namespace (matching `selector`, if given), listed at most once every `ttl`
+    seconds however many lookups are made. Safe to use from several threads.
+    '''
+    def __init__(self, selector: str = None, ttl: float = None):
+        self.selector = selector if selector is not None else default_pod_selector
+        self.ttl = ttl if ttl is not None else default_pod_ttl
+        self._lock = threading.Lock()
+        self._pods = []
+        self._listed_at = None
+
+    def invalidate(self):
+        'Forget what we know - the next lookup lists the pods again (e.g. after a helm install)'
+        with self._lock:
+            self._listed_at = None
+
+    def _list(self) -> List[Dict]:
+        cmd = ['kubectl', 'get', 'pod', '-o', f'jsonpath={_pod_fields}']
+        if self.selector:
+            cmd += ['-l', self.selector]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE)
+        if result.returncode != 0:
+            raise BaseException('Unable to list the pods with kubectl.')
+        return parse_pod_lines(result.stdout.decode('utf-8'))
+
+    def all_pods(self, max_age: float = None) -> List[Dict]:
+        'Every pod, listed no more than max_age (default ttl) seconds ago'
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if self._listed_at is None or time.time() - self._listed_at > max_age:
+                self._pods = self._list()
+                self._listed_at = time.time()
+            return list(self._pods)
+
+    def pods(self, prefix: str = '', max_age: float = None) -> List[Dict]:
+        'The pods whose names start with prefix'
+        return [p for p in self.all_pods(max_age) if p['name'].startswith(prefix)]
+
+    def is_ready(self, prefix: str, max_age: float = None) -> bool:
+        'There is at least one pod starting with prefix, and they are all ready'
+        pods = self.pods(prefix, max_age)
+        return len(pods) > 0 and all(p['status'] for p in pods)
+
+    def find(self, prefix: str, max_age: float = None) -> str:
+        '''
+        The one pod whose name starts with prefix. While a pod is being replaced the old and
+        new ones can both be there, in which case the one that is ready wins.
+        '''
+        pods = self.pods(prefix, max_age)
+        if len(pods) > 1:
+            pods = [p for p in pods if p['status']]
+        assert len(pods) == 1, f'Expected one pod starting with {prefix}, found {len(pods)}.'
+        return pods[0]['name']
+
+
+# The index the tests share.
+pod_index = PodIndex()
@@ -0,0 +1,119 @@
+# A local on-disk cache of transform results, so re-running a test whose request has not
+# changed does not have to wait for ServiceX again.
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List, Optional
+
+# The parts of a transform request that determine what comes back. Things like the number of
+# workers change how fast we get an answer, not what the answer is.
+cache_key_fields = ['did', 'selection', 'columns', 'image', 'result-format', 'chunk-size']
+
+default_cache_dir = os.environ.get('SERVICEX_TEST_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.servicex_tests', 'cache'))
+default_cache_max_bytes = int(os.environ.get('SERVICEX_TEST_CACHE_MAX_BYTES', str(20 * 1024 ** 3)))
+default_ignore_cache = os.environ.get('SERVICEX_TEST_IGNORE_CACHE', '0').lower() in ['1', 'true', 'yes']
+
+_manifest_name = 'manifest.json'
+
+
+def request_cache_key(request_json: dict) -> str:
+    'Hash of the parts of a transform request that determine its result'
+    keyed = {k: request_json[k] for k in cache_key_fields if k in request_json}
+    return hashlib.sha256(json.dumps(keyed, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class PendingEntry:
+    'A cache entry being written: the result files go in `dir`. Set `keep` to False to throw them away.'
+    def __init__(self, directory: str):
+        self.dir = directory
+        self.keep = True
+
+
+class ResultCache:
+    '''
+    Result files of transform requests, one directory per request (named by `request_cache_key`).
+
+    - An entry only becomes visible once all its files have been written.
+    - Looking an entry up marks it as recently used; when the cache grows past max_bytes the
+      least recently used entries are deleted.
+    '''
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self._dir = cache_dir or default_cache_dir
+        self._max_bytes = max_bytes if max_bytes is not None else default_cache_max_bytes
+
+    def lookup(self, key: str) -> Optional[List[str]]:
+        'The result files for `key`, or None if they are not cached'
+        manifest = os.path.join(self._dir, key, _manifest_name)
+        try:
+            with open(manifest, 'r') as f:
+                info = json.load(f)
+            os.utime(manifest)
+        except (OSError, ValueError):
+            return None
+        files = [os.path.join(self._dir, key, f_name) for f_name in info['files']]
+        if not all(os.path.exists(f_name) for f_name in files):
+            return None
+        return files
+
+    @contextmanager
+    def writer(self, key: str, request_json: dict):
+        '''
+        Yields a `PendingEntry` to write the result files for `key` into. If the block exits
+        cleanly (and did not set `keep` to False) they become the cache entry, replacing whatever
+        was there before; otherwise they are thrown away.
+        '''
+        os.makedirs(self._dir, exist_ok=True)
+        staging = os.path.join(self._dir, f'{key}.tmp-{uuid.uuid4().hex}')
+        os.makedirs(staging)
+        try:
+            entry = PendingEntry(staging)
+            yield entry
+            if entry.keep:
+                files = sorted(os.listdir(staging))
+                with open(os.path.join(staging, _manifest_name), 'w') as f:
+                    json.dump({'request': request_json,
+                               'files': files,
+                               'bytes': sum(os.path.getsize(os.path.join(staging, f_name)) for f_name in files),
+                               'created': time.time()}, f)
+                self._replace(key, staging)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+
+    def _replace(self, key: str, staging: str):
+        'Make staging the entry for key. An entry that is already there is moved aside first and then deleted.'
+        entry = os.path.join(self._dir, key)
+        old = os.path.join(self._dir, f'{key}.old-{uuid.uuid4().hex}')
+        try:
+            os.rename(entry, old)
+        except OSError:
+            old = None
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Someone else filled this entry in the moment it was empty - theirs is just as fresh.
+            pass
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def evict(self):
+        'Delete least recently used entries until the cache fits in max_bytes'
+        entries = []
+        for key in os.listdir(self._dir):
+            manifest = os.path.join(self._dir, key, _manifest_name)
+            try:
+                with open(manifest, 'r') as f:
+                    n_bytes = json.load(f)['bytes']
+                entries.append((os.path.getmtime(manifest), n_bytes, key))
+            except (OSError, ValueError, KeyError):
+                continue
+        total = sum(e[1] for e in entries)
+        for _, n_bytes, key in sorted(entries):
+            if total <= self._max_bytes:
+                break
+            shutil.rmtree(os.path.join(self._dir, key), ignore_errors=True)
+            total -= n_bytes
@@ -0,0 +1,201 @@
+# Merge the per-file tables that come back from a request into one table without
+# holding every file and the merged copy in memory at the same time.
+import numpy as np
+
+
+def _is_awkward(values) -> bool:
+    'Any awkward array (numpy arrays are not, and telling so does not need awkward installed)'
+    if isinstance(values, np.ndarray):
+        return False
+    import awkward
+    return isinstance(values, awkward.array.base.AwkwardArray)
+
+
+def _is_jagged(values) -> bool:
+    'An awkward JaggedArray - other awkward arrays (masked ones, say) have counts too, but mean something else'
+    if not _is_awkward(values):
+        return False
+    import awkward
+    return isinstance(values, awkward.JaggedArray)
+
+
+def n_rows(table) -> int:
+    'Number of rows in a pandas DataFrame or a dict of columns'
+    if hasattr(table, 'columns'):
+        return len(table)
+    return max((len(c) for c in table.values()), default=0)
+
+
+def slice_rows(table, start: int, stop: int):
+    'Rows [start, stop) of a pandas DataFrame or a dict of columns'
+    if hasattr(table, 'iloc'):
+        return table.iloc[start:stop]
+    return {name: c[start:stop] for name, c in table.items()}
+
+
+class _GrowableArray:
+    '''
+    A 1D numpy array that is filled in place. When it runs out of room it is grown with
+    `ndarray.resize`, which is a `realloc` - for big arrays that remaps the pages rather than
+    copying them, so we never hold two copies of a column.
+    '''
+    def __init__(self, dtype, capacity: int = 0):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def reserve(self, n: int):
+        'Make sure there is room for at least n entries in total'
+        if n > len(self._data):
+            self._data.resize((n,), refcheck=False)
+
+    def append(self, values):
+        values = np.asarray(values)
+        if values.dtype != self._data.dtype:
+            dtype = np.result_type(self._data.dtype, values.dtype)
+            if dtype != self._data.dtype:
+                self._data = self._data.astype(dtype)
+        needed = self._size + len(values)
+        if needed > len(self._data):
+            self.reserve(max(needed, int(len(self._data) * 1.5)))
+        self._data[self._size:needed] = values
+        self._size = needed
+
+    def result(self) -> np.ndarray:
+        'Trim to size and hand back the array. Nothing can be appended after this.'
+        self._data.resize((self._size,), refcheck=False)
+        return self._data
+
+
+class _JaggedColumn:
+    'A jagged column, kept as a counts array and a (possibly itself jagged) content column'
+    def __init__(self, values, capacity: int = 0):
+        self._counts = _GrowableArray(np.int64, capacity)
+        self._content = _column_for(values.flatten())
+
+    def __len__(self):
+        return len(self._counts)
+
+    def reserve(self, n: int):
+        self._counts.reserve(n)
+
+    def append(self, values):
+        self._counts.append(values.counts)
+        self._content.append(values.flatten())
+
+    def result(self):
+        import awkward
+        return awkward.JaggedArray.fromcounts(self._counts.result(), self._content.result())
+
+
+class _AwkwardColumn:
+    '''
+    Any other awkward array (the BitMaskedArray parquet gives for the nullable content of a list
+    column, for example). We do not know how to grow these in place, so the pieces are kept and
+    handed to `awkward.concatenate` at the end. That cannot do bit masks, so those are kept as
+    byte masks (a MaskedArray) instead.
+    '''
+    def __init__(self):
+        self._pieces = []
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def reserve(self, n: int):
+        pass
+
+    def append(self, values):
+        import awkward
+        if isinstance(values, awkward.BitMaskedArray):
+            values = awkward.MaskedArray(values.boolmask(maskedwhen=True), values.content, maskedwhen=True)
+        self._pieces.append(values)
+        self._size += len(values)
+
+    def result(self):
+        import awkward
+        pieces, self._pieces = self._pieces, []
+        return pieces[0] if len(pieces) == 1 else awkward.concatenate(pieces)
+
+
+def _column_for(values, capacity: int = 0):
+    'Build the right kind of column to hold things like `values`'
+    if _is_jagged(values):
+        return _JaggedColumn(values, capacity)
+    if _is_awkward(values):
+        return _AwkwardColumn()
+    return _GrowableArray(np.asarray(values).dtype, capacity)
+
+
+class TableMerger:
+    '''
+    Merge tables (pandas DataFrames, or dicts of arrays for awkward) as they arrive.
+
+    - Each table's columns are copied into preallocated output columns and the table can then
+      be dropped, so peak memory is the merged result plus one file, not twice the result.
+    - Jagged (awkward) columns are merged as counts + content, never as numpy object arrays.
+    - A pandas MultiIndex (jagged branches) is kept; a plain index becomes a fresh RangeIndex.
+    - If only one table ever arrives it is handed back untouched.
+    - `expected_rows`, if known, is used to size the output columns up front.
+    '''
+    def __init__(self, as_data_type: str = 'pandas', expected_rows: int = None):
+        self._as_data_type = as_data_type
+        self._expected_rows = expected_rows
+        self._first = None
+        self._columns = None
+        self._index_names = None
+        self._n_tables = 0
+
+    def __len__(self):
+        'Number of tables merged so far'
+        return self._n_tables
+
+    def add(self, table):
+        self._n_tables += 1
+        if self._n_tables == 1:
+            self._first = table
+            return
+        if self._columns is None:
+            first, self._first = self._first, None
+            self._start(first, n_rows(first) + n_rows(table))
+            self._append(first)
+            del first
+        self._append(table)
+
+    def result(self):
+        assert self._n_tables > 0, 'No tables were added to merge'
+        if self._first is not None:
+            return self._first
+
+        columns = {name: c.result() for name, c in self._columns.items()}
+        if self._as_data_type != 'pandas':
+            return columns
+
+        import pandas
+        index = None
+        if self._index_names is not None:
+            index = pandas.MultiIndex.from_arrays([columns.pop(('index', i)) for i in range(len(self._index_names))],
+                                                  names=self._index_names)
+        return pandas.DataFrame(columns, index=index, copy=False)
+
+    def _items(self, table):
+        'The columns of a table, including the levels of a pandas MultiIndex'
+        if self._as_data_type != 'pandas':
+            return list(table.items())
+        items = [(c, table[c].to_numpy()) for c in table.columns]
+        if self._index_names is not None:
+            items += [(('index', i), table.index.get_level_values(i).to_numpy()) for i in range(len(self._index_names))]
+        return items
+
+    def _start(self, first, n_rows: int):
+        if self._as_data_type == 'pandas' and getattr(first.index, 'nlevels', 1) > 1:
+            # Jagged branches come back from uproot as a (entry, subentry) index - keep it.
+            self._index_names = list(first.index.names)
+        capacity = max(n_rows, self._expected_rows or 0)
+        self._columns = {name: _column_for(values, capacity) for name, values in self._items(first)}
+
+    def _append(self, table):
+        for name, values in self._items(table):
+            self._columns[name].append(values)
@@ -0,0 +1,113 @@
+# Run several transform requests at once, so they overlap on the cluster rather than
+# going one after the other.
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from tests.backend_telemetry import stop_request_telemetry
+from tests.result_cache import ResultCache, default_ignore_cache, request_cache_key
+from tests.servicex_test_utils import TransformPoller, get_servicex_data, submit_servicex_request
+from tests.servicex_timing import timing_label
+
+# Something that turns a request into whatever the test wants to check:
+#   loader(backend_address, request_json, request_id)
+# request_id is None if the results are already in the local cache.
+Loader = Callable[[str, dict, str], Any]
+
+
+def _labelled(label: str, fn, *args):
+    'Run fn with its timing records labelled (the loader threads are not running any one test)'
+    with timing_label(label):
+        return fn(*args)
+
+
+def default_loader(backend_address: str, request_json: dict, request_id: str):
+    'Load the whole result as a pandas table'
+    return get_servicex_data(backend_address, request_json, request_id=request_id)
+
+
+class TransformBatch:
+    '''
+    A set of named transform requests that are run together on one asyncio event loop.
+
+    - All the requests are submitted at once, and the status of each is tracked on the same loop.
+    - As soon as a request has its first result file ready its loader is started (on a thread,
+      at most max_loaders at a time), so the download overlaps the rest of that transform and
+      the other requests.
+    - Requests whose results are in the local result cache are never submitted.
+
+    Call `start` to run the batch in the background and `result` to wait for one of them, or
+    `await batch.run()` from async code.
+    '''
+    def __init__(self, backend_address: str, max_loaders: int = 2, ignore_cache: bool = None):
+        self._backend = backend_address
+        self._max_loaders = max_loaders
+        self._ignore_cache = default_ignore_cache if ignore_cache is None else ignore_cache
+        self._requests = {}
+        self._results = {}
+        self._thread = None
+
+    def add(self, name: str, request_json: dict, loader: Loader = None):
+        assert self._thread is None, 'Requests must be added before the batch is started'
+        self._requests[name] = (request_json, loader or default_loader)
+        self._results[name] = Future()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._requests
+
+    def start(self):
+        'Run the batch on a background thread'
+        self._thread = threading.Thread(target=lambda: asyncio.run(self.run()), daemon=True)
+        self._thread.start()
+
+    def result(self, name: str, timeout: float = None):
+        'Wait for the named request to be loaded and return what its loader returned (or raise what it raised)'
+        return self._results[name].result(timeout)
+
+    async def run(self) -> Dict[str, Any]:
+        'Run every request, and return a dict of their results. A failed request does not stop the others.'
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self._max_loaders + len(self._requests))
+        loader_slots = asyncio.Semaphore(self._max_loaders)
+        try:
+            await asyncio.gather(*[self._run_one(loop, executor, loader_slots, name, request_json, loader)
+                                   for name, (request_json, loader) in self._requests.items()])
+        finally:
+            executor.shutdown(wait=False)
+        return {name: f.result() for name, f in self._results.items() if f.exception() is None}
+
+    async def _run_one(self, loop, executor, loader_slots, name, request_json, loader):
+        future = self._results[name]
+        request_id = None
+        try:
+            if self._ignore_cache or ResultCache().lookup(request_cache_key(request_json)) is None:
+                request_id = await loop.run_in_executor(executor, _labelled, name, submit_servicex_request, self._backend, request_json)
+                print(f'{name}: submitted as request {request_id}')
+                poller = TransformPoller(self._backend, request_id)
+                while not await loop.run_in_executor(executor, poller.poll) and poller.files_processed == 0:
+                    await asyncio.sleep(poller.next_delay())
+                status_watch = asyncio.ensure_future(self._watch_status(loop, executor, poller, name))
+            else:
+                print(f'{name}: results are in the local cache')
+                status_watch = None
+
+            async with loader_slots:
+                r = await loop.run_in_executor(executor, _labelled, name, loader, self._backend, request_json, request_id)
+            if status_watch is not None:
+                status_watch.cancel()
+            future.set_result(r)
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            # The telemetry started at submission normally stops when the loader has downloaded
+            # the results - but not if it failed first, or never downloaded them.
+            if request_id is not None:
+                stop_request_telemetry(request_id)
+
+    async def _watch_status(self, loop, executor, poller: TransformPoller, name: str):
+        'Keep reporting progress until the transform is done'
+        while not poller.done:
+            await asyncio.sleep(poller.next_delay())
+            await loop.run_in_executor(executor, poller.poll)
+        print(f'{name}: transform finished. {poller.describe()}')
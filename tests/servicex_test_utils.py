@@ -1,75 +1,666 @@
 # Some utils to help out with writing tests.
+import os
+import sys
+import time
+import queue
+import random
+import threading
 import requests
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 from minio import Minio
+import urllib3
 import tempfile
 import numpy as np
 
-def wait_for_request_done(backend_address: str, request_id: str) -> None:
-    'Wait until a request has finished processing and files are ready to go'
-    status_endpoint = f'{backend_address}/transformation/{request_id}/status'
-
-    # Wait for the transform to complete.
-    done = False
-    info = None
-    while not done:
-        sleep(5)
-        status = requests.get(status_endpoint)
-        assert status.status_code == 200
-        info = status.json()
-        if ('files-remaining' in info) and (info['files-remaining'] is not None):
-            done = int(info['files-remaining']) == 0
+from tests.backend_telemetry import backend_telemetry, start_request_telemetry
+from tests.result_cache import ResultCache, default_ignore_cache, request_cache_key
+from tests.result_merge import TableMerger, n_rows, slice_rows
+from tests.servicex_timing import RequestTimings, record, timings_for
+
+# How many objects we pull back from minio at once, and how many bytes of result files we
+# allow to be downloaded-but-not-yet-read at any one time. Both can be overridden from the
+# environment (e.g. in pytest.ini).
+default_download_concurrency = int(os.environ.get('SERVICEX_DOWNLOAD_CONCURRENCY', '8'))
+default_download_byte_budget = int(os.environ.get('SERVICEX_DOWNLOAD_BYTE_BUDGET', str(2 * 1024 ** 3)))
+
+# Result objects are decoded straight out of memory unless they are bigger than this, in which
+# case they go to a temp file that is memory mapped instead.
+default_decode_mode = os.environ.get('SERVICEX_DECODE_MODE', 'memory')
+default_in_memory_max_bytes = int(os.environ.get('SERVICEX_IN_MEMORY_MAX_BYTES', str(256 * 1024 ** 2)))
+
+# Parquet results are read with the arrow dataset scanner, which only decodes the columns asked
+# for, and decodes the row groups and converts to pandas on arrow's thread pool. This is the size
+# of that pool: 0 leaves it at arrow's default (one thread per core), 1 reads on the calling thread.
+# The pool belongs to the whole process, so a size set here applies to everything using arrow.
+default_parquet_threads = int(os.environ.get('SERVICEX_PARQUET_THREADS', '0'))
+
+
+# How long to wait for a transform to finish before giving up, and the range the status polling
+# interval is allowed to move in.
+default_transform_timeout = float(os.environ.get('SERVICEX_TRANSFORM_TIMEOUT', str(3 * 60 * 60)))
+default_poll_min_interval = float(os.environ.get('SERVICEX_POLL_MIN_INTERVAL', '0.5'))
+default_poll_max_interval = float(os.environ.get('SERVICEX_POLL_MAX_INTERVAL', '30'))
+
+# Where the result files are picked up from (the minio port forward, unless the tests are
+# running against something else like `tests/fake_backend.py`).
+default_minio_endpoint = os.environ.get('SERVICEX_MINIO_ENDPOINT', 'localhost:9000')
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    'The pooled http session all the REST calls to the backend share'
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=32,
+                max_retries=urllib3.Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504],
+                                          allowed_methods=['GET']))
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+class TransformPoller:
+    '''
+    Polls the status of a transform, and keeps track of how it is getting on.
+
+    The time between polls adapts: it shrinks (down to min_interval) while files are being
+    finished and grows (up to max_interval) while nothing changes, with some jitter so many
+    pollers do not hit the backend in lock step. `wait` raises TimeoutError once the whole
+    transform has taken longer than `timeout` seconds.
+    '''
+    backoff = 1.6
+    # Longest we wait on any one status request, so a connection that hangs cannot hold us past the deadline.
+    request_timeout = 30.0
+
+    def __init__(self, backend_address: str, request_id: str, timeout: float = None,
+                 min_interval: float = None, max_interval: float = None):
+        self._status_endpoint = f'{backend_address}/transformation/{request_id}/status'
+        self._request_id = request_id
+        self._min_interval = min_interval if min_interval is not None else default_poll_min_interval
+        self._max_interval = max_interval if max_interval is not None else default_poll_max_interval
+        self._interval = self._min_interval
+        self._start = time.time()
+        self._deadline = self._start + (timeout if timeout is not None else default_transform_timeout)
+        self._first_processed = None
+        self._last_processed = None
+        self.info = {}
+
+    def poll(self) -> bool:
+        'Get the status once, update the progress numbers, and return True if the transform is done'
+        try:
+            status = get_session().get(self._status_endpoint,
+                                       timeout=max(1.0, min(self._deadline - time.time(), self.request_timeout)))
+        except requests.exceptions.RequestException as e:
+            # The session has already retried - this is what is left once it gave up.
+            raise BaseException(f'Status request for {self._request_id} failed after retrying: {e}') from e
+        assert status.status_code == 200, f'Status request for {self._request_id} failed ({status.status_code}): {status.text}'
+        self.info = status.json()
+
+        processed = self.info.get('files-processed')
+        if processed is not None:
+            processed = int(processed)
+            if self._first_processed is None:
+                self._first_processed = (time.time(), processed)
+            if processed != self._last_processed:
+                if self._last_processed is not None:
+                    print(self.describe())
+                self._interval = max(self._min_interval, self._interval / self.backoff)
+            else:
+                self._interval = min(self._max_interval, self._interval * self.backoff)
+            self._last_processed = processed
         else:
-            print (f'missing "files-remaining" in response: {info}.')
-    print(f'Finihsed processing. Final message: {info}')
+            self._interval = min(self._max_interval, self._interval * self.backoff)
+
+        return self.done
+
+    @property
+    def done(self) -> bool:
+        remaining = self.info.get('files-remaining')
+        return remaining is not None and int(remaining) == 0
+
+    @property
+    def files_per_second(self):
+        'Rate files have been finished since we started watching, or None if we cannot tell yet'
+        if self._first_processed is None or self._last_processed is None:
+            return None
+        t0, n0 = self._first_processed
+        elapsed = time.time() - t0
+        if elapsed <= 0 or self._last_processed == n0:
+            return None
+        return (self._last_processed - n0) / elapsed
+
+    @property
+    def seconds_remaining(self):
+        'Estimated time to finish, or None if we cannot tell yet'
+        rate = self.files_per_second
+        remaining = self.info.get('files-remaining')
+        if rate is None or remaining is None:
+            return None
+        return int(remaining) / rate
+
+    def describe(self) -> str:
+        rate = self.files_per_second
+        eta = self.seconds_remaining
+        parts = [f'Transform {self._request_id}: {self.info.get("files-processed")} files processed',
+                 f'{self.info.get("files-remaining")} remaining',
+                 f'{self.info.get("files-skipped", 0)} skipped']
+        if rate is not None:
+            parts.append(f'{rate:.2f} files/s')
+        if eta is not None:
+            parts.append(f'about {eta:.0f} seconds left')
+        return ', '.join(parts) + f' ({time.time() - self._start:.0f} seconds so far)'
+
+    @property
+    def files_processed(self) -> int:
+        return int(self.info.get('files-processed') or 0)
+
+    def next_delay(self) -> float:
+        'Seconds until the next poll should happen'
+        now = time.time()
+        if now >= self._deadline:
+            raise TimeoutError(f'Transform {self._request_id} did not finish in time. Last status: {self.info}')
+        delay = random.uniform(0.5, 1.0) * self._interval
+        return min(delay, self._deadline - now)
+
+    def wait(self):
+        'Sleep until it is time for the next poll'
+        sleep(self.next_delay())
+
+
+def wait_for_request_done(backend_address: str, request_id: str, timeout: float = None) -> dict:
+    'Wait until a request has finished processing and files are ready to go. Returns the final status.'
+    poller = TransformPoller(backend_address, request_id, timeout=timeout)
+    while not poller.poll():
+        poller.wait()
+    print(f'Finished processing. {poller.describe()}. Final message: {poller.info}')
+    return poller.info
+
+
+def is_request_done(backend_address: str, request_id: str) -> bool:
+    'Ask the backend once if the transform has finished all its files'
+    return TransformPoller(backend_address, request_id).poll()
+
 
-def get_servicex_request_data(backend_address: str, request_id: str, as_data_type = 'pandas'):
+def make_minio_client(minio_endpoint: str = None, max_connections: int = default_download_concurrency) -> Minio:
+    'Create a minio client with a connection pool big enough to feed all the download threads'
+    minio_endpoint = minio_endpoint or default_minio_endpoint
+    http_client = urllib3.PoolManager(
+        maxsize=max_connections,
+        timeout=urllib3.Timeout(connect=10, read=300),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]))
+    return Minio(minio_endpoint,
+                 access_key='miniouser',
+                 secret_key='leftfoot1',
+                 secure=False,
+                 http_client=http_client)
+
+
+def iter_request_objects(backend_address: str, request_id: str, minio_client: Minio, timeout: float = None):
     '''
-    Get the data back in a table. Assumes request is done and there is only one result file.
+    Yield the minio objects for a request as they appear in its bucket.
 
-    as_data_type can be either pandas or awkward, which determines the return type.
+    If the transform is still running we keep re-listing the bucket until the backend says there
+    are no files remaining, so the caller can start on the first files while the rest are being made.
+    The status is polled with a `TransformPoller`, so `timeout` is as for that.
     '''
-    # Now get the data
-    # TODO: This should not be hardwired right now!
-    # Really, it should come back in the request status!
-    minio_endpoint = "localhost:9000"
-    minio_client = Minio(minio_endpoint,
-                    access_key='miniouser',
-                    secret_key='leftfoot1',
-                    secure=False)
-    objects = list(minio_client.list_objects(request_id))
-    assert len(objects) >= 1
-    print(f'Found {len(objects)} objects to read back from minio')
-
-    sample_files = list([file.object_name for file in objects])
-    assert len(sample_files) > 0
-    import uproot
-    import uproot_methods
-    import pandas
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        def file_to_table(r_id, sample_file_name, output_name):
-            minio_client.fget_object(r_id,
-                                    sample_file_name,
-                                    output_name)
-            f_in = uproot.open(output_name)
+    poller = TransformPoller(backend_address, request_id, timeout=timeout)
+    timings = timings_for(request_id)
+    seen = set()
+    while True:
+        # Check for done before listing so the last listing is guaranteed to see every file.
+        done = poller.poll()
+        if done:
+            timings.done(int(poller.info.get('files-skipped') or 0))
+        if minio_client.bucket_exists(request_id):
+            for obj in minio_client.list_objects(request_id):
+                if obj.object_name not in seen:
+                    seen.add(obj.object_name)
+                    timings.file_ready(obj.object_name)
+                    yield obj
+        if done:
+            print(f'Finished processing. {poller.describe()}')
+            return
+        poller.wait()
+
+
+class _ByteBudget:
+    'Hold off starting new downloads until there is room for them in the byte budget'
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._in_flight = 0
+        self._cv = threading.Condition()
+
+    def acquire(self, n_bytes: int, stop: threading.Event) -> bool:
+        'Returns False if we were asked to stop while waiting'
+        with self._cv:
+            # An object bigger than the whole budget is allowed through on its own.
+            while self._in_flight > 0 and self._in_flight + n_bytes > self._limit:
+                if stop.is_set():
+                    return False
+                self._cv.wait(0.5)
+            self._in_flight += n_bytes
+            return True
+
+    def release(self, n_bytes: int):
+        with self._cv:
+            self._in_flight -= n_bytes
+            self._cv.notify_all()
+
+
+def stream_request_objects(backend_address: str, request_id: str, handler, concurrency: int = None, byte_budget: int = None, minio_client: Minio = None):
+    '''
+    Run `handler(minio_client, index, obj)` on every result object of a request on a pool of
+    threads, and yield what it returns as soon as each one finishes.
+
+    - Objects are picked up while the transform is still running.
+    - At most `concurrency` handlers run at once.
+    - At most `byte_budget` bytes of objects are handed out but not yet consumed by the caller.
+    '''
+    concurrency = concurrency or default_download_concurrency
+    budget = _ByteBudget(byte_budget or default_download_byte_budget)
+    minio_client = minio_client or make_minio_client(max_connections=concurrency)
+
+    results = queue.Queue()
+    stop = threading.Event()
+    _done = object()
+
+    def run_one(index, obj):
+        try:
+            results.put((obj, handler(minio_client, index, obj), None))
+        except BaseException as e:
+            results.put((obj, None, e))
+
+    def feed(executor):
+        try:
+            n_submitted = 0
+            for obj in iter_request_objects(backend_address, request_id, minio_client):
+                if not budget.acquire(obj.size or 0, stop):
+                    return
+                executor.submit(run_one, n_submitted, obj)
+                n_submitted += 1
+            results.put((_done, n_submitted, None))
+        except BaseException as e:
+            results.put((_done, None, e))
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    feeder = threading.Thread(target=feed, args=(executor,), daemon=True)
+    feeder.start()
+    try:
+        n_expected = None
+        n_seen = 0
+        while n_expected is None or n_seen < n_expected:
+            obj, r, err = results.get()
+            if err is not None:
+                raise err
+            if obj is _done:
+                n_expected = r
+                continue
+            n_seen += 1
             try:
-                r = f_in[f_in.keys()[0]]
-                assert r is not None
-                if as_data_type == 'pandas':
-                    return r.pandas.df()
-                else:
-                    return r.arrays()
-                    
+                yield r
             finally:
-                f_in._context.source.close()
+                budget.release(obj.size or 0)
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
 
-        all_data = (file_to_table(request_id, s_file, f'{tmpdirname}/sample_{i}.root') for i, s_file in enumerate(sample_files))
-        if len(sample_files) == 1:
-            return list(all_data)[0]
+class _ObjectBuffer(threading.local):
+    'A per-thread bytearray that result objects are read into, reused from one object to the next'
+    def __init__(self):
+        self._buffer = bytearray(0)
+
+    def read(self, minio_client: Minio, obj) -> memoryview:
+        'Stream `obj` into the buffer and return a view of just its bytes'
+        if len(self._buffer) < obj.size:
+            # Never resize in place - a view handed out for the last object may still be alive.
+            self._buffer = bytearray(max(obj.size, int(len(self._buffer) * 1.5)))
+        view = memoryview(self._buffer)
+        response = minio_client.get_object(obj.bucket_name, obj.object_name)
+        try:
+            n_read = 0
+            while n_read < obj.size:
+                n = response.readinto(view[n_read:obj.size])
+                if n == 0:
+                    break
+                n_read += n
+            assert n_read == obj.size, f'Short read of {obj.object_name}: {n_read} of {obj.size} bytes'
+        finally:
+            response.close()
+            response.release_conn()
+        return view[:n_read]
+
+
+def _open_root_buffer(buffer):
+    'Open a ROOT file that is sitting in memory with uproot, without copying it'
+    import uproot
 
+    class BufferSource(uproot.source.memmap.MemmapSource):
+        def __init__(self, path):
+            self.path = path
+            self._source = np.frombuffer(buffer, dtype=np.uint8)
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    return uproot.open('in-memory.root', localsource=BufferSource)
+
+
+def _root_to_table(f_in, as_data_type: str, columns=None):
+    try:
+        r = f_in[f_in.keys()[0]]
+        assert r is not None
         if as_data_type == 'pandas':
-            return pandas.concat(all_data)
+            return r.pandas.df(columns)
         else:
-            frames = list(all_data)
-            col_names = frames[0].keys()
-            return {c: np.concatenate([ar[c] for ar in frames]) for c in col_names}
+            return r.arrays(columns)
+    finally:
+        f_in._context.source.close()
+
+
+_arrow_default_threads = None
+_arrow_threads_lock = threading.Lock()
+
+
+def _set_arrow_threads(threads: int):
+    '''
+    Size arrow's thread pool for `threads` (see `default_parquet_threads`), or put it back to
+    the size arrow started with for 0. The pool is process-wide, and several result files are
+    decoded at once, so it is set rather than changed and restored around each read.
+    '''
+    import pyarrow as pa
+    global _arrow_default_threads
+    with _arrow_threads_lock:
+        if _arrow_default_threads is None:
+            _arrow_default_threads = pa.cpu_count()
+        wanted = threads if threads > 1 else _arrow_default_threads
+        if threads != 1 and pa.cpu_count() != wanted:
+            pa.set_cpu_count(wanted)
+
+
+def _parquet_to_table(source, as_data_type: str, columns=None, threads: int = None):
+    import pyarrow.dataset as ds
+    threads = default_parquet_threads if threads is None else threads
+    assert threads >= 0, f'The number of parquet decode threads must be 0 or more, not {threads}'
+    _set_arrow_threads(threads)
+    use_threads = threads != 1
+    table = ds.ParquetFileFormat().make_fragment(source).to_table(columns=columns, use_threads=use_threads)
+    if as_data_type == 'pandas':
+        # Hand each arrow column back as soon as it has been converted, rather than holding two
+        # copies of the whole table at the peak.
+        return table.to_pandas(use_threads=use_threads, split_blocks=True, self_destruct=True)
+    else:
+        return {c.encode(): _arrow_column_to_array(table.column(c)) for c in table.column_names}
+
+
+def _arrow_column_to_array(column):
+    'Flat columns become numpy arrays, lists become awkward jagged arrays (like uproot gives us)'
+    import pyarrow as pa
+    # A column comes back in one chunk per row group (and in none at all from an empty file),
+    # and awkward would make a ChunkedArray of that rather than one JaggedArray.
+    column = column.combine_chunks()
+    if pa.types.is_list(column.type) or pa.types.is_large_list(column.type):
+        import awkward
+        return awkward.fromarrow(column)
+    return column.to_numpy(zero_copy_only=False)
+
+
+def decode_result(source, as_data_type: str = 'pandas', columns=None):
+    '''
+    Turn one result object into a table. `source` is either a file name or a buffer holding the
+    whole file. ROOT and parquet files are both understood (we look at the magic bytes).
+    If `columns` is given only those columns are read.
+    '''
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            magic = f.read(4)
+    else:
+        magic = bytes(source[:4])
+
+    if magic == b'PAR1':
+        import pyarrow as pa
+        if isinstance(source, str):
+            return _parquet_to_table(pa.memory_map(source), as_data_type, columns)
+        return _parquet_to_table(pa.BufferReader(pa.py_buffer(source)), as_data_type, columns)
+
+    import uproot
+    import uproot_methods  # noqa
+    f_in = uproot.open(source) if isinstance(source, str) else _open_root_buffer(source)
+    return _root_to_table(f_in, as_data_type, columns)
+
+
+def peak_rss_mb():
+    'Peak resident memory of this process in MB, or None if we cannot tell on this platform'
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def iter_servicex_request_data(backend_address: str, request_id: str, as_data_type='pandas', columns=None, chunk_rows: int = None,
+                               concurrency: int = None, byte_budget: int = None, decode_mode: str = None, in_memory_max_bytes: int = None):
+    '''
+    Yield the data back a piece at a time rather than as one big table, so it can be summarised
+    in bounded memory. The transform does not need to be finished - result files are downloaded
+    in parallel as they appear, and each is read in as soon as it arrives.
+
+    as_data_type can be either pandas or awkward, which determines the type of each piece.
+    columns, if given, is the list of columns to read - everything else is skipped.
+    chunk_rows: None yields one table per result file (in the order they arrive), otherwise tables
+    of exactly chunk_rows rows (the last one may be short).
+    concurrency and byte_budget control the downloader (see `stream_request_objects`).
+    decode_mode is `memory` (read each object into a buffer and decode it from there) or `file`
+    (write each to a temp file first). In `memory` mode objects larger than in_memory_max_bytes
+    still go via a (memory mapped) temp file.
+    '''
+    tables = _iter_request_tables(backend_address, request_id, as_data_type, columns,
+                                  concurrency, byte_budget, decode_mode, in_memory_max_bytes)
+    if chunk_rows is None:
+        return tables
+    return _rechunk(tables, chunk_rows, as_data_type)
+
+
+def _iter_request_tables(backend_address, request_id, as_data_type, columns=None, concurrency=None, byte_budget=None,
+                         decode_mode=None, in_memory_max_bytes=None, keep_dir: str = None):
+    'One table per result file. If keep_dir is given every result file is also written there and left behind.'
+    decode_mode = decode_mode or default_decode_mode
+    in_memory_max_bytes = in_memory_max_bytes if in_memory_max_bytes is not None else default_in_memory_max_bytes
+    assert decode_mode in ['memory', 'file'], f'Unknown decode mode {decode_mode}'
+
+    # Now get the data
+    # TODO: Really, the minio endpoint should come back in the request status!
+    minio_client = make_minio_client(max_connections=concurrency or default_download_concurrency)
+
+    start = time.time()
+    timings = timings_for(request_id)
+    buffers = _ObjectBuffer()
+    n_objects = 0
+    n_bytes = 0
+    with tempfile.TemporaryDirectory() as tmpdirname, backend_telemetry(request_id, label=timings.label):
+        def download(client, index, obj):
+            'Returns the buffer or file name to decode, and if the file should be deleted afterwards'
+            if keep_dir is not None:
+                output_name = os.path.join(keep_dir, f'part_{index:05d}')
+                client.fget_object(obj.bucket_name, obj.object_name, output_name)
+                return output_name, False
+
+            if decode_mode == 'memory' and obj.size <= in_memory_max_bytes:
+                return buffers.read(client, obj), False
+
+            output_name = f'{tmpdirname}/sample_{index}'
+            client.fget_object(obj.bucket_name, obj.object_name, output_name)
+            return output_name, True
+
+        def object_to_table(client, index, obj):
+            t_start = time.time()
+            source, delete = download(client, index, obj)
+            t_downloaded = time.time()
+            try:
+                return decode_result(source, as_data_type, columns)
+            finally:
+                if delete:
+                    os.remove(source)
+                timings.object_read(obj.object_name, obj.size, t_downloaded - t_start, time.time() - t_downloaded)
+
+        for obj, table in stream_request_objects(backend_address, request_id,
+                                                 lambda client, index, obj: (obj, object_to_table(client, index, obj)),
+                                                 concurrency=concurrency, byte_budget=byte_budget,
+                                                 minio_client=minio_client):
+            n_objects += 1
+            n_bytes += obj.size
+            yield table
+            del table
+
+    assert n_objects >= 1
+    timings.finish()
+    rss = peak_rss_mb()
+    print(f'Read back {n_objects} objects ({n_bytes / 1024 ** 2:.1f} MB) from minio in {time.time() - start:.1f} seconds '
+          f'using {decode_mode} decoding. Peak RSS {"unknown" if rss is None else f"{rss:.0f} MB"}.')
+
+
+def _rechunk(tables, chunk_rows: int, as_data_type: str):
+    'Re-cut a stream of tables into tables of chunk_rows rows'
+    assert chunk_rows > 0
+    pending = TableMerger(as_data_type)
+    n_pending = 0
+    for table in tables:
+        start = 0
+        n = n_rows(table)
+        while n - start >= chunk_rows - n_pending:
+            stop = start + chunk_rows - n_pending
+            pending.add(slice_rows(table, start, stop))
+            yield pending.result()
+            pending = TableMerger(as_data_type)
+            n_pending = 0
+            start = stop
+        if start < n:
+            pending.add(slice_rows(table, start, n))
+            n_pending += n - start
+    if n_pending > 0:
+        yield pending.result()
+
+
+def get_servicex_request_data(backend_address: str, request_id: str, as_data_type='pandas', concurrency: int = None, byte_budget: int = None,
+                              decode_mode: str = None, in_memory_max_bytes: int = None, expected_rows: int = None):
+    '''
+    Get the data back in a table. The transform does not need to be finished - result files are
+    downloaded in parallel as they appear, and each is read in as soon as it arrives.
+
+    as_data_type can be either pandas or awkward, which determines the return type.
+    concurrency, byte_budget, decode_mode and in_memory_max_bytes are as for `iter_servicex_request_data`.
+    expected_rows, if known, lets the merge allocate the full output columns up front.
+    '''
+    return _merge_tables(iter_servicex_request_data(backend_address, request_id, as_data_type,
+                                                    concurrency=concurrency, byte_budget=byte_budget,
+                                                    decode_mode=decode_mode, in_memory_max_bytes=in_memory_max_bytes),
+                         as_data_type, expected_rows)
+
+
+def _merge_tables(tables, as_data_type: str, expected_rows: int = None):
+    'Merge a stream of tables into one, and record how long the merging (not the reading) took'
+    merger = TableMerger(as_data_type, expected_rows=expected_rows)
+    merge_seconds = 0.0
+    for table in tables:
+        t_start = time.time()
+        merger.add(table)
+        del table
+        merge_seconds += time.time() - t_start
+    t_start = time.time()
+    result = merger.result()
+    merge_seconds += time.time() - t_start
+    record('merge', seconds=merge_seconds, tables=len(merger))
+    return result
+
+
+def submit_servicex_request(backend_address: str, request_json: dict) -> str:
+    'Start a transform off and return its request id'
+    t_start = time.time()
+    response = get_session().post(f'{backend_address}/transformation', json=request_json)
+    assert response.status_code == 200, f'Transform request failed ({response.status_code}): {response.text}'
+    request_id = response.json()["request_id"]
+    assert isinstance(request_id, str)
+    timings = timings_for(request_id)
+    timings.submitted(t_start, time.time())
+    # Stopped once the results have been downloaded (see `_iter_request_tables`).
+    start_request_telemetry(request_id, label=timings.label)
+    return request_id
+
+
+def iter_servicex_data(backend_address: str, request_json: dict, as_data_type='pandas', columns=None, chunk_rows: int = None,
+                       ignore_cache: bool = None, cache: ResultCache = None, request_id: str = None,
+                       store_in_cache: bool = True, **download_options):
+    '''
+    Run a transform request and yield its data back a piece at a time (see `iter_servicex_request_data`).
+
+    The result files are kept in the local result cache (see `tests.result_cache`), keyed on the
+    parts of `request_json` that determine the result. If they are already there ServiceX is not
+    contacted at all. ignore_cache (or SERVICEX_TEST_IGNORE_CACHE) forces the request to be run;
+    its results still refresh the cache, unless store_in_cache is False - then nothing is written
+    to disk and the result objects are decoded as they are downloaded (see `decode_mode`).
+    If request_json has already been submitted, pass its request_id and it will not be sent again.
+    '''
+    ignore_cache = default_ignore_cache if ignore_cache is None else ignore_cache
+    cache = cache or ResultCache()
+    key = request_cache_key(request_json)
+
+    files = None if ignore_cache or request_id is not None else cache.lookup(key)
+    if files is not None:
+        print(f'Using {len(files)} cached result files for request {key}')
+        tables = _iter_cached_tables(files, key, as_data_type, columns)
+    elif not store_in_cache:
+        if request_id is None:
+            request_id = submit_servicex_request(backend_address, request_json)
+        tables = _iter_request_tables(backend_address, request_id, as_data_type, columns, **download_options)
+    else:
+        tables = _iter_and_cache_request(backend_address, request_json, request_id, key, cache, as_data_type, columns, download_options)
+
+    if chunk_rows is not None:
+        tables = _rechunk(tables, chunk_rows, as_data_type)
+    return tables
+
+
+def _iter_cached_tables(files, key, as_data_type, columns):
+    timings = RequestTimings(f'cache-{key}')
+    for f_name in files:
+        t_start = time.time()
+        table = decode_result(f_name, as_data_type, columns)
+        timings.object_read(os.path.basename(f_name), os.path.getsize(f_name), 0.0, time.time() - t_start)
+        yield table
+        del table
+    timings.finish()
+
+
+def _iter_and_cache_request(backend_address, request_json, request_id, key, cache, as_data_type, columns, download_options):
+    if request_id is None:
+        request_id = submit_servicex_request(backend_address, request_json)
+    timings = timings_for(request_id)
+    with cache.writer(key, request_json) as entry:
+        for table in _iter_request_tables(backend_address, request_id, as_data_type, columns,
+                                          keep_dir=entry.dir, **download_options):
+            yield table
+            del table
+        if timings.files_skipped > 0:
+            # An incomplete result must not be handed out as the answer next time.
+            print(f'Not caching the results of {request_id}: {timings.files_skipped} files were skipped.')
+            entry.keep = False
+
+
+def get_servicex_data(backend_address: str, request_json: dict, as_data_type='pandas', expected_rows: int = None,
+                      ignore_cache: bool = None, cache: ResultCache = None, request_id: str = None, **download_options):
+    '''
+    Run a transform request (or pick its result out of the local cache) and return the data in a
+    table. Arguments are as for `iter_servicex_data` and `get_servicex_request_data`.
+    '''
+    return _merge_tables(iter_servicex_data(backend_address, request_json, as_data_type,
+                                            ignore_cache=ignore_cache, cache=cache, request_id=request_id, **download_options),
+                         as_data_type, expected_rows)
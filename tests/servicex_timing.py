@@ -0,0 +1,206 @@
+# Timing records for bringing the cluster up and for the phases of a request (submit,
+# transform, download, decode, merge) so a slow run can be pinned on the part that got slower.
+#
+# Records are JSON lines. They are appended to the file named by SERVICEX_TIMING_LOG (if set),
+# which is how `scripts/run_test_continuous.py` picks them up from the pytest run it starts.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+_lock = threading.Lock()
+_label = threading.local()
+_records = []
+
+
+def timing_log_file() -> Optional[str]:
+    return os.environ.get('SERVICEX_TIMING_LOG')
+
+
+def current_label() -> Optional[str]:
+    '''
+    What the records made on this thread belong to: whatever `timing_label` set, otherwise the
+    test pytest is currently running.
+    '''
+    label = getattr(_label, 'value', None)
+    if label is not None:
+        return label
+    current_test = os.environ.get('PYTEST_CURRENT_TEST')
+    if current_test is None:
+        return None
+    # Looks like "tests/test_x.py::test_name (call)"
+    return current_test.split('::')[-1].split(' ')[0]
+
+
+@contextmanager
+def timing_label(label: str):
+    'Label the records made on this thread (e.g. with the test a background request belongs to)'
+    old = getattr(_label, 'value', None)
+    _label.value = label
+    try:
+        yield
+    finally:
+        _label.value = old
+
+
+def record(kind: str, label: str = None, **fields) -> dict:
+    'Make a timing record, keep it, and append it to the timing log if there is one'
+    r = dict(kind=kind, label=label or current_label(), time=time.time(), **fields)
+    with _lock:
+        _records.append(r)
+        log_file = timing_log_file()
+        if log_file is not None:
+            with open(log_file, 'a') as f:
+                f.write(json.dumps(r) + '\n')
+    return r
+
+
+def recorded(kind: str = None) -> List[dict]:
+    'The records made in this process so far'
+    with _lock:
+        return [r for r in _records if kind is None or r['kind'] == kind]
+
+
+def read_timing_log(log_file: str) -> List[dict]:
+    'Load the records from a timing log'
+    if not os.path.exists(log_file):
+        return []
+    with open(log_file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class RequestTimings:
+    '''
+    Collects the timings of one request as it goes, and writes one `object` record per result
+    file and a `request` summary record when it is finished.
+    All times are unix timestamps (time.time()) so they line up with anything else recorded.
+    '''
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.label = current_label()
+        self.submit_start = None
+        self.submit_end = None
+        self.first_file_ready = None
+        self.last_file_ready = None
+        self.transform_done = None
+        self.n_objects = 0
+        self.download_bytes = 0
+        self.download_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.files_skipped = 0
+        self._lock = threading.Lock()
+
+    def submitted(self, start: float, end: float):
+        self.submit_start = start
+        self.submit_end = end
+        record('submit', self.label, request_id=self.request_id, start=start, seconds=end - start)
+
+    def file_ready(self, object_name: str):
+        'A result file has shown up in the object store'
+        now = time.time()
+        if self.first_file_ready is None:
+            self.first_file_ready = now
+        self.last_file_ready = now
+
+    def done(self, files_skipped: int = 0):
+        'The backend says the transform has finished (having given up on files_skipped files)'
+        if self.transform_done is None:
+            self.transform_done = time.time()
+        self.files_skipped = files_skipped
+
+    def object_read(self, object_name: str, n_bytes: int, download_seconds: float, decode_seconds: float):
+        'Called from the download threads as each result object is read in'
+        with self._lock:
+            self.n_objects += 1
+            self.download_bytes += n_bytes
+            self.download_seconds += download_seconds
+            self.decode_seconds += decode_seconds
+        record('object', self.label, request_id=self.request_id, object=object_name, bytes=n_bytes,
+               download_seconds=download_seconds, decode_seconds=decode_seconds)
+
+    def phases(self) -> Dict[str, Optional[float]]:
+        'Seconds spent in each phase (None if we never saw it)'
+        def since_submit(t):
+            if t is None or self.submit_end is None:
+                return None
+            return t - self.submit_end
+        return {
+            'submit_seconds': None if self.submit_start is None else self.submit_end - self.submit_start,
+            'first_file_seconds': since_submit(self.first_file_ready),
+            'last_file_seconds': since_submit(self.last_file_ready),
+            'transform_seconds': since_submit(self.transform_done),
+            'download_bytes': self.download_bytes,
+            'download_seconds': self.download_seconds,
+            'decode_seconds': self.decode_seconds,
+        }
+
+    def finish(self):
+        record('request', self.label, request_id=self.request_id, objects=self.n_objects,
+               submit_start=self.submit_start, first_file_ready=self.first_file_ready,
+               last_file_ready=self.last_file_ready, transform_done=self.transform_done,
+               files_skipped=self.files_skipped,
+               **self.phases())
+        with _lock:
+            _open_requests.pop(self.request_id, None)
+
+
+_open_requests = {}
+
+
+def timings_for(request_id: str) -> RequestTimings:
+    'The timings of a request that is in progress (made the first time it is asked for)'
+    with _lock:
+        if request_id not in _open_requests:
+            _open_requests[request_id] = RequestTimings(request_id)
+        return _open_requests[request_id]
+
+
+# The columns `summarise_phases` produces, in the order they should be written out.
+phase_columns = ['Cluster Setup Time', 'Submit Time', 'Time To First File', 'Time To Last File', 'Transform Time',
+                 'Download Bytes', 'Download Time', 'Decode Time', 'Merge Time',
+                 'Peak Queue Depth', 'Min Queue Consumers', 'Transformer Restarts']
+
+
+def summarise_phases(records: List[dict], label: str = None) -> Dict[str, Optional[float]]:
+    '''
+    Add up the phase timings of all the requests in `records` (only those with `label`, if
+    given) into the `phase_columns`. A phase that never showed up is None.
+    The backend telemetry columns are the worst any `telemetry` sample saw: the most messages
+    waiting in a queue, the fewest consumers on a queue with messages waiting, and the most
+    transformer restarts.
+    '''
+    totals = {c: None for c in phase_columns}
+
+    def add(column, value):
+        if value is not None:
+            totals[column] = (totals[column] or 0) + value
+
+    def worst(column, value, fn=max):
+        if value is not None:
+            totals[column] = value if totals[column] is None else fn(totals[column], value)
+
+    for r in records:
+        if label is not None and r.get('label') != label:
+            continue
+        if r['kind'] == 'request':
+            add('Submit Time', r.get('submit_seconds'))
+            add('Time To First File', r.get('first_file_seconds'))
+            add('Time To Last File', r.get('last_file_seconds'))
+            add('Transform Time', r.get('transform_seconds'))
+            add('Download Bytes', r.get('download_bytes'))
+            add('Download Time', r.get('download_seconds'))
+            add('Decode Time', r.get('decode_seconds'))
+        elif r['kind'] == 'merge':
+            add('Merge Time', r.get('seconds'))
+        elif r['kind'] == 'setup':
+            add('Cluster Setup Time', r.get('seconds'))
+        elif r['kind'] == 'telemetry':
+            for q in r.get('queues', []):
+                worst('Peak Queue Depth', q['messages'])
+                if q['messages'] > 0:
+                    worst('Min Queue Consumers', q['consumers'], min)
+            if 'pods' in r:
+                worst('Transformer Restarts', sum(p.get('restarts', 0) for p in r['pods']))
+    return totals
@@ -0,0 +1,124 @@
+# The client side of the tests (submit, polling, download, decode, merge) run against the fake
+# backend in tests/fake_backend.py, so they work without a cluster. They are also a repeatable
+# benchmark of that path: `pytest tests/test_fake_backend.py --durations=0`.
+from tests.config import fake_backend  # noqa
+from tests.fake_backend import fake_servicex
+from tests.result_cache import ResultCache, request_cache_key
+from tests.servicex_test_utils import get_servicex_data, is_request_done, iter_servicex_data, submit_servicex_request
+import pytest
+import time
+
+
+def jet_request(result_format: str = 'root-file') -> dict:
+    return {
+        "did": "mc15_13TeV:fake",
+        "selection": "(call ResultTTree (call Select (call SelectMany (call EventDataset (list 'localds:bogus')) (lambda (list e) (call (attr e 'Jets') 'AntiKt4EMTopoJets'))) (lambda (list j) (/ (call (attr j 'pt')) 1000.0))) (list 'JetPt') 'analysis' 'junk.root')",
+        "image": "fake",
+        "result-destination": "object-store",
+        "result-format": result_format,
+        "chunk-size": 1000,
+        "workers": 2
+    }
+
+
+@pytest.fixture()
+def empty_cache(tmp_path):
+    'Keep the fake results out of the real result cache'
+    return ResultCache(str(tmp_path / 'cache'))
+
+
+def test_fake_root_results(fake_backend, empty_cache):
+    'ROOT result files are downloaded, decoded and merged'
+    table = get_servicex_data(fake_backend.servicex_address, jet_request(), ignore_cache=True, cache=empty_cache)
+    assert len(table) == fake_backend.n_files * fake_backend.rows_per_file
+
+
+def test_fake_parquet_results(fake_backend, empty_cache):
+    'Parquet result files are downloaded, decoded and merged'
+    table = get_servicex_data(fake_backend.servicex_address, jet_request('parquet'), as_data_type='awkward',
+                              ignore_cache=True, cache=empty_cache)
+    assert len(table[b'JetPt']) == fake_backend.n_files * fake_backend.rows_per_file
+
+
+def test_fake_results_while_transform_runs(empty_cache):
+    'The first files are read while the rest are still being made'
+    with fake_servicex(n_files=6, rows_per_file=100, file_delay=0.2, workers=1) as backend:
+        sizes = []
+        arrived = []
+        for t in iter_servicex_data(backend.servicex_address, jet_request('parquet'), ignore_cache=True, cache=empty_cache):
+            arrived.append(time.time())
+            sizes.append(len(t))
+        transform, = backend.transforms.values()
+    assert sizes == [100] * 6
+    assert arrived[0] < transform.completed_at
+
+
+def test_fake_failures(empty_cache):
+    'Failed files are skipped, and failed status and download calls are retried'
+    with fake_servicex(n_files=8, rows_per_file=100, fail_files=2, status_error_rate=0.2,
+                       object_error_rate=0.2, file_delay=0.05, seed=3) as backend:
+        table = get_servicex_data(backend.servicex_address, jet_request('parquet'), ignore_cache=True, cache=empty_cache)
+    assert len(table) == 6 * 100
+    assert backend.n_status_errors + backend.n_object_errors > 0
+
+
+def test_fake_refresh_replaces_cache(empty_cache):
+    'Running a request again (ignoring the cache) replaces what was cached for it'
+    request = jet_request('parquet')
+    for n_files in [2, 3]:
+        with fake_servicex(n_files=n_files, rows_per_file=100) as backend:
+            get_servicex_data(backend.servicex_address, request, ignore_cache=True, cache=empty_cache)
+    assert len(empty_cache.lookup(request_cache_key(request))) == 3
+
+
+def test_fake_skipped_files_not_cached(empty_cache):
+    'A transform that skipped files does not leave an entry in the cache'
+    request = jet_request('parquet')
+    with fake_servicex(n_files=4, rows_per_file=100, fail_files=1) as backend:
+        get_servicex_data(backend.servicex_address, request, ignore_cache=True, cache=empty_cache)
+    assert empty_cache.lookup(request_cache_key(request)) is None
+
+
+def test_fake_results_not_stored(fake_backend, empty_cache, tmp_path):
+    'With store_in_cache=False the results are decoded straight from memory and nothing is cached'
+    request = jet_request('parquet')
+    table = get_servicex_data(fake_backend.servicex_address, request, ignore_cache=True, cache=empty_cache,
+                              store_in_cache=False)
+    assert len(table) == fake_backend.n_files * fake_backend.rows_per_file
+    assert empty_cache.lookup(request_cache_key(request)) is None
+    assert not (tmp_path / 'cache').exists() or list((tmp_path / 'cache').iterdir()) == []
+
+
+def test_fake_status_gives_up():
+    'A status endpoint that keeps failing gives an error naming the request once the retries run out'
+    with fake_servicex(status_error_rate=1.0) as backend:
+        request_id = submit_servicex_request(backend.servicex_address, jet_request())
+        with pytest.raises(BaseException, match=f'Status request for {request_id} failed after retrying'):
+            is_request_done(backend.servicex_address, request_id)
+
+
+def test_fake_telemetry_from_submit(empty_cache, monkeypatch):
+    'Backend telemetry is sampled from the moment a batch request is submitted, not from its first file'
+    import tests.backend_telemetry as telemetry
+    import tests.config as config
+    from tests.servicex_async import TransformBatch
+    from tests.servicex_timing import recorded
+    monkeypatch.setattr(telemetry, 'telemetry_enabled', True)
+    monkeypatch.setattr(telemetry, 'default_telemetry_interval', 0.05)
+    monkeypatch.setattr(telemetry, 'get_queue_stats', lambda *args: [])
+    monkeypatch.setattr(config, 'get_pod_status', lambda prefix: [])
+
+    with fake_servicex(n_files=2, rows_per_file=100, file_delay=1.0, workers=1) as backend:
+        batch = TransformBatch(backend.servicex_address, ignore_cache=True)
+        batch.add('jets', jet_request('parquet'),
+                  lambda address, request_json, request_id: get_servicex_data(address, request_json, request_id=request_id,
+                                                                              cache=empty_cache))
+        batch.start()
+        assert len(batch.result('jets', timeout=60)) == 200
+        transform, = backend.transforms.values()
+
+    # The first file takes a second to make - the loader only starts after that.
+    samples = [r['time'] for r in recorded('telemetry') if r['request_id'] == transform.request_id]
+    assert len(samples) > 0
+    assert min(samples) < transform.submitted + 0.5
+    assert transform.request_id not in telemetry._request_samplers
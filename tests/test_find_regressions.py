@@ -0,0 +1,53 @@
+# The regression check of scripts/find_regressions.py on made up series of timings.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from find_regressions import check_series  # noqa: E402
+
+_noisy = [10.0, 10.4, 9.7, 10.1, 9.9, 10.3, 9.8, 10.2, 10.0, 9.6]
+
+
+@pytest.mark.parametrize('values, smaller_is_worse, regressed', [
+    # Nothing changes at all, or only by noise.
+    ([10.0] * 13, False, False),
+    (_noisy + [10.1, 9.9, 10.2], False, False),
+    # A step up of 50% - well above the noise and min_change.
+    (_noisy + [15.0, 15.2, 14.9], False, True),
+    # A step up of 5% on a steady baseline - clearly real, but below min_change.
+    ([10.0] * 10 + [10.5, 10.5, 10.5], False, False),
+    # A step up of 20% on a steady baseline - above min_change.
+    ([10.0] * 10 + [12.0, 12.0, 12.0], False, True),
+    # Only one of the recent runs is slow - the median of them is not.
+    (_noisy + [10.1, 30.0, 9.9], False, False),
+    # A rate that drops is a regression, one that goes up is not.
+    (_noisy + [5.0, 5.1, 4.9], True, True),
+    (_noisy + [15.0, 15.2, 14.9], True, False),
+    # Fewer values than the window - the baseline is whatever there is before the recent ones.
+    ([10.0, 10.2, 9.9, 15.0, 15.1, 14.8], False, True),
+    # Too short to have a baseline at all.
+    ([10.0, 10.2, 15.0, 15.1, 14.8], False, False),
+])
+def test_check_series(values, smaller_is_worse, regressed):
+    r = check_series(values, window=10, recent=3, threshold=4.0, min_change=0.1, smaller_is_worse=smaller_is_worse)
+    assert (r is not None) == regressed
+    if r is not None:
+        assert r['n_baseline'] == min(10, len(values) - 3)
+        assert r['change'] >= 0.1
+
+
+def test_check_series_report():
+    'The report gives the medians as they are, even for series where smaller is worse'
+    r = check_series(_noisy + [5.0, 5.1, 4.9], window=10, recent=3, threshold=4.0, min_change=0.1, smaller_is_worse=True)
+    assert r['baseline'] == pytest.approx(10.0)
+    assert r['latest'] == pytest.approx(5.0)
+    assert r['change'] == pytest.approx(0.5)
+
+
+def test_check_series_window():
+    'Only the last `window` values before the recent ones make the baseline'
+    values = [20.0] * 30 + [10.0] * 10 + [12.0, 12.0, 12.0]
+    assert check_series(values, window=10, recent=3, threshold=4.0, min_change=0.1)['baseline'] == 10.0
+    assert check_series(values, window=40, recent=3, threshold=4.0, min_change=0.1) is None
@@ -0,0 +1,88 @@
+# Staging of the xrootd input files (tests/input_staging.py) against a local http server, so
+# the resume and checksum handling can be checked without the grid.
+import hashlib
+import os
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import tests.input_staging as staging
+from tests.input_staging import input_file, stage_inputs
+
+_content = os.urandom(3 * 1024 ** 2 + 17)
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    'Serves _content at any path, honouring "Range: bytes=N-"'
+    sent = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        start = 0
+        if 'Range' in self.headers:
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+        if start >= len(_content):
+            self.send_response(416)
+            self.end_headers()
+            return
+        self.send_response(206 if start > 0 else 200)
+        self.send_header('Content-Length', str(len(_content) - start))
+        self.end_headers()
+        self.wfile.write(_content[start:])
+        _RangeHandler.sent += len(_content) - start
+
+
+@pytest.fixture()
+def file_server():
+    server = ThreadingHTTPServer(('localhost', 0), _RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    _RangeHandler.sent = 0
+    yield f'http://localhost:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_stage_once(file_server, tmp_path):
+    'Files are fetched in parallel, checked, and not fetched again the next time'
+    files = [input_file(f'{file_server}/f{i}.root', checksum=f'adler32:{zlib.adler32(_content):08x}') for i in range(3)]
+    report = stage_inputs(files, str(tmp_path))
+    assert report['fetched_bytes'] == 3 * len(_content)
+    assert report['bytes_per_second'] > 0
+    assert all(open(s['path'], 'rb').read() == _content for s in report['files'])
+
+    again = stage_inputs(files, str(tmp_path))
+    assert again['fetched_bytes'] == 0
+    assert _RangeHandler.sent == 3 * len(_content)
+
+
+def test_stage_resumes(file_server, tmp_path):
+    'A partly fetched file is finished off rather than fetched again'
+    with open(tmp_path / 'f.root.part', 'wb') as f:
+        f.write(_content[:1000])
+    report = stage_inputs([input_file(f'{file_server}/f.root', checksum=f'md5:{hashlib.md5(_content).hexdigest()}')],
+                          str(tmp_path))
+    assert report['fetched_bytes'] == len(_content) - 1000
+    assert open(tmp_path / 'f.root', 'rb').read() == _content
+
+
+def test_stage_bad_checksum(file_server, tmp_path):
+    'A file that does not match its checksum is thrown away'
+    with pytest.raises(BaseException, match='is bad'):
+        stage_inputs([input_file(f'{file_server}/f.root', checksum='adler32:00000001')], str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_stage_grid_needs_proxy(file_server, tmp_path, monkeypatch):
+    'Grid files are only fetched with a grid proxy'
+    monkeypatch.setattr(staging, 'default_grid_proxy', str(tmp_path / 'no-proxy'))
+    with pytest.raises(AssertionError, match='No grid proxy'):
+        stage_inputs([input_file(f'{file_server}/f.root', grid=True)], str(tmp_path / 'cache'))
+
+    (tmp_path / 'proxy').write_text('proxy')
+    monkeypatch.setattr(staging, 'default_grid_proxy', str(tmp_path / 'proxy'))
+    report = stage_inputs([input_file(f'{file_server}/f.root', grid=True)], str(tmp_path / 'cache'))
+    assert report['fetched_bytes'] == len(_content)
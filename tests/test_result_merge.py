@@ -0,0 +1,112 @@
+# The in-place merge of per-file tables (tests/result_merge.py), checked against what pandas
+# and awkward make of the same tables when they concatenate them.
+import awkward
+import numpy as np
+import pandas
+import pytest
+
+from tests.result_merge import TableMerger
+from tests.servicex_test_utils import decode_result
+
+
+def merged(tables, as_data_type: str = 'pandas', expected_rows: int = None):
+    merger = TableMerger(as_data_type, expected_rows=expected_rows)
+    for t in tables:
+        merger.add(t)
+    return merger.result()
+
+
+def parquet_file(columns, row_group_size: int = None) -> bytes:
+    import io
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    buffer = io.BytesIO()
+    pq.write_table(pa.table(columns), buffer, row_group_size=row_group_size)
+    return buffer.getvalue()
+
+
+def jagged(counts, content):
+    return awkward.JaggedArray.fromcounts(np.array(counts, dtype=np.int64), np.array(content))
+
+
+def test_merge_single_table_untouched():
+    'One table comes back as it is'
+    df = pandas.DataFrame({'a': [1, 2, 3]})
+    assert merged([df]) is df
+
+
+@pytest.mark.parametrize('expected_rows', [None, 5, 1000])
+def test_merge_pandas_mixed_int_float(expected_rows):
+    'An int column that later arrives as float is promoted, as concat does'
+    tables = [pandas.DataFrame({'a': np.arange(3, dtype=np.int64), 'b': np.arange(3, dtype=np.float32)}),
+              pandas.DataFrame({'a': np.array([0.5, 1.5]), 'b': np.array([7.0, 8.0], dtype=np.float32)}),
+              pandas.DataFrame({'a': np.arange(4, dtype=np.int64), 'b': np.ones(4, dtype=np.float32)})]
+    pandas.testing.assert_frame_equal(merged(tables, expected_rows=expected_rows),
+                                      pandas.concat(tables, ignore_index=True))
+
+
+def test_merge_pandas_many_tables():
+    'Lots of small tables make the output columns grow several times'
+    tables = [pandas.DataFrame({'a': np.arange(i, dtype=np.int64) + i}) for i in range(1, 60)]
+    pandas.testing.assert_frame_equal(merged(tables), pandas.concat(tables, ignore_index=True))
+
+
+def test_merge_pandas_multiindex():
+    'The (entry, subentry) index uproot makes for jagged branches is kept'
+    def frame(entries, subentries, values):
+        index = pandas.MultiIndex.from_arrays([np.array(entries), np.array(subentries)], names=['entry', 'subentry'])
+        return pandas.DataFrame({'JetPt': np.array(values)}, index=index)
+    tables = [frame([0, 0, 1], [0, 1, 0], [1.0, 2.0, 3.0]),
+              frame([0, 2, 2, 2], [0, 0, 1, 2], [4.0, 5.0, 6.0, 7.0])]
+    pandas.testing.assert_frame_equal(merged(tables), pandas.concat(tables))
+
+
+def test_merge_pandas_empty_tables():
+    'Empty tables (files with no events) do not change the result'
+    full = pandas.DataFrame({'a': np.arange(5, dtype=np.int64), 'b': np.linspace(0, 1, 5)})
+    empty = full.iloc[0:0]
+    tables = [empty, full, empty, full]
+    pandas.testing.assert_frame_equal(merged(tables), pandas.concat(tables, ignore_index=True))
+
+
+def test_merge_awkward_jagged():
+    'Jagged columns (and doubly jagged ones) merge like awkward.concatenate, flat ones like numpy'
+    tables = [{b'JetPt': jagged([2, 0, 1], [1.0, 2.0, 3.0]),
+               b'n': np.array([1, 2, 3], dtype=np.int64),
+               b'Nested': awkward.JaggedArray.fromcounts([1, 1], jagged([2, 1], [1, 2, 3]))},
+              {b'JetPt': jagged([0, 3], [4.0, 5.0, 6.0]),
+               b'n': np.array([0.5, 1.5]),
+               b'Nested': awkward.JaggedArray.fromcounts([0, 2], jagged([0, 1], [4]))},
+              {b'JetPt': jagged([], []),
+               b'n': np.array([], dtype=np.int64),
+               b'Nested': awkward.JaggedArray.fromcounts([], jagged([], np.array([], dtype=np.int64)))}]
+    result = merged(tables, 'awkward')
+    for name in [b'JetPt', b'Nested']:
+        assert result[name].tolist() == awkward.concatenate([t[name] for t in tables]).tolist()
+    np.testing.assert_array_equal(result[b'n'], np.concatenate([t[b'n'] for t in tables]))
+    assert result[b'n'].dtype == np.float64
+
+
+def test_merge_awkward_parquet_jagged():
+    'List columns from parquet (nullable, so their content is masked) merge across files'
+    import pyarrow as pa
+    files = [parquet_file({'JetPt': pa.array([[1.0, None], [], [3.0]], pa.list_(pa.float64())), 'n': [1, 2, 3]}),
+             parquet_file({'JetPt': pa.array([[4.0], [5.0, 6.0]], pa.list_(pa.float64())), 'n': [4, 5]})]
+    result = merged([decode_result(f, 'awkward') for f in files], 'awkward')
+    assert result[b'JetPt'].tolist() == [[1.0, None], [], [3.0], [4.0], [5.0, 6.0]]
+    np.testing.assert_array_equal(result[b'n'], [1, 2, 3, 4, 5])
+
+
+@pytest.mark.parametrize('sizes, row_group_size', [([7, 3], 2), ([5, 0, 7], None)])
+def test_merge_awkward_parquet_chunked(sizes, row_group_size):
+    'Files written in several row groups, and empty files, decode to one array per column'
+    import pyarrow as pa
+
+    def column(start, size):
+        return {'JetPt': pa.array([[float(i)] * (i % 3) for i in range(start, start + size)], pa.list_(pa.float64())),
+                'n': pa.array(range(start, start + size), pa.int64())}
+    starts = np.cumsum([0] + sizes[:-1])
+    files = [parquet_file(column(start, size), row_group_size) for start, size in zip(starts, sizes)]
+    result = merged([decode_result(f, 'awkward') for f in files], 'awkward')
+    assert result[b'JetPt'].tolist() == [[float(i)] * (i % 3) for i in range(sum(sizes))]
+    np.testing.assert_array_equal(result[b'n'], np.arange(sum(sizes)))
@@ -0,0 +1,91 @@
+# The open-loop arrival profiles and per-interval summaries of scripts/servicex_swarm.py. These
+# need nothing running - no ServiceX, and no swarm - but the script does need typer, which is not
+# in requirements.txt.
+import os
+import statistics
+import sys
+
+import pytest
+
+pytest.importorskip('typer')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from servicex_swarm import SwarmRun, arrival_times, summarise_intervals  # noqa: E402
+
+
+def gaps(times):
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def test_arrivals_constant():
+    'Evenly spaced at the rate asked for, starting straight away'
+    assert arrival_times('constant', 5, 4.0) == pytest.approx([0.0, 0.25, 0.5, 0.75, 1.0])
+
+
+def test_arrivals_poisson():
+    'Seeded poisson arrivals are repeatable, and average the rate asked for'
+    times = arrival_times('poisson', 2000, 5.0, seed=3)
+    assert len(times) == 2000
+    assert times[0] == 0.0
+    assert times == arrival_times('poisson', 2000, 5.0, seed=3)
+    assert times != arrival_times('poisson', 2000, 5.0, seed=4)
+    assert all(g > 0 for g in gaps(times))
+    assert statistics.mean(gaps(times)) == pytest.approx(1 / 5.0, rel=0.1)
+
+
+def test_arrivals_ramp():
+    'The rate climbs to end_rate over ramp_seconds and then holds'
+    times = arrival_times('ramp', 200, 1.0, end_rate=10.0, ramp_seconds=20.0)
+    g = gaps(times)
+    assert all(b <= a for a, b in zip(g, g[1:]))
+    assert g[0] == pytest.approx(1.0)
+    assert all(x == pytest.approx(0.1) for x, t in zip(g, times) if t >= 20.0)
+
+
+def test_arrivals_ramp_down():
+    'A ramp can go down as well'
+    g = gaps(arrival_times('ramp', 50, 10.0, end_rate=2.0, ramp_seconds=5.0))
+    assert all(b >= a for a, b in zip(g, g[1:]))
+    assert g[-1] == pytest.approx(0.5)
+
+
+def test_arrivals_step():
+    'The rate goes up by step_rate every step_seconds'
+    times = arrival_times('step', 30, 2.0, step_seconds=5.0, step_rate=2.0)
+    for t, g in zip(times, gaps(times)):
+        assert g == pytest.approx(1 / (2.0 + 2.0 * (t // 5.0)))
+
+
+def run(arrivals, finished, statuses, latencies):
+    return SwarmRun(statuses=statuses, timings=[None if q is None else {'query_seconds': q} for q in latencies],
+                    released=0.0, arrivals=arrivals, finished=finished)
+
+
+def test_intervals_bucketing():
+    'Jobs are counted in the interval they were sent and the one they finished in'
+    rows = summarise_intervals(run(arrivals=[0.0, 1.0, 2.0, 11.0, 12.0],
+                                   finished=[3.0, 12.0, 5.0, 25.0, None],
+                                   statuses=['ok', 'ok', 'failed', 'ok', 'running'],
+                                   latencies=[3.0, 11.0, None, 14.0, None]), 10.0)
+    assert [r['start_seconds'] for r in rows] == [0.0, 10.0, 20.0]
+    assert [r['sent'] for r in rows] == [3, 2, 0]
+    assert [r['finished'] for r in rows] == [2, 1, 1]
+    assert [r['ok'] for r in rows] == [1, 1, 1]
+    assert [r['jobs_per_second'] for r in rows] == pytest.approx([0.1, 0.1, 0.1])
+    assert [r['p50'] for r in rows] == [3.0, 11.0, 14.0]
+    # Sent by the end of the interval, and not finished by then.
+    assert [r['outstanding'] for r in rows] == [1, 2, 1]
+
+
+def test_intervals_percentiles():
+    'The latencies of the ok jobs that finished in an interval make its percentiles'
+    rows = summarise_intervals(run(arrivals=[0.0] * 5, finished=[1.0, 2.0, 3.0, 4.0, 5.0],
+                                   statuses=['ok'] * 5, latencies=[1.0, 2.0, 3.0, 4.0, 5.0]), 10.0)
+    assert len(rows) == 1
+    assert rows[0]['p50'] == 3.0
+    assert rows[0]['p90'] == pytest.approx(4.6)
+    assert rows[0]['outstanding'] == 0
+
+
+def test_intervals_closed_loop():
+    'A closed-loop run has no arrival times, so nothing to bucket'
+    assert summarise_intervals(SwarmRun(statuses=['ok'], timings=[None], released=0.0), 10.0) == []